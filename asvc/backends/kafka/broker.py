@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import asyncio
-from typing import TYPE_CHECKING, Any
+import re
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
 
 import aiokafka
 
@@ -13,10 +15,37 @@ from .settings import KafkaSettings
 if TYPE_CHECKING:
     from asvc import CloudEvent, Consumer, Service
 
+# header with number of previous deliveries, for messages republished for retry
+DELIVERY_COUNT_HEADER = "x-delivery-count"
+# header with unix time (in milliseconds) of retry, for messages republished for retry
+RETRY_AT_HEADER = "x-retry-at"
+# not allowed in topic names
+_UNSAFE_TOPIC_CHARS = re.compile(r"[^a-zA-Z0-9._-]")
+
+
+def get_retry_topic(topic: str, group: str) -> str:
+    """Return topic of retried messages of consumer group"""
+    return _UNSAFE_TOPIC_CHARS.sub("_", f"{topic}.{group}.retry")
+
+
+def get_retry_at(message: aiokafka.ConsumerRecord) -> float:
+    """Return unix time (in seconds) message should be retried at, 0 if not retried"""
+    for key, value in message.headers or ():
+        if key == RETRY_AT_HEADER:
+            return int(value) / 1000
+    return 0.0
+
 
 class KafkaBroker(Broker[aiokafka.ConsumerRecord]):
     """
-    Kafka backend
+    Kafka backend. Nacked messages are republished to retry topic of the consumer
+    group (`<topic>.<service>_<consumer>.retry`, see `get_retry_topic`, must exist
+    or be created automatically) with incremented `x-delivery-count` header
+    and `x-retry-at` time, so the consumer commits past them and other groups
+    do not receive them again. The group consumes its retry topic too, partition
+    of the retry topic is paused until its next message is due.
+    Messages which could not be republished are redelivered by seeking back
+    to their offset, together with messages after them in the batch.
     :param bootstrap_servers: url or list of kafka servers
     :param publisher_options: extra options for AIOKafkaProducer
     :param consumer_options: extra options (defaults) for AIOKafkaConsumer
@@ -40,9 +69,25 @@ class KafkaBroker(Broker[aiokafka.ConsumerRecord]):
         self._publisher_options = publisher_options or {}
         self._consumer_options = consumer_options or {}
         self._publisher = None
+        # ids of nacked records not republished, redelivered by seeking back
+        self._unsettled: set[int] = set()
+        # retry topics of records being handled, by record id
+        self._retry_topics: dict[int, str] = {}
 
     def parse_incoming_message(self, message: aiokafka.ConsumerRecord) -> Any:
-        return self.encoder.decode(message.value)
+        # headers of other producers may hold arbitrary bytes (or no value)
+        headers = {
+            k: v.decode(errors="replace")
+            for k, v in message.headers or ()
+            if v is not None
+        }
+        return self.decode_message(message.value, headers)
+
+    def get_delivery_count(self, message: aiokafka.ConsumerRecord) -> int:
+        for key, value in message.headers or ():
+            if key == DELIVERY_COUNT_HEADER:
+                return int(value) + 1
+        return 1
 
     @property
     def is_connected(self) -> bool:
@@ -50,26 +95,80 @@ class KafkaBroker(Broker[aiokafka.ConsumerRecord]):
 
     async def _start_consumer(self, service: Service, consumer: Consumer) -> None:
         handler = self.get_handler(service, consumer)
+        group = f"{service.name}:{consumer.name}"
+        retry_topic = get_retry_topic(consumer.topic, group)
         subscriber = aiokafka.AIOKafkaConsumer(
             consumer.topic,
-            group_id=f"{service.name}:{consumer.name}",
+            retry_topic,
+            group_id=group,
             bootstrap_servers=self.bootstrap_servers,
             enable_auto_commit=False,
             **consumer.options.get("kafka_consumer_options", self._consumer_options),
         )
         await subscriber.start()
-        while self._stopped:
-            result = await subscriber.getmany(
-                timeout_ms=consumer.options.get("timeout_ms", 600)
-            )
-            for tp, messages in result.items():
-
-                if messages:
-                    tasks: list[asyncio.Task] = [
-                        asyncio.create_task(handler(message)) for message in messages  # type: ignore
-                    ]
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                    await subscriber.commit({tp: messages[-1].offset + 1})
+        # scheduled resumes of paused partitions
+        resumes: dict[aiokafka.TopicPartition, asyncio.TimerHandle] = {}
+        try:
+            while self.is_consuming:
+                result = await subscriber.getmany(
+                    timeout_ms=consumer.options.get("timeout_ms", 600)
+                )
+                if not self.is_consuming:
+                    # draining, fetched messages are not committed and will be redelivered
+                    break
+                for tp, messages in result.items():
+                    if messages:
+                        resume = await self._handle_batch(
+                            subscriber, handler, tp, messages, retry_topic
+                        )
+                        if resume is not None:
+                            resumes[tp] = resume
+        finally:
+            for handle in resumes.values():
+                handle.cancel()
+            await subscriber.stop()
+
+    async def _handle_batch(
+        self,
+        subscriber: aiokafka.AIOKafkaConsumer,
+        handler: Callable[[aiokafka.ConsumerRecord], Awaitable[Any]],
+        tp: aiokafka.TopicPartition,
+        messages: list[aiokafka.ConsumerRecord],
+        retry_topic: str,
+    ) -> asyncio.TimerHandle | None:
+        """
+        Handle due records of a partition concurrently and commit past them,
+        if a record is not due yet the partition is paused until it is
+        :return: handle of scheduled partition resume
+        """
+        now = time.time()
+        ready = messages
+        for i, message in enumerate(messages):
+            if get_retry_at(message) > now:
+                ready = messages[:i]
+                break
+        for message in ready:
+            self._retry_topics[id(message)] = retry_topic
+        await asyncio.gather(
+            *(handler(message) for message in ready), return_exceptions=True
+        )
+        for message in ready:
+            self._retry_topics.pop(id(message), None)
+        unsettled = [m for m in ready if id(m) in self._unsettled]
+        self._unsettled.difference_update(id(m) for m in unsettled)
+        if not unsettled and len(ready) == len(messages):
+            await subscriber.commit({tp: messages[-1].offset + 1})
+            return None
+        stop = unsettled[0] if unsettled else messages[len(ready)]
+        if stop.offset > messages[0].offset:
+            await subscriber.commit({tp: stop.offset})
+        subscriber.seek(tp, stop.offset)
+        if unsettled:
+            return None
+        subscriber.pause(tp)
+        return asyncio.get_running_loop().call_later(
+            get_retry_at(stop) - now, subscriber.resume, tp
+        )
 
     async def _disconnect(self):
         if self._publisher:
@@ -96,16 +195,46 @@ class KafkaBroker(Broker[aiokafka.ConsumerRecord]):
         timestamp_ms: int | None = None,
         **kwargs: Any,
     ):
-        data = self.encoder.encode(message.dict())
+        data, message_headers = self.encode_message(message)
+        message_headers.update(headers or {})
         timestamp_ms = timestamp_ms or int(message.time.timestamp() * 1000)
         key = key or getattr(message, "key", message.id)
-        headers = headers or {}
-        headers.setdefault("Content-Type", self.encoder.CONTENT_TYPE)
         await self.publisher.send(
             topic=message.topic,
             value=data,
             key=key,
             partition=partition,
-            headers=headers,
+            headers=[(k, v.encode()) for k, v in message_headers.items()],
             timestamp_ms=timestamp_ms,
         )
+
+    async def _nack(
+        self, message: aiokafka.ConsumerRecord, delay: float | None = None
+    ) -> None:
+        retry_topic = self._retry_topics.get(id(message))
+        if retry_topic is None:
+            self._unsettled.add(id(message))
+            return
+        headers = [
+            (k, v)
+            for k, v in message.headers or ()
+            if k not in (DELIVERY_COUNT_HEADER, RETRY_AT_HEADER)
+        ]
+        headers.append(
+            (DELIVERY_COUNT_HEADER, str(self.get_delivery_count(message)).encode())
+        )
+        retry_at = int((time.time() + (delay or 0)) * 1000)
+        headers.append((RETRY_AT_HEADER, str(retry_at).encode()))
+        try:
+            await self.publisher.send_and_wait(
+                topic=retry_topic,
+                value=message.value,
+                key=message.key,
+                headers=headers,
+                timestamp_ms=message.timestamp,
+            )
+        except Exception as e:
+            self.logger.warning(
+                f"Republishing nacked message failed ({e!r}), seeking back to it"
+            )
+            self._unsettled.add(id(message))
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from pydantic import Field
+
+from asvc.broker import Broker
+from asvc.middleware import Middleware
+from asvc.models import CloudEvent
+from asvc.settings import BrokerSettings
+from asvc.utils.subjects import SubjectTrie
+
+if TYPE_CHECKING:
+    from asvc import Consumer, Service
+    from asvc.types import Encoder
+
+
+class InMemorySettings(BrokerSettings):
+    serialize: bool = Field(True, env="BROKER_SERIALIZE")
+    max_concurrency: int = Field(10, env="BROKER_MAX_CONCURRENCY")
+    max_pending: int = Field(0, env="BROKER_MAX_PENDING")
+
+
+class QueueGroup:
+    """Consumers sharing one queue, each message is delivered to one of them"""
+
+    __slots__ = ("name", "topic", "queue")
+
+    def __init__(self, name: str, topic: str, max_pending: int = 0) -> None:
+        self.name = name
+        self.topic = topic
+        self.queue: asyncio.Queue[InMemoryMessage] = asyncio.Queue(max_pending)
+
+
+@dataclass
+class InMemoryMessage:
+    data: bytes | CloudEvent
+    group: QueueGroup
+    headers: dict[str, str] | None = None
+    deliveries: int = 1
+    # acked or nacked, redeliveries are new messages
+    settled: bool = False
+
+
+class InMemoryBroker(Broker[InMemoryMessage]):
+    """
+    In-memory broker for in-process pipelines, local development and benchmarks.
+    Every queue group (service:consumer) receives each message once, messages are fanned out
+    to all groups subscribed to matching topic. Topics support NATS style wildcards,
+    `*` matches a single token, `>` one or more trailing tokens.
+    Messages are lost on process exit and not delivered to groups started after publishing.
+    :param serialize: encode and decode messages, with `False` events are passed
+        to consumers directly (as shallow copies, so event data must not be mutated)
+    :param max_concurrency: default number of messages handled concurrently by every
+        consumer, can be set per consumer with `max_concurrency` option
+    :param max_pending: max number of messages waiting in group queue, publishing to a full
+        queue waits for free space, unlimited by default
+    """
+
+    protocol = "in-memory"
+    Settings = InMemorySettings
+
+    def __init__(
+        self,
+        *,
+        encoder: Encoder | None = None,
+        middlewares: list[Middleware] | None = None,
+        serialize: bool = True,
+        max_concurrency: int = 10,
+        max_pending: int = 0,
+        **options: Any,
+    ) -> None:
+        super().__init__(encoder=encoder, middlewares=middlewares, **options)
+        self.serialize = serialize
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.groups: dict[str, QueueGroup] = {}
+        self._subjects: SubjectTrie[QueueGroup] = SubjectTrie()
+        self._timers: set[asyncio.Task] = set()
+        # queue.get() of workers waiting for messages, cancelled on drain
+        self._getters: set[asyncio.Future] = set()
+
+    @property
+    def is_connected(self) -> bool:
+        return not self._stopped
+
+    async def _connect(self) -> None:
+        pass
+
+    async def _stop_consumers(self) -> None:
+        for getter in self._getters:
+            getter.cancel()
+
+    async def _disconnect(self) -> None:
+        for task in self._timers:
+            task.cancel()
+        self._timers.clear()
+        self.groups.clear()
+        self._subjects = SubjectTrie()
+
+    def get_group(self, service: Service, consumer: Consumer) -> QueueGroup:
+        name = f"{service.name}:{consumer.name}"
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = QueueGroup(
+                name, consumer.topic, self.max_pending
+            )
+            self._subjects.insert(consumer.topic, group)
+        return group
+
+    def parse_incoming_message(self, message: InMemoryMessage) -> Any:
+        if isinstance(message.data, CloudEvent):
+            return message.data
+        return self.decode_message(message.data, message.headers)
+
+    async def _start_consumer(self, service: Service, consumer: Consumer) -> None:
+        group = self.get_group(service, consumer)
+        handler = self.get_handler(service, consumer)
+        concurrency = consumer.options.get("max_concurrency", self.max_concurrency)
+        await asyncio.gather(
+            *(self._worker(group, handler) for _ in range(concurrency))
+        )
+
+    async def _worker(
+        self,
+        group: QueueGroup,
+        handler: Callable[[InMemoryMessage], Awaitable[Any]],
+    ) -> None:
+        queue = group.queue
+        while self.is_consuming:
+            message = await self._get(queue)
+            if message is None:
+                return
+            if not self.is_consuming:
+                # draining started while waiting, leave the message in the queue
+                await self._put(message)
+                queue.task_done()
+                return
+            try:
+                await handler(message)
+            finally:
+                # not settled if handler failed, do not block join()
+                self._settle(message)
+
+    async def _get(
+        self, queue: asyncio.Queue[InMemoryMessage]
+    ) -> InMemoryMessage | None:
+        """Wait for next message, `None` if waiting was stopped on drain"""
+        getter = asyncio.ensure_future(queue.get())
+        self._getters.add(getter)
+        try:
+            # getter cancelled on drain ends the wait, instead of raising in the worker
+            await asyncio.wait((getter,))
+        finally:
+            self._getters.discard(getter)
+            getter.cancel()
+        return None if getter.cancelled() else getter.result()
+
+    def _settle(self, message: InMemoryMessage) -> None:
+        if not message.settled:
+            message.settled = True
+            message.group.queue.task_done()
+
+    async def _put(self, message: InMemoryMessage) -> None:
+        queue = message.group.queue
+        if queue.maxsize:
+            await queue.put(message)
+        else:
+            queue.put_nowait(message)
+
+    async def _publish(self, message: CloudEvent, **_: Any) -> None:
+        groups = self._subjects.match(message.topic)
+        if not groups:
+            return
+        if self.serialize:
+            data, headers = self.encode_message(message)
+            for group in groups:
+                await self._put(InMemoryMessage(data, group, headers))
+        else:
+            for group in groups:
+                await self._put(InMemoryMessage(message.copy(), group))
+
+    def get_delivery_count(self, message: InMemoryMessage) -> int:
+        return message.deliveries
+
+    async def _ack(self, message: InMemoryMessage) -> None:
+        self._settle(message)
+
+    async def _nack(self, message: InMemoryMessage, delay: int | None = None) -> None:
+        # settled by the redelivery, so join() waits for it
+        message.settled = True
+        redelivery = replace(message, deliveries=message.deliveries + 1, settled=False)
+        if delay:
+            task = asyncio.create_task(self._redeliver(message, redelivery, delay))
+            self._timers.add(task)
+            task.add_done_callback(self._timers.discard)
+        else:
+            await self._put(redelivery)
+            message.group.queue.task_done()
+
+    async def _redeliver(
+        self, message: InMemoryMessage, redelivery: InMemoryMessage, delay: float
+    ) -> None:
+        await asyncio.sleep(delay)
+        await self._put(redelivery)
+        message.group.queue.task_done()
+
+    async def join(self) -> None:
+        """Wait until all published messages are processed (acknowledged)"""
+        await asyncio.gather(*(g.queue.join() for g in list(self.groups.values())))
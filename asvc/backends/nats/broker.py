@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import asyncio
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Sequence
 
 import nats
 from nats.aio.msg import Msg as NatsMsg
+from nats.aio.subscription import Subscription
 from nats.js import JetStreamContext
 
 from asvc.broker import Broker
@@ -26,6 +27,7 @@ class NatsBroker(Broker[NatsMsg]):
     """
 
     protocol = "nats"
+    consumer_loop = False
 
     def __init__(
         self,
@@ -41,6 +43,7 @@ class NatsBroker(Broker[NatsMsg]):
         self.connection_options = connection_options or {}
         self._auto_flush = auto_flush
         self._nc = None
+        self._subscriptions: list[Subscription] = []
 
     @property
     def nc(self) -> nats.NATS:
@@ -49,14 +52,22 @@ class NatsBroker(Broker[NatsMsg]):
         return self._nc
 
     def parse_incoming_message(self, message: NatsMsg) -> Any:
-        return self.encoder.decode(message.data)
+        return self.decode_message(message.data, message.headers)
 
     async def _start_consumer(self, service: Service, consumer: Consumer) -> None:
-        await self.nc.subscribe(
+        subscription = await self.nc.subscribe(
             subject=consumer.topic,
             queue=consumer.name,
             cb=self.get_handler(service, consumer),
         )
+        self._subscriptions.append(subscription)
+
+    async def _stop_consumers(self) -> None:
+        # unsubscribe, messages already received are still processed
+        subscriptions, self._subscriptions = self._subscriptions, []
+        await asyncio.gather(
+            *(s.drain() for s in subscriptions), return_exceptions=True
+        )
 
     async def _disconnect(self) -> None:
         await self.nc.flush()
@@ -72,11 +83,23 @@ class NatsBroker(Broker[NatsMsg]):
 
     @retry_async(max_retries=3)
     async def _publish(self, message: CloudEvent, **kwargs) -> None:
-        data = self.encoder.encode(message.dict())
-        await self.nc.publish(message.topic, data, **kwargs)
+        data, headers = self.encode_message(message)
+        headers.update(kwargs.pop("headers", None) or {})
+        await self.nc.publish(message.topic, data, headers=headers, **kwargs)
         if self._auto_flush:
             await self.nc.flush()
 
+    @retry_async(max_retries=3)
+    async def _publish_batch(self, messages: Sequence[CloudEvent], **kwargs) -> None:
+        headers = kwargs.pop("headers", None) or {}
+        for message in messages:
+            data, message_headers = self.encode_message(message)
+            message_headers.update(headers)
+            await self.nc.publish(
+                message.topic, data, headers=message_headers, **kwargs
+            )
+        await self.nc.flush()
+
     @property
     def is_connected(self) -> bool:
         return self.nc.is_connected
@@ -94,6 +117,7 @@ class JetStreamBroker(NatsBroker):
     """
 
     Settings = JetStreamSettings
+    consumer_loop = True
 
     def __init__(
         self,
@@ -128,20 +152,23 @@ class JetStreamBroker(NatsBroker):
         stream: str | None = None,
         headers: dict[str, str] | None = None,
     ) -> None:
-        data = self.encoder.encode(message)
-        headers = headers or {}
-        headers.setdefault("Content-Type", self.encoder.CONTENT_TYPE)
+        data, message_headers = self.encode_message(message)
+        message_headers.update(headers or {})
         try:
             await self.js.publish(
                 subject=message.topic,
                 payload=data,
                 timeout=timeout,
                 stream=stream,
-                headers=headers,
+                headers=message_headers,
             )
         except Exception as e:
             raise PublishError from e
 
+    async def _publish_batch(self, messages: Sequence[CloudEvent], **kwargs) -> None:
+        # acks are awaited concurrently
+        await asyncio.gather(*(self._publish(m, **kwargs) for m in messages))
+
     async def _start_consumer(self, service: Service, consumer: Consumer) -> None:
         durable = f"{service.name}:{consumer.name}"
         subscription = await self.js.pull_subscribe(
@@ -153,19 +180,24 @@ class JetStreamBroker(NatsBroker):
         batch = consumer.options.get("prefetch_count", self.prefetch_count)
         timeout = consumer.options.get("fetch_timeout", self.fetch_timeout)
         try:
-            while not self._stopped:
+            while self.is_consuming:
                 try:
                     messages = await subscription.fetch(batch=batch, timeout=timeout)
+                    if not self.is_consuming:
+                        # draining, return fetched messages for redelivery
+                        await asyncio.gather(*(self._nack(m) for m in messages))
+                        break
                     tasks = [asyncio.create_task(handler(message)) for message in messages]  # type: ignore
                     await asyncio.gather(*tasks, return_exceptions=True)
                 except nats.errors.TimeoutError:
                     await asyncio.sleep(5)
-        except Exception:
-            self.logger.exception("Cancelling consumer")
         finally:
             if consumer.dynamic:
                 await subscription.unsubscribe()
 
+    def get_delivery_count(self, message: NatsMsg) -> int:
+        return message.metadata.num_delivered or 1
+
     async def _ack(self, message: NatsMsg) -> None:
         if not message._ackd:
             await message.ack()
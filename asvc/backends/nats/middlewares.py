@@ -1,29 +1,69 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+import asyncio
+import re
+from typing import TYPE_CHECKING, Any, Sequence
 
-from nats.js.errors import KeyNotFoundError
+from nats.js.errors import InvalidKeyError, KeyNotFoundError
 from nats.js.kv import KeyValue
 
 from asvc.backends.nats.broker import JetStreamBroker
-from asvc.middleware import Middleware
+from asvc.middlewares.dedup import DedupStore
+from asvc.middlewares.results import ResultMiddleware, StoredResult
 from asvc.utils.functools import retry_async
 
 if TYPE_CHECKING:
     from asvc.broker import Broker
     from asvc.consumer import Consumer
-    from asvc.models import CloudEvent
     from asvc.types import Encoder
 
+# allowed in K/V key tokens, "=" escapes other characters
+_KV_UNSAFE = re.compile(r"[^-/_a-zA-Z0-9]")
+
+
+def _escape(match: re.Match) -> str:
+    return "".join(f"={b:02X}" for b in match.group().encode())
+
+
+def kv_key(key: str) -> str:
+    """
+    Return valid K/V key for `<service>:<consumer>:<id>` key, ":" separated parts
+    are joined with "." and characters not allowed in keys are escaped as "=XX"
+    """
+    return ".".join(_KV_UNSAFE.sub(_escape, part) or "_" for part in key.split(":"))
 
-class NatsJetStreamResultMiddleware(Middleware):
-    def __init__(self, bucket: str, encoder: Encoder | None = None, **options: Any):
-        self.bucket = bucket
-        if encoder is None:
-            from asvc.encoders import get_default_encoder
 
-            encoder = get_default_encoder()
-        self.encoder = encoder
+class NatsJetStreamResultMiddleware(ResultMiddleware):
+    """
+    Stores consumer results in JetStream K/V bucket, waiters (`wait_for`) are notified
+    through one watch of the bucket
+    :param bucket: K/V bucket name
+    :param encoder: results encoder
+    :param cache_size: max number of results kept in local cache
+    :param batch_size: max number of results written at once (concurrently)
+    :param linger: max time (in seconds) to wait for more results to write at once
+    :param wait_for_write: wait until result is written before message is acked
+    :param options: K/V bucket config
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        encoder: Encoder | None = None,
+        cache_size: int = 1000,
+        batch_size: int = 100,
+        linger: float = 0.01,
+        wait_for_write: bool = True,
+        **options: Any,
+    ):
+        super().__init__(
+            encoder=encoder,
+            cache_size=cache_size,
+            batch_size=batch_size,
+            linger=linger,
+            wait_for_write=wait_for_write,
+        )
+        self.bucket = bucket
         self.options = options
         self._kv = None
 
@@ -43,26 +83,87 @@ class NatsJetStreamResultMiddleware(Middleware):
             self.logger.warning(f"Key {key} not found")
             return None
 
+    def get_key(self, consumer: Consumer | str, message_id: str) -> str:
+        return kv_key(super().get_key(consumer, message_id))
+
     async def get_message_result(
-        self, consumer_name: str, message_id: str
+        self, consumer_name: str, message_id: str, timeout: float | None = None
     ) -> Any | None:
-        # TODO: timeout
-        return await self.get(f"{consumer_name}:{message_id}")
+        """
+        Return stored result
+        :param timeout: wait for result up to `timeout` seconds if it is not stored yet
+        """
+        if timeout is not None:
+            return await self.wait_for(consumer_name, message_id, timeout)
+        return await self.get(self.get_key(consumer_name, message_id))
+
+    async def _get(self, key: str) -> bytes | None:
+        try:
+            entry = await self.kv.get(key)
+        except KeyNotFoundError:
+            return None
+        except InvalidKeyError:
+            self.logger.warning(f"Invalid result key {key}")
+            return None
+        return entry.value
+
+    async def _watch(self) -> None:
+        watcher = await self.kv.watchall(ignore_deletes=True)
+        self._watching.set()
+        try:
+            async for entry in watcher:
+                # None marks the end of current values
+                if entry is not None and entry.key in self._waiters and entry.value:
+                    self.notify(entry.key, entry.value)
+        finally:
+            await watcher.stop()
 
     async def after_broker_connect(self, broker: Broker) -> None:
         assert isinstance(broker, JetStreamBroker)
         self._kv = await broker.js.create_key_value(bucket=self.bucket, **self.options)
 
-    @retry_async(max_retries=3, backoff=10)
-    async def after_process_message(
-        self,
-        broker: JetStreamBroker,
-        consumer: Consumer,
-        message: CloudEvent,
-        result: Any | None = None,
-        exc: Exception | None = None,
-    ):
-        """Store message result in JetStream K/V Store"""
-        if exc is None and consumer.options.get("store_results"):
-            data = self.encoder.encode(result)
-            await self.kv.put(f"{consumer.name}:{message.id}", data)
+    async def write_many(self, results: list[StoredResult]) -> None:
+        await asyncio.gather(*(self.kv.put(key, data) for key, data, _ in results))
+
+
+class NatsKVDedupStore(DedupStore):
+    """
+    Deduplication store in JetStream K/V bucket, key expiration is set on the bucket
+    (`ttl` in seconds), lookups are sent concurrently. Keys are stored as `kv_key`
+    :param bucket: K/V bucket name
+    :param ttl: max age (in seconds) of bucket keys
+    """
+
+    def __init__(self, bucket: str = "dedup", ttl: float = 3600, **options: Any):
+        super().__init__()
+        self.bucket = bucket
+        self.ttl = ttl
+        self.options = options
+        self._kv: KeyValue | None = None
+
+    @property
+    def kv(self) -> KeyValue:
+        assert self._kv
+        return self._kv
+
+    async def connect(self, broker: Broker) -> None:
+        assert isinstance(broker, JetStreamBroker)
+        self._kv = await broker.js.create_key_value(
+            bucket=self.bucket, ttl=self.ttl, **self.options
+        )
+
+    async def _contains(self, key: str) -> bool:
+        try:
+            await self.kv.get(kv_key(key))
+        except KeyNotFoundError:
+            return False
+        except InvalidKeyError:
+            self.logger.warning(f"Invalid deduplication key {key}")
+            return False
+        return True
+
+    async def contains_many(self, keys: Sequence[str]) -> list[bool]:
+        return list(await asyncio.gather(*(self._contains(key) for key in keys)))
+
+    async def add_many(self, keys: Sequence[str], ttl: float) -> None:
+        await asyncio.gather(*(self.kv.put(kv_key(key), b"1") for key in keys))
@@ -41,7 +41,11 @@ class PubSubBroker(Broker[SubscriberMessage]):
         self._client = None
 
     def parse_incoming_message(self, message: SubscriberMessage) -> Any:
-        return self.encoder.decode(message.data)
+        return self.decode_message(message.data, message.attributes)
+
+    def get_delivery_count(self, message: SubscriberMessage) -> int:
+        # set only for subscriptions with dead letter policy
+        return message.delivery_attempt or 1
 
     async def _disconnect(self) -> None:
         await self.client.close()
@@ -70,9 +74,9 @@ class PubSubBroker(Broker[SubscriberMessage]):
         ordering_key: str | None = None,
         **kwargs,
     ) -> None:
+        data, attributes = self.encode_message(message)
         msg = PubsubMessage(
-            data=self.encoder.encode(message.dict()),
-            ordering_key=ordering_key or message.id,
+            data=data, ordering_key=ordering_key or message.id, **attributes
         )
         await self.client.publish(topic=message.topic, messages=[msg], timeout=timeout)
 
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import math
 from typing import TYPE_CHECKING, Any
 
 import aio_pika
 
 from asvc.broker import Broker
+from asvc.models import ContentMode
+from asvc.serialization import CE_PREFIX, is_binary
 
 from .settings import RabbitMQSettings
 
@@ -13,6 +16,18 @@ if TYPE_CHECKING:
     from asvc import CloudEvent, Consumer, Service
 
 
+def get_delay_bucket(delay: float) -> int:
+    """
+    Round delay (in seconds) up to at most 2 significant digits,
+    to limit the number of retry queues
+    """
+    seconds = max(math.ceil(delay), 1)
+    if seconds <= 10:
+        return seconds
+    step = 10 ** (len(str(seconds)) - 2)
+    return math.ceil(seconds / step) * step
+
+
 class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
     """
     RabbitMQ broker implementation, based on `aio_pika` library.
@@ -22,9 +37,14 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
     :param exchange_name: global exchange name
     :param connection_options: additional connection options passed to aio_pika.connect_robust
     :param kwargs: Broker base class parameters
+
+    Retried messages (nack with delay) are published to `<queue>.retry.<seconds>` queue
+    with message TTL, from which they are dead-lettered back to the consumer queue.
     """
 
     Settings = RabbitMQSettings
+    content_mode = ContentMode.binary
+    consumer_loop = False
 
     def __init__(
         self,
@@ -45,7 +65,11 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
         self.connection_options = connection_options or {}
         self._connection = None
         self._exchange = None
+        self._channel: aio_pika.abc.AbstractRobustChannel | None = None
+        self._queue_names: dict[str, str] = {}
+        self._retry_queues: set[str] = set()
         self._channels: list[aio_pika.abc.AbstractRobustChannel] = []
+        self._consumers: list[tuple[aio_pika.abc.AbstractRobustQueue, str]] = []
 
     @property
     def connection(self) -> aio_pika.RobustConnection:
@@ -59,7 +83,7 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
         self._connection = await aio_pika.connect_robust(
             self.url, **self.connection_options
         )
-        channel = await self.connection.channel()
+        channel = self._channel = await self.connection.channel()
         self._exchange = await channel.declare_exchange(
             name=self.exchange_name, type=aio_pika.ExchangeType.TOPIC, durable=True
         )
@@ -93,20 +117,28 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
         queue = await channel.declare_queue(name=queue_name, **options)
         await queue.bind(self._exchange, routing_key=consumer.topic)
         handler = self.get_handler(service, consumer)
-        await queue.consume(handler)
+        consumer_tag = await queue.consume(handler)
+        self._queue_names[consumer_tag] = queue_name
+        self._consumers.append((queue, consumer_tag))
         self._channels.append(channel)
 
+    async def _stop_consumers(self) -> None:
+        # cancel consumers, messages already delivered are still processed
+        consumers, self._consumers = self._consumers, []
+        await asyncio.gather(
+            *(queue.cancel(tag) for queue, tag in consumers), return_exceptions=True
+        )
+
     async def _publish(self, message: CloudEvent, **kwargs) -> None:
-        body = self.encoder.encode(message.data)
-        headers = kwargs.pop("headers", {})
-        headers.setdefault("X-Trace-ID", str(message.trace_id))
-        headers.setdefault("version", "1.0")
-        headers.setdefault("Content-Type", self.encoder.CONTENT_TYPE)
+        body, headers = self.encode_message(message)
+        if self.content_mode == ContentMode.binary:
+            headers["X-Trace-ID"] = str(message.trace_id)
+        headers.update(kwargs.pop("headers", None) or {})
         msg = aio_pika.Message(
             headers=headers,
             body=body,
             app_id=message.source,
-            content_type=message.content_type,
+            content_type=self.encoder.CONTENT_TYPE,
             timestamp=message.time,
             message_id=str(message.id),
             type=message.type,
@@ -116,13 +148,58 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
 
         await self.exchange.publish(msg, routing_key=message.topic, **kwargs)
 
+    def get_delivery_count(self, message: aio_pika.abc.AbstractIncomingMessage) -> int:
+        # x-death counts dead-lettering from retry queues, redelivered flag is set
+        # for messages requeued (or not acked before connection/channel closed)
+        deaths = (message.headers or {}).get("x-death") or []
+        count = 1 + sum(int(d.get("count", 1)) for d in deaths if isinstance(d, dict))
+        return count + 1 if message.redelivered else count
+
     async def _ack(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
-        await message.ack()
+        if not message.processed:
+            await message.ack()
 
     async def _nack(
         self, message: aio_pika.abc.AbstractIncomingMessage, delay: int | None = None
     ) -> None:
-        await message.reject(requeue=True)
+        if message.processed:
+            return
+        queue_name = self._queue_names.get(message.consumer_tag)  # type: ignore
+        if not delay or queue_name is None:
+            await message.reject(requeue=True)
+            return
+        retry_queue = await self._get_retry_queue(queue_name, delay)
+        await self._channel.default_exchange.publish(  # type: ignore
+            aio_pika.Message(
+                body=message.body,
+                headers=message.headers,
+                app_id=message.app_id,
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                timestamp=message.timestamp,
+                message_id=message.message_id,
+                type=message.type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=retry_queue,
+        )
+        await message.ack()
+
+    async def _get_retry_queue(self, queue_name: str, delay: float) -> str:
+        seconds = get_delay_bucket(delay)
+        name = f"{queue_name}.retry.{seconds}"
+        if name not in self._retry_queues:
+            await self._channel.declare_queue(  # type: ignore
+                name,
+                durable=True,
+                arguments={
+                    "x-message-ttl": seconds * 1000,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": queue_name,
+                },
+            )
+            self._retry_queues.add(name)
+        return name
 
     @property
     def is_connected(self) -> bool:
@@ -131,14 +208,18 @@ class RabbitmqBroker(Broker[aio_pika.abc.AbstractIncomingMessage]):
     def parse_incoming_message(
         self, message: aio_pika.abc.AbstractIncomingMessage
     ) -> Any:
-        return dict(
-            id=message.message_id,
-            trace_id=message.headers.get("X-Trace-ID"),
-            type=message.type,
-            data=self.encoder.decode(message.body),
-            source=message.app_id,
-            content_type=message.content_type,
-            version=message.headers.get("version", "1.0"),
-            time=message.timestamp,
-            topic=message.routing_key,
-        )
+        headers = message.headers or {}
+        if not is_binary(headers) and "X-Trace-ID" in headers:
+            # published by older versions, with event attributes as AMQP properties
+            headers = {
+                f"{CE_PREFIX}specversion": headers.get("version", "1.0"),
+                f"{CE_PREFIX}id": message.message_id,
+                f"{CE_PREFIX}traceid": headers["X-Trace-ID"],
+                f"{CE_PREFIX}type": message.type,
+                f"{CE_PREFIX}source": message.app_id,
+                f"{CE_PREFIX}time": message.timestamp,
+                f"{CE_PREFIX}subject": message.routing_key,
+                "Content-Type": message.content_type,
+                **headers,
+            }
+        return self.decode_message(message.body, headers)
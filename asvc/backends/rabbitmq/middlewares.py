@@ -1,22 +1,47 @@
 from __future__ import annotations
 
-from aio_pika import ExchangeType
+from typing import TYPE_CHECKING
 
 from asvc.backends.rabbitmq.broker import RabbitmqBroker
-from asvc.middleware import Middleware
+from asvc.dlq import get_replay_group
+from asvc.middlewares.dlq import DLQ_TOPIC, DeadLetterMiddleware
 
+if TYPE_CHECKING:
+    from asvc.broker import Broker
+    from asvc.models import CloudEvent
 
-class DeadLetterQueue(Middleware):
-    def __init__(self, dlx_name: str = "dlx") -> None:
+
+class DeadLetterQueue(DeadLetterMiddleware):
+    """
+    Dead letter middleware for RabbitMQ. Messages published to a topic exchange without
+    bound queue are dropped, so before dead-lettering to a new topic a durable
+    `dlq-replay:<topic>` queue (see `get_replay_group`) is declared and bound to it, the queue is consumed
+    by `asvc dlq replay`.
+    :param dlx_name: not used, kept for compatibility
+    """
+
+    def __init__(self, dlx_name: str = "dlx", **kwargs) -> None:
+        super().__init__(**kwargs)
         self.dlx_name = dlx_name
-        self._dlx_exchange = None
+        self._declared: set[str] = set()
 
-    async def after_broker_connect(self, broker: RabbitmqBroker) -> None:  # type: ignore[override]
-        # FIXME: implement properly
+    async def after_broker_connect(self, broker: Broker) -> None:
         assert isinstance(
             broker, RabbitmqBroker
         ), f"RabbitmqBroker instance expected, got {type(broker).__name__}"
-        channel = await broker.connection.channel()
-        self._dlx_exchange = await channel.declare_exchange(
-            name=self.dlx_name, type=ExchangeType.HEADERS, auto_delete=True
+        self._declared.clear()
+
+    async def declare_queue(self, broker: RabbitmqBroker, topic: str) -> None:
+        if topic in self._declared:
+            return
+        queue = await broker._channel.declare_queue(  # type: ignore
+            name=get_replay_group(topic), durable=True
         )
+        await queue.bind(broker.exchange, routing_key=topic)
+        self._declared.add(topic)
+
+    async def before_publish(
+        self, broker: Broker, message: CloudEvent, **kwargs
+    ) -> None:
+        if message.__dict__.get(DLQ_TOPIC) and isinstance(broker, RabbitmqBroker):
+            await self.declare_queue(broker, message.topic)
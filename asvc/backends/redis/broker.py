@@ -5,6 +5,8 @@ from typing import TYPE_CHECKING, Any
 import aioredis
 
 from asvc.broker import Broker
+from asvc.exceptions import ConfigurationError
+from asvc.models import ContentMode
 
 from .settings import RedisSettings
 
@@ -31,12 +33,17 @@ class RedisBroker(Broker[dict[str, str]]):
     ) -> None:
 
         super().__init__(**kwargs)
+        if self.content_mode == ContentMode.binary:
+            raise ConfigurationError(
+                "Redis PUB/SUB does not support headers, use structured content mode"
+            )
         self.url = url
         self.connect_options = connect_options or {}
         self._redis = None
 
     def parse_incoming_message(self, message: RawMessage) -> Any:
-        return message
+        # redis PUB/SUB does not support headers, always use default encoder
+        return self.decode_message(message["data"])
 
     @property
     def is_connected(self) -> bool:
@@ -46,7 +53,7 @@ class RedisBroker(Broker[dict[str, str]]):
         handler = self.get_handler(service, consumer)
         psub = self.redis.pubsub()
 
-        while True:
+        while self.is_consuming:
             message = await psub.get_message(ignore_subscribe_messages=True)
             if message:
                 await handler(message)
@@ -63,5 +70,5 @@ class RedisBroker(Broker[dict[str, str]]):
         self._redis = aioredis.from_url(url=self.url, **self.connect_options)
 
     async def _publish(self, message: CloudEvent, **kwargs) -> None:
-        data = self.encoder.encode(message)
+        data, _ = self.encode_message(message)
         await self.redis.publish(message.topic, data)
@@ -1,29 +1,41 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Sequence
 
 from aioredis import Redis
 
-from asvc import Middleware
+from asvc.middlewares.dedup import DedupStore
+from asvc.middlewares.ratelimit import RateLimitStore
+from asvc.middlewares.results import ResultMiddleware, StoredResult
 
 from ...utils.functools import retry_async
 
 if TYPE_CHECKING:
-    from asvc import Broker, CloudEvent, Consumer
+    from asvc import Broker, Consumer
     from asvc.types import Encoder
 
-    from .broker import RedisBroker
 
+class RedisResultMiddleware(ResultMiddleware):
+    """
+    Stores consumer results in Redis. Key of every stored result is published
+    to `channel`, waiters (`wait_for`) are notified through one Pub/Sub subscription
+    :param bucket: name used for notification channel (`<bucket>.results`)
+    :param encoder: results encoder
+    :param ttl: default time (in seconds) to keep results, `result_ttl` consumer option
+    :param options: `ResultMiddleware` params (local cache, write-behind batching)
+    """
 
-class RedisResultMiddleware(Middleware):
-    def __init__(self, bucket: str, encoder: Encoder | None = None, ttl: int = 3600):
+    def __init__(
+        self,
+        bucket: str,
+        encoder: Encoder | None = None,
+        ttl: int = 3600,
+        **options: Any,
+    ):
+        super().__init__(encoder=encoder, **options)
         self.bucket = bucket
-        if encoder is None:
-            from asvc.encoders import get_default_encoder
-
-            encoder = get_default_encoder()
-        self.encoder = encoder
         self.ttl = ttl
+        self.channel = f"{bucket}.results"
         self._redis: Redis | None = None
 
     @property
@@ -31,25 +43,148 @@ class RedisResultMiddleware(Middleware):
         assert self._redis
         return self._redis
 
-    async def after_broker_connect(self, broker: RedisBroker) -> None:  # type: ignore[override]
+    async def after_broker_connect(self, broker: Broker) -> None:
+        from .broker import RedisBroker
+
         assert isinstance(broker, RedisBroker)
         self._redis = broker.redis
 
-    @retry_async(max_retries=3, backoff=10)
-    async def after_process_message(
-        self,
-        broker: Broker,
-        consumer: Consumer,
-        message: CloudEvent,
-        result: Any | None = None,
-        exc: Exception | None = None,
-    ) -> None:
-        if exc is None and consumer.options.get("store_results"):
-            data = self.encoder.encode(result)
-            ttl = consumer.options.get("result_ttl", self.ttl)
-            await self.redis.set(f"{consumer.name}:{message.id}", data, ex=ttl)
+    def get_ttl(self, consumer: Consumer) -> int | None:
+        return consumer.options.get("result_ttl", self.ttl)
+
+    async def write_many(self, results: list[StoredResult]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        for key, data, ttl in results:
+            pipe.set(key, data, ex=ttl)
+        for key, _, _ in results:
+            pipe.publish(self.channel, key)
+        await pipe.execute()
+
+    async def _get(self, key: str) -> bytes | None:
+        return await self.redis.get(key)
+
+    async def _watch(self) -> None:
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._watching.set()
+        try:
+            async for notification in pubsub.listen():
+                if notification["type"] != "message":
+                    continue
+                key = notification["data"]
+                if isinstance(key, bytes):
+                    key = key.decode()
+                if key in self._waiters:
+                    data = await self._get(key)
+                    if data is not None:
+                        self.notify(key, data)
+        finally:
+            await pubsub.close()
 
     @retry_async(max_retries=3, backoff=5)
-    async def get_message_result(self, consumer_name: str, message_id: str):
-        value = await self.redis.get(f"{consumer_name}:{message_id}")
+    async def _get_message_result(self, consumer_name: str, message_id: str):
+        value = await self.redis.get(self.get_key(consumer_name, message_id))
         return self.encoder.decode(value)
+
+    async def get_message_result(
+        self, consumer_name: str, message_id: str, timeout: float | None = None
+    ):
+        """
+        Return stored result
+        :param timeout: wait for result up to `timeout` seconds if it is not stored yet
+        """
+        if timeout is not None:
+            return await self.wait_for(consumer_name, message_id, timeout)
+        return await self._get_message_result(consumer_name, message_id)
+
+
+class RedisDedupStore(DedupStore):
+    """
+    Deduplication store in Redis, keys are looked up with one MGET and set in one pipeline
+    :param prefix: key prefix
+    :param redis: Redis client, `RedisBroker` client is used by default
+    """
+
+    def __init__(self, prefix: str = "dedup", redis: Redis | None = None) -> None:
+        super().__init__()
+        self.prefix = prefix
+        self._redis = redis
+
+    @property
+    def redis(self) -> Redis:
+        assert self._redis
+        return self._redis
+
+    async def connect(self, broker: Broker) -> None:
+        if self._redis is None:
+            from .broker import RedisBroker
+
+            assert isinstance(broker, RedisBroker), "Redis client required"
+            self._redis = broker.redis
+
+    async def contains_many(self, keys: Sequence[str]) -> list[bool]:
+        values = await self.redis.mget([f"{self.prefix}:{key}" for key in keys])
+        return [value is not None for value in values]
+
+    async def add_many(self, keys: Sequence[str], ttl: float) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(f"{self.prefix}:{key}", 1, ex=int(ttl))
+        await pipe.execute()
+
+
+# refills bucket by server time and takes up to ARGV[3] tokens atomically
+LEASE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local count = tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(count, math.floor(tokens))
+tokens = tokens - granted
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+local wait = 0
+if granted == 0 then
+    wait = (1 - tokens) / rate
+end
+return {granted, tostring(wait)}
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Token buckets in Redis, refilled and leased atomically by Lua script
+    :param prefix: key prefix
+    :param redis: Redis client, `RedisBroker` client is used by default
+    """
+
+    def __init__(self, prefix: str = "ratelimit", redis: Redis | None = None) -> None:
+        self.prefix = prefix
+        self._redis = redis
+        self._script: Any = None
+
+    @property
+    def redis(self) -> Redis:
+        assert self._redis
+        return self._redis
+
+    async def connect(self, broker: Broker) -> None:
+        if self._redis is None:
+            from .broker import RedisBroker
+
+            assert isinstance(broker, RedisBroker), "Redis client required"
+            self._redis = broker.redis
+        self._script = self.redis.register_script(LEASE_SCRIPT)
+
+    async def lease(
+        self, key: str, rate: float, burst: float, count: int
+    ) -> tuple[int, float]:
+        granted, wait = await self._script(
+            keys=[f"{self.prefix}:{key}"], args=[rate, burst, count]
+        )
+        return int(granted), float(wait)
@@ -17,6 +17,8 @@ if TYPE_CHECKING:
 class Message:
     data: bytes
     queue: asyncio.Queue
+    headers: dict[str, str] | None = None
+    deliveries: int = 1
 
 
 class StubBroker(Broker[Message]):
@@ -34,17 +36,22 @@ class StubBroker(Broker[Message]):
         super().__init__(encoder=encoder, middlewares=middlewares, **options)
         self.topics: dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
         self._stopped = False
+        # scheduled redeliveries of nacked messages
+        self._redeliveries: set[asyncio.TimerHandle] = set()
 
     def parse_incoming_message(self, message: Message) -> Any:
-        return self.encoder.decode(message.data)
+        return self.decode_message(message.data, message.headers)
 
     async def _disconnect(self) -> None:
         self._stopped = True
+        for handle in self._redeliveries:
+            handle.cancel()
+        self._redeliveries.clear()
 
     async def _start_consumer(self, service: Service, consumer: Consumer):
         queue = self.topics[consumer.topic]
         handler = self.get_handler(service, consumer)
-        while not self._stopped:
+        while self.is_consuming:
             message = await queue.get()
             await handler(message)
 
@@ -53,18 +60,36 @@ class StubBroker(Broker[Message]):
 
     async def _publish(self, message: CloudEvent, **_) -> None:
         queue = self.topics[message.topic]
-        data = self.encoder.encode(message.dict())
-        msg = Message(data=data, queue=queue)
+        data, headers = self.encode_message(message)
+        msg = Message(data=data, queue=queue, headers=headers)
         await queue.put(msg)
 
     async def _ack(self, message: Message) -> None:
         message.queue.task_done()
 
-    async def _nack(self, message: Message, delay: int | None = None) -> None:
+    def get_delivery_count(self, message: Message) -> int:
+        return message.deliveries
 
-        if delay:
-            await asyncio.sleep(delay)
-        await message.queue.put(message)
+    async def _nack(self, message: Message, delay: int | None = None) -> None:
+        message.deliveries += 1
+        if not delay:
+            self._redeliver(message)
+            return
+        handle: asyncio.TimerHandle
+
+        def redeliver() -> None:
+            self._redeliveries.discard(handle)
+            self._redeliver(message)
+
+        handle = asyncio.get_running_loop().call_later(delay, redeliver)
+        self._redeliveries.add(handle)
+
+    @staticmethod
+    def _redeliver(message: Message) -> None:
+        """Requeue message and settle its previous delivery"""
+        message.queue.put_nowait(message)
+        message.queue.task_done()
 
+    @property
     def is_connected(self) -> bool:
         return True
@@ -2,18 +2,41 @@ from __future__ import annotations
 
 import asyncio
 import functools
+import time
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Any, Awaitable, Callable, Generic
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    Mapping,
+    Sequence,
+)
 
 import async_timeout
 from pydantic import ValidationError
 
-from .exceptions import DecodeError, Reject, Retry, Skip
+from .exceptions import DecodeError, Postpone, Reject, Retry, Skip
+from .local import LOCAL_ORIGIN, DeliveryMode, LocalMessage, LocalSubscribers
 from .logger import LoggerMixin
 from .middleware import Middleware
-from .models import CloudEvent
+from .models import CloudEvent, ContentMode
+from .outbox import Outbox
+from .scheduler import Scheduler
+from .serialization import (
+    from_binary,
+    get_content_type,
+    get_serializer,
+    is_binary,
+    to_binary,
+)
 from .settings import BrokerSettings, Settings
 from .types import Encoder, RawMessage
+from .utils.cache import TTLCache
+from .utils.ids import generate_id
+from .utils.timing import Timer, start_stage_timer
 
 if TYPE_CHECKING:
     from asvc import Consumer, Service
@@ -46,6 +69,23 @@ class AbstractBroker(ABC, Generic[RawMessage]):
     async def _start_consumer(self, service: Service, consumer: Consumer) -> None:
         raise NotImplementedError
 
+    async def _publish_batch(self, messages: Sequence[CloudEvent], **kwargs) -> None:
+        """Publish messages concurrently, backends with batch publishing override it"""
+        await asyncio.gather(*(self._publish(m, **kwargs) for m in messages))
+
+    async def _stop_consumers(self) -> None:
+        """
+        Stop receiving new messages, called on drain. Backends with consumer loops
+        check `is_consuming` instead, push-based backends should cancel subscriptions
+        """
+
+    def get_delivery_count(self, message: RawMessage) -> int:
+        """
+        Return number of times message was delivered (1 for the first delivery),
+        backends tracking redeliveries override it
+        """
+        return 1
+
     async def _ack(self, message: RawMessage) -> None:
         """Empty default implementation for backends that do not support explicit ack"""
 
@@ -58,10 +98,31 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
     :param description: Broker (Server) Description
     :param encoder: Encoder (Serializer) class
     :param middlewares: Optional list of middlewares
+    :param content_mode: CloudEvents content mode, 'structured' (whole event in the
+        message body) or 'binary' (event attributes as ce-* headers, data in the body)
+    :param compact_time: encode event time as unix time in milliseconds instead of
+        RFC3339 string, applies only to structured content mode
+    :param stage_sample_rate: fraction of messages (0-1) with per-stage handling time
+        measured and reported with `after_stage_timing` middleware hook, off by default
+    :param drain_timeout: max time (in seconds) to wait for messages being processed
+        on graceful shutdown
+    :param local_delivery: delivery of events to consumers running in the same process,
+        'remote' (always through the broker, default), 'local' (directly to local
+        consumers) or 'mirror' (directly to local consumers and through the broker)
+    :param scheduler: scheduler of delayed events, for backends without native
+        delayed delivery, by default pending events are kept only in memory
+    :param outbox: store of events not published due to broker failure, published
+        later, by default `publish_event` raises on failure
     """
 
     protocol: str
     Settings = BrokerSettings
+    MAX_CACHED_ENCODERS = 32
+    MAX_POSTPONED = 10_000
+    content_mode: ContentMode = ContentMode.structured
+    # `_start_consumer` runs consumer loop until broker stops (pull based backends),
+    # otherwise it returns after subscribing
+    consumer_loop: bool = True
 
     def __init__(
         self,
@@ -69,6 +130,13 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
         description: str | None = None,
         encoder: Encoder | None = None,
         middlewares: list[Middleware] | None = None,
+        content_mode: ContentMode | None = None,
+        compact_time: bool = False,
+        stage_sample_rate: float = 0.0,
+        drain_timeout: float = 30,
+        local_delivery: DeliveryMode | str = DeliveryMode.remote,
+        scheduler: Scheduler | None = None,
+        outbox: Outbox | None = None,
     ) -> None:
 
         if encoder is None:
@@ -77,91 +145,349 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
             encoder = get_default_encoder()
         self.description = description or type(self).__doc__
         self.encoder = encoder
+        self._encoders: dict[str, Encoder] = {encoder.CONTENT_TYPE: encoder}
         self.middlewares: list[Middleware] = middlewares or []
+        if content_mode is not None:
+            self.content_mode = ContentMode(content_mode)
+        self.compact_time = compact_time
+        self.stage_sample_rate = stage_sample_rate
+        self.drain_timeout = drain_timeout
+        self.local_delivery = DeliveryMode(local_delivery)
+        self._local = LocalSubscribers()
+        self._instance_id = generate_id()
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        self.outbox = outbox
         self._lock = asyncio.Lock()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._in_flight: dict[Consumer, int] = {}
+        self._in_flight_total = 0
+        # messages being handled (by id), True once acked or nacked
+        self._settled: dict[int, bool] = {}
+        # number of postponements of redelivered messages, by consumer and message id,
+        # entries expire (bounded), as message can be nacked by middlewares after processing
+        self._postponed: TTLCache[tuple[Consumer, str], int] = TTLCache(
+            self.MAX_POSTPONED, ttl=3600
+        )
+        self._draining = False
         self._stopped = True
 
     def __repr__(self):
         return type(self).__name__
 
-    def get_handler(
-        self, service: Service, consumer: Consumer
-    ) -> Callable[[RawMessage], Awaitable[Any | None]]:
-        async def handler(raw_message: RawMessage) -> None:
-            exc: Exception | None = None
-            result: Any = None
-            try:
-                parsed = self.parse_incoming_message(raw_message)
-                message = consumer.validate_message(parsed)
-                message._raw = raw_message
-
-            except (DecodeError, ValidationError) as e:
-                self.logger.exception(
-                    "Parsing error Decode/Validation error", exc_info=e
+    def get_encoder(self, content_type: str | None = None) -> Encoder:
+        """
+        Return encoder for given message content type, falls back to broker encoder
+        :param content_type: Content-Type header/attribute of the incoming message
+        """
+        if not content_type:
+            return self.encoder
+        try:
+            return self._encoders[content_type]
+        except KeyError:
+            from .encoders import get_encoder, normalize_content_type
+
+            if normalize_content_type(content_type) == self.encoder.CONTENT_TYPE:
+                encoder = self.encoder
+            else:
+                encoder = get_encoder(content_type)
+            if encoder is None:
+                self.logger.warning(
+                    f"No encoder registered for {content_type}, using default"
                 )
+                encoder = self.encoder
+            if len(self._encoders) < self.MAX_CACHED_ENCODERS:
+                self._encoders[content_type] = encoder
+            return encoder
+
+    def decode(self, data: bytes, content_type: str | None = None) -> Any:
+        return self.get_encoder(content_type).decode(data)
+
+    def encode_message(self, message: CloudEvent) -> tuple[bytes, dict[str, str]]:
+        """
+        Serialize message according to broker content mode
+        :param message: Cloud event to serialize
+        :return: tuple of message body and headers
+        """
+        if self.content_mode == ContentMode.binary:
+            return to_binary(message, self.encoder)
+        serializer = get_serializer(type(message), self.compact_time)
+        data = serializer.encode(message, self.encoder)
+        return data, {"Content-Type": self.encoder.CONTENT_TYPE}
+
+    def decode_message(
+        self, data: bytes, headers: Mapping[str, Any] | None = None
+    ) -> Any:
+        """
+        Decode message body, detecting content mode from message headers
+        :param data: Message body
+        :param headers: Message headers (or attributes)
+        """
+        encoder = self.get_encoder(get_content_type(headers))
+        if is_binary(headers):
+            return from_binary(data, headers, encoder)  # type: ignore
+        return encoder.decode(data)
+
+    async def _parse_message(
+        self, consumer: Consumer, raw_message: RawMessage, timer: Timer
+    ) -> CloudEvent | None:
+        """Parse and validate incoming message, invalid messages are acked"""
+        try:
+            if isinstance(raw_message, LocalMessage):
+                parsed = raw_message.event
+                delivery_count = raw_message.deliveries
+            else:
+                parsed = self.parse_incoming_message(raw_message)
+                delivery_count = self.get_delivery_count(raw_message)
+            timer.mark("decode")
+            message = consumer.validate_message(parsed)
+            message._raw = raw_message
+            message._delivery_count = delivery_count
+            if self._postponed and delivery_count > 1:
+                message._postponed = self._postponed.get((consumer, message.id), 0)
+            timer.mark("validate")
+            return message
+        except (DecodeError, ValidationError) as e:
+            self.logger.exception("Parsing error Decode/Validation error", exc_info=e)
+            if not isinstance(raw_message, LocalMessage):
                 await self._ack(raw_message)
-                return
+            return None
+
+    def _is_mirrored(
+        self, service: Service, consumer: Consumer, message: CloudEvent
+    ) -> bool:
+        """Check if event was already delivered to this consumer locally"""
+        return bool(
+            self._local
+            and message.__dict__.get(LOCAL_ORIGIN) == self._instance_id
+            and not isinstance(message.raw, LocalMessage)
+            and self._local.is_local(service, consumer)
+        )
 
-            try:
-                await self.dispatch_before(
-                    "process_message", service, consumer, message
+    async def _report_timing(
+        self, consumer: Consumer, message: CloudEvent, timer: Timer
+    ) -> None:
+        if timer:
+            await self.dispatch_after("stage_timing", consumer, message, timer.timings)
+
+    async def _skip(
+        self, consumer: Consumer, message: CloudEvent, timer: Timer
+    ) -> None:
+        self.logger.info(f"Skipped message {message.id}")
+        await self.dispatch_after("skip_message", consumer, message)
+        timer.mark("before_process")
+        await self.ack(consumer, message.raw)
+        timer.mark("ack")
+        await self._report_timing(consumer, message, timer)
+
+    async def _postpone(
+        self, consumer: Consumer, message: CloudEvent, exc: Retry, timer: Timer
+    ) -> None:
+        # postponed by middleware (e.g. rate limit), redelivered without processing
+        self.logger.info(f"Postponed message {message.id} by {exc.delay}s")
+        await self.dispatch_after("postpone_message", consumer, message, exc.delay)
+        timer.mark("before_process")
+        if isinstance(exc, Postpone):
+            # redelivery is not counted as retry
+            self._postponed.set((consumer, message.id), message.postponed + 1)
+        await self.nack(consumer, message.raw, exc.delay)
+        timer.mark("ack")
+        await self._report_timing(consumer, message, timer)
+
+    async def _run_consumer(
+        self,
+        service: Service,
+        consumer: Consumer,
+        message: CloudEvent,
+        timer: Timer,
+    ) -> tuple[Any, Exception | None]:
+        """Process message and forward response, return result and raised error"""
+        forwarding = False
+        try:
+            async with async_timeout.timeout(consumer.timeout):
+                self.logger.info(
+                    f"Running consumer {consumer.name} with message {message.id}"
                 )
-            except Skip:
-                self.logger.info(f"Skipped message {message.id}")
-                await self.dispatch_after("skip_message", service, consumer, message)
-                await self.ack(consumer, raw_message)
-                return
-            try:
-                async with async_timeout.timeout(consumer.timeout):
-                    self.logger.info(
-                        f"Running consumer {consumer.name} with message {message.id}"
-                    )
-                    result = await consumer.process(message)
-                if consumer.forward_response and result is not None:
-                    await self.publish_event(
-                        CloudEvent(
-                            type=consumer.forward_response.as_type,
-                            topic=consumer.forward_response.topic,
-                            data=result,
-                            trace_id=message.trace_id,
-                            source=service.name,
-                        )
-                    )
-            # TODO: asyncio.CanceledError handling (?)
-            except Exception as e:
-                exc = e
-            finally:
-                if isinstance(exc, Reject):
-                    self.logger.warning(
-                        f"Message {message.id} rejected due to {exc.reason}"
+                result = await consumer.process(message)
+            timer.mark("process")
+            if consumer.forward_response and result is not None:
+                forwarding = True
+                await self.publish_event(
+                    CloudEvent(
+                        type=consumer.forward_response.as_type,
+                        topic=consumer.forward_response.topic,
+                        data=result,
+                        trace_id=message.trace_id,
+                        source=service.name,
                     )
-                await self.dispatch_after(
-                    "process_message", service, consumer, message, result, exc
                 )
-                if exc and isinstance(exc, Retry):
-                    await self.nack(consumer, message, exc.delay)
-                else:
-                    await self.ack(consumer, message)
+                timer.mark("forward")
+            return result, None
+        # TODO: asyncio.CanceledError handling (?)
+        except Exception as e:
+            timer.mark("forward" if forwarding else "process")
+            return None, e
+
+    async def _finalize(
+        self,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any,
+        exc: Exception | None,
+        timer: Timer,
+    ) -> None:
+        """Run `after_process_message` hooks and ack (or nack on `Retry`) message"""
+        if isinstance(exc, Reject):
+            self.logger.warning(f"Message {message.id} rejected due to {exc.reason}")
+        await self.dispatch_after("process_message", consumer, message, result, exc)
+        timer.mark("after_process")
+        if isinstance(exc, Retry):
+            await self.nack(consumer, message.raw, exc.delay)
+        else:
+            await self.ack(consumer, message.raw)
+        timer.mark("ack")
+        await self._report_timing(consumer, message, timer)
+
+    async def _process(
+        self, service: Service, consumer: Consumer, raw_message: RawMessage
+    ) -> None:
+        timer = start_stage_timer(self.stage_sample_rate)
+        message = await self._parse_message(consumer, raw_message, timer)
+        if message is None:
+            return
+        if self._is_mirrored(service, consumer, message):
+            await self._ack(raw_message)
+            return
+        try:
+            await self.dispatch_before("process_message", consumer, message)
+            timer.mark("before_process")
+        except Skip:
+            return await self._skip(consumer, message, timer)
+        except Retry as e:
+            return await self._postpone(consumer, message, e, timer)
+        result, exc = None, None
+        try:
+            result, exc = await self._run_consumer(service, consumer, message, timer)
+        finally:
+            await self._finalize(consumer, message, result, exc, timer)
+
+    def get_handler(
+        self, service: Service, consumer: Consumer
+    ) -> Callable[[RawMessage], Awaitable[Any | None]]:
+        async def handler(raw_message: RawMessage) -> None:
+            self._in_flight[consumer] = self._in_flight.get(consumer, 0) + 1
+            self._in_flight_total += 1
+            self._idle.clear()
+            key = id(raw_message)
+            self._settled[key] = False
+            try:
+                if not self._resumed.is_set():
+                    await self._resumed.wait()
+                await self._process(service, consumer, raw_message)
+            finally:
+                self._settled.pop(key, None)
+                self._in_flight[consumer] -= 1
+                self._in_flight_total -= 1
+                if not self._in_flight_total:
+                    self._idle.set()
 
         return handler
 
+    @property
+    def is_consuming(self) -> bool:
+        """Check if consumers should keep receiving new messages"""
+        return not (self._stopped or self._draining)
+
+    def in_flight(self, consumer: Consumer | None = None) -> int:
+        """Return number of messages being processed, by consumer or in total"""
+        if consumer is None:
+            return self._in_flight_total
+        return self._in_flight.get(consumer, 0)
+
+    async def drain(self, timeout: float | None = None) -> int:
+        """
+        Stop receiving new messages and wait until messages being processed
+        are handled (and acknowledged)
+        :param timeout: max time (in seconds) to wait, defaults to broker `drain_timeout`
+        :return: number of messages left unprocessed after timeout
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+        start = time.monotonic()
+        self._draining = True
+        self.resume()
+        try:
+            async with async_timeout.timeout(timeout):
+                await self._stop_consumers()
+                await self._idle.wait()
+        except asyncio.TimeoutError:
+            pass
+        abandoned = self._in_flight_total
+        duration = (time.monotonic() - start) * 1000
+        if abandoned:
+            self.logger.warning(
+                f"Drain timed out after {duration:.0f}ms, {abandoned} messages abandoned"
+            )
+        else:
+            self.logger.info(f"Drained in {duration:.0f}ms")
+        return abandoned
+
+    @property
+    def is_paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def pause(self) -> None:
+        """
+        Stop processing incoming messages, until `resume()` is called.
+        Messages already being processed are not affected, new ones wait in handler
+        """
+        self._resumed.clear()
+
+    def resume(self) -> None:
+        """Resume processing of incoming messages"""
+        self._resumed.set()
+
+    def _mark_settled(self, message: RawMessage) -> bool:
+        """Mark message being handled as settled, return False if it already was"""
+        key = id(message)
+        settled = self._settled.get(key)
+        if settled:
+            return False
+        if settled is not None:
+            self._settled[key] = True
+        return True
+
     async def ack(self, consumer: Consumer, message: RawMessage) -> None:
+        """Acknowledge message, ignored if message was already acked or nacked"""
+        if not self._mark_settled(message):
+            return
         await self.dispatch_before("ack", consumer, message)
-        await self._ack(message)
+        if not isinstance(message, LocalMessage):
+            await self._ack(message)
         await self.dispatch_after("ack", consumer, message)
 
     async def nack(
         self,
         consumer: Consumer,
         message: RawMessage,
-        delay: int | None = None,
+        delay: float | None = None,
     ) -> None:
-        await self.dispatch_after(
+        """
+        Negatively acknowledge message, for redelivery after `delay` seconds
+        (if supported by the backend), ignored if message was already acked or nacked
+        """
+        if not self._mark_settled(message):
+            return
+        await self.dispatch_before(
             "nack",
             consumer,
             message,
         )
-        await self._nack(message, delay)
+        if isinstance(message, LocalMessage):
+            self._local.redeliver(message, delay)
+        else:
+            await self._nack(message, delay)
         await self.dispatch_after(
             "nack",
             consumer,
@@ -173,27 +499,99 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
             if self._stopped:
                 await self.dispatch_before("broker_connect")
                 await self._connect()
+                self.scheduler.start(self)
+                if self.outbox is not None:
+                    self.outbox.start(self)
                 self._stopped = False
+                self._draining = False
                 await self.dispatch_after("broker_connect")
 
     async def disconnect(self) -> None:
         async with self._lock:
             if not self._stopped:
                 await self.dispatch_before("broker_disconnect")
+                await self.scheduler.stop()
+                if self.outbox is not None:
+                    await self.outbox.stop()
                 await self._disconnect()
+                await self._local.close()
                 self._stopped = True
                 await self.dispatch_after("broker_disconnect")
 
-    async def publish_event(self, message: CloudEvent, **kwargs: Any) -> None:
+    async def _publish_delayed(
+        self, message: CloudEvent, due: float, **kwargs: Any
+    ) -> None:
+        """
+        Publish message at `due` unix time, backends supporting delayed delivery
+        natively can override it
+        """
+        if not self.scheduler.is_running:
+            self.scheduler.start(self)
+        self.scheduler.schedule(message, due, **kwargs)
+
+    async def publish_event(
+        self,
+        message: CloudEvent,
+        *,
+        delay: float | None = None,
+        deliver_at: datetime | None = None,
+        **kwargs: Any,
+    ) -> None:
         """
         :param message: Cloud event object to send
-        :param kwargs: Additional params passed to broker._publish
+        :param delay: publish after `delay` seconds
+        :param deliver_at: publish at given time (timezone aware datetime)
+        :param kwargs: Additional params passed to broker._publish,
+            `delivery` overrides broker `local_delivery` for this event
         :rtype: None
         """
+        if deliver_at is not None or delay:
+            due = deliver_at.timestamp() if deliver_at else time.time() + (delay or 0)
+            if due > time.time():
+                await self._publish_delayed(message, due, **kwargs)
+                return
+        delivery = kwargs.pop("delivery", self.local_delivery)
         await self.dispatch_before("publish", message)
-        await self._publish(message, **kwargs)
+        if delivery == DeliveryMode.remote or not self.is_consuming:
+            await self._publish_or_store(message, **kwargs)
+        elif not self._local.deliver(message):
+            await self._publish_or_store(message, **kwargs)
+        elif delivery == DeliveryMode.mirror:
+            mirrored = message.copy(update={LOCAL_ORIGIN: self._instance_id})
+            await self._publish_or_store(mirrored, **kwargs)
         await self.dispatch_after("publish", message)
 
+    async def _publish_or_store(self, message: CloudEvent, **kwargs: Any) -> None:
+        outbox = self.outbox
+        if outbox is None:
+            await self._publish(message, **kwargs)
+            return
+        if not outbox.is_running:
+            outbox.start(self)
+        if outbox.is_pending(message.topic) or not self.is_connected:
+            outbox.store(message)
+            return
+        try:
+            async with async_timeout.timeout(outbox.publish_timeout):
+                await self._publish(message, **kwargs)
+        except Exception as e:
+            self.logger.warning(f"Publishing {message.id} failed, stored: {e!r}")
+            outbox.store(message)
+
+    async def publish_batch(
+        self, messages: Sequence[CloudEvent], **kwargs: Any
+    ) -> None:
+        """
+        Publish multiple events to the broker at once (without local delivery or delay)
+        :param messages: Cloud events to send
+        :param kwargs: Additional params passed to broker._publish
+        """
+        for message in messages:
+            await self.dispatch_before("publish", message)
+        await self._publish_batch(messages, **kwargs)
+        for message in messages:
+            await self.dispatch_after("publish", message)
+
     async def publish(
         self,
         topic: str,
@@ -207,7 +605,8 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
         :param data: Message content
         :param type_: Event type, name or class
         :param source: message sender (service/app name)
-        :param kwargs: additional params passed to underlying broker implementation, such as headers
+        :param kwargs: additional params passed to `publish_event` (e.g. `delay`
+            or `deliver_at`) and underlying broker implementation, such as headers
         :rtype: None
         """
 
@@ -226,6 +625,7 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
 
     async def start_consumer(self, service: Service, consumer: Consumer):
         await self.dispatch_before("consumer_start", service, consumer)
+        self._local.add(service, consumer, self.get_handler(service, consumer))
         await self._start_consumer(service, consumer)
         await self.dispatch_after("consumer_start", service, consumer)
 
@@ -238,7 +638,7 @@ class Broker(AbstractBroker[RawMessage], LoggerMixin, ABC):
         for m in self.middlewares:
             try:
                 await getattr(m, full_event)(self, *args, **kwargs)
-            except Skip:
+            except (Skip, Retry):
                 raise
             except Exception as e:
                 self.logger.exception("Unhandled middleware exception", exc_info=e)
@@ -19,12 +19,40 @@ def cli() -> None:
 @click.argument("service_or_runner")
 @click.option("--log-level", default="info")
 @click.option("--use-uvloop", default="false")
-def run(service_or_runner: str, log_level: str, use_uvloop: str) -> None:
+@click.option("--workers", default=1, help="Number of worker processes")
+@click.option("--cpu-affinity", is_flag=True, help="Pin each worker to one CPU")
+@click.option("--metrics-dir", default=None, help="Prometheus multiprocess directory")
+@click.option("--metrics-port", default=None, type=int, help="Aggregated metrics port")
+def run(
+    service_or_runner: str,
+    log_level: str,
+    use_uvloop: str,
+    workers: int,
+    cpu_affinity: bool,
+    metrics_dir: str | None,
+    metrics_port: int | None,
+) -> None:
     click.echo(f"Running [{service_or_runner}]...")
     logging.basicConfig(level=log_level.upper())
+    if metrics_dir:
+        from .middlewares.prometheus import enable_multiprocess
+
+        # must be set before metrics are created on service import
+        enable_multiprocess(metrics_dir)
     obj = import_from_string(service_or_runner)
     if isinstance(obj, Service):
         obj = ServiceRunner([obj])
+    if workers > 1:
+        from .prefork import PreforkRunner
+
+        PreforkRunner(
+            obj,
+            workers=workers,
+            cpu_affinity=cpu_affinity,
+            use_uvloop=(use_uvloop == "true"),
+            metrics_port=metrics_port,
+        ).run()
+        return
     obj.run(use_uvloop=(use_uvloop == "true"))
 
 
@@ -53,6 +81,85 @@ def watch(service_or_runner: str, log_level: str, use_uvloop: str, directory: st
     )
 
 
+@cli.command(help="Measure service throughput and latency")
+@click.argument("service")
+@click.option("--count", default=10000, help="Number of messages to publish")
+@click.option("--rate", default=0.0, help="Messages per second, 0 - unlimited")
+@click.option("--consumer", "consumers", multiple=True, help="Consumer name(s)")
+@click.option("--broker-url", default=None, help="Use service broker with this url")
+@click.option("--timeout", default=60.0, help="Max time to wait for processing")
+@click.option("--log-level", default="warning")
+def bench(
+    service: str,
+    count: int,
+    rate: float,
+    consumers: tuple[str, ...],
+    broker_url: str | None,
+    timeout: float,
+    log_level: str,
+) -> None:
+    import asyncio
+
+    from .loadgen import run_bench, use_broker
+
+    logging.basicConfig(level=log_level.upper())
+    svc = import_from_string(service)
+    assert isinstance(svc, Service), f"Service instance expected, got {type(svc)}"
+    broker = use_broker(svc, broker_url)
+    click.echo(f"Benchmarking [{service}] with {broker} ({count} messages)...")
+    result = asyncio.run(
+        run_bench(
+            svc, count=count, rate=rate, consumers=list(consumers), timeout=timeout
+        )
+    )
+    for name, value in result.summary().items():
+        click.echo(f"{name:>18}: {value}")
+
+
+@cli.command(help="Run service with CPU and memory profiler")
+@click.argument("service_or_runner")
+@click.option("--duration", default=None, type=float, help="Profile for N seconds")
+@click.option("--messages", default=None, type=int, help="Stop after N messages")
+@click.option("--mode", default="cprofile", type=click.Choice(["cprofile", "sampling"]))
+@click.option("--out-dir", default="./profile")
+@click.option("--memory/--no-memory", default=True, help="Trace memory allocations")
+@click.option("--handler-only", is_flag=True, help="Profile message handling only")
+@click.option("--interval", default=0.001, help="Sampling interval (in seconds)")
+@click.option("--log-level", default="warning")
+def profile(
+    service_or_runner: str,
+    duration: float | None,
+    messages: int | None,
+    mode: str,
+    out_dir: str,
+    memory: bool,
+    handler_only: bool,
+    interval: float,
+    log_level: str,
+) -> None:
+    import asyncio
+
+    from .profiling import Profiler
+
+    logging.basicConfig(level=log_level.upper())
+    obj = import_from_string(service_or_runner)
+    services = [obj] if isinstance(obj, Service) else list(obj.services)
+    if duration is None and messages is None:
+        duration = 30
+    click.echo(f"Profiling [{service_or_runner}] ({mode})...")
+    profiler = Profiler(
+        mode=mode,
+        out_dir=out_dir,
+        memory=memory,
+        handler_only=handler_only,
+        interval=interval,
+    )
+    processed, files = asyncio.run(profiler.run(services, duration, messages))
+    click.echo(f"Processed {processed} messages")
+    for path in files:
+        click.echo(f"Saved {path}")
+
+
 @cli.command()
 @click.argument("service")
 def verify(service: str) -> None:
@@ -77,5 +184,51 @@ def generate_docs(
     save_async_api_to_file(spec, out, format)
 
 
+@cli.group(help="Dead letter queue tools")
+def dlq() -> None:
+    pass
+
+
+@dlq.command(help="Publish dead-lettered messages back to their original topic")
+@click.argument("service")
+@click.option("--topic", required=True, help="Dead letter topic")
+@click.option("--target", default=None, help="Publish to this topic instead")
+@click.option("--batch-size", default=100, help="Messages published at once")
+@click.option("--rate", default=0.0, help="Messages per second, 0 - unlimited")
+@click.option("--limit", default=None, type=int, help="Max number of messages")
+@click.option("--idle-timeout", default=5.0, help="Stop after no message for (s)")
+@click.option("--log-level", default="info")
+def replay(
+    service: str,
+    topic: str,
+    target: str | None,
+    batch_size: int,
+    rate: float,
+    limit: int | None,
+    idle_timeout: float,
+    log_level: str,
+) -> None:
+    import asyncio
+
+    from .dlq import replay as replay_messages
+
+    logging.basicConfig(level=log_level.upper())
+    svc = import_from_string(service)
+    assert isinstance(svc, Service), f"Service instance expected, got {type(svc)}"
+    click.echo(f"Replaying [{topic}] with {svc.broker}...")
+    replayed = asyncio.run(
+        replay_messages(
+            svc.broker,
+            topic,
+            target=target,
+            batch_size=batch_size,
+            rate=rate,
+            limit=limit,
+            idle_timeout=idle_timeout,
+        )
+    )
+    click.echo(f"Replayed {replayed} messages")
+
+
 if __name__ == "__main__":
     cli()
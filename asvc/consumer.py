@@ -3,11 +3,13 @@ from __future__ import annotations
 import asyncio
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Generic, get_type_hints
+from typing import Any, Callable, Generic, get_type_hints
 
 from asvc.logger import get_logger
+from asvc.models import CloudEvent
 from asvc.types import FT, MessageHandlerT, T
 from asvc.utils.functools import run_async
+from asvc.validation import ValidationMode, get_validator
 
 
 @dataclass
@@ -29,6 +31,7 @@ class Consumer(ABC, Generic[T]):
         timeout: int = 120,
         dynamic: bool = False,
         forward_response: ForwardResponse | None = None,
+        validation: ValidationMode | str = ValidationMode.full,
         **options: Any,
     ):
         self._name = name
@@ -36,11 +39,24 @@ class Consumer(ABC, Generic[T]):
         self.timeout = timeout
         self.dynamic = dynamic
         self.forward_response = forward_response
+        self.validation = ValidationMode(validation)
         self.options: dict[str, Any] = options
         self.logger = get_logger(__name__, self._name)
+        self._validator: Callable[[Any], T] | None = None
 
     def validate_message(self, message: Any) -> T:
-        return self.event_type.parse_obj(message)
+        if isinstance(message, CloudEvent):
+            # passed without serialization (in-memory broker)
+            event_type = self.event_type
+            if isinstance(event_type, type) and isinstance(message, event_type):
+                return message  # type: ignore
+            message = message.__dict__
+        validator = self._validator
+        if validator is None:
+            validator = self._validator = get_validator(  # type: ignore
+                self.event_type, self.validation
+            )
+        return validator(message)  # type: ignore
 
     @property
     def name(self) -> str:
@@ -122,6 +138,7 @@ class ConsumerGroup:
         timeout: int = 120,
         dynamic: bool = False,
         forward_response: ForwardResponse | None = None,
+        validation: ValidationMode | str = ValidationMode.full,
         cls=FnConsumer,
         **options,
     ):
@@ -142,6 +159,7 @@ class ConsumerGroup:
                 timeout=timeout,
                 dynamic=dynamic,
                 forward_response=forward_response,
+                validation=validation,
                 **options,
             )
             self.add_consumer(consumer)
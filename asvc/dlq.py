@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import TYPE_CHECKING
+
+from .exceptions import Fail, Retry
+from .logger import get_logger
+from .middlewares.dlq import DLQ_ATTRIBUTES, DLQ_TOPIC
+from .models import CloudEvent
+from .publisher import BatchPublisher
+from .service import Service
+
+if TYPE_CHECKING:
+    from .broker import Broker
+
+REPLAY_SERVICE = "dlq-replay"
+# not allowed in JetStream durable names
+_UNSAFE_NAME_CHARS = re.compile(r"[.*>/\\\s]")
+
+logger = get_logger(__name__, "replay")
+
+
+def restore_message(message: CloudEvent, target: str | None = None) -> CloudEvent:
+    """
+    Return dead-lettered message without failure metadata
+    :param target: topic to publish to, defaults to the original topic
+    """
+    topic = target or message.__dict__.get(DLQ_TOPIC)
+    if not topic:
+        raise Fail(f"Original topic of message {message.id} unknown")
+    return message.copy(exclude=set(DLQ_ATTRIBUTES), update={"topic": topic})
+
+
+def get_replay_name(topic: str) -> str:
+    """
+    Return name of replay consumer of dead letter topic, with characters
+    not allowed in queue (durable) names by some backends (e.g. JetStream) replaced
+    """
+    return _UNSAFE_NAME_CHARS.sub("_", topic)
+
+
+def get_replay_group(topic: str) -> str:
+    """Return queue group (`<service>:<consumer>`) consuming dead letter topic"""
+    return f"{REPLAY_SERVICE}:{get_replay_name(topic)}"
+
+
+class _Replay:
+    """Publishes consumed dead letters back until `limit` is reached or idle"""
+
+    def __init__(
+        self,
+        publisher: BatchPublisher,
+        target: str | None,
+        limit: int | None,
+        idle_timeout: float,
+    ) -> None:
+        self.publisher = publisher
+        self.target = target
+        self.limit = limit
+        self.idle_timeout = idle_timeout
+        self.replayed = 0
+        self.done = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self.last_at = self._loop.time()
+
+    def is_full(self) -> bool:
+        return self.limit is not None and self.replayed >= self.limit
+
+    async def replay_message(self, message: CloudEvent) -> None:
+        if self.is_full():
+            # left in dead letter queue, redelivered after replay is stopped
+            raise Retry(delay=max(self.idle_timeout, 1))  # type: ignore[arg-type]
+        self.replayed += 1
+        self.last_at = self._loop.time()
+        try:
+            await self.publisher.publish(restore_message(message, self.target))
+        except Exception:
+            self.replayed -= 1
+            raise
+        finally:
+            self.last_at = self._loop.time()
+        if self.is_full():
+            self.done.set()
+
+    async def wait(self, broker: Broker) -> None:
+        """Wait until limit is reached or no message is received for `idle_timeout`"""
+        while not self.done.is_set():
+            idle = self._loop.time() - self.last_at
+            if idle >= self.idle_timeout and not broker.in_flight():
+                return
+            try:
+                await asyncio.wait_for(
+                    self.done.wait(), max(self.idle_timeout - idle, 0.1)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+async def replay(
+    broker: Broker,
+    topic: str,
+    target: str | None = None,
+    batch_size: int = 100,
+    rate: float = 0,
+    limit: int | None = None,
+    idle_timeout: float = 5.0,
+) -> int:
+    """
+    Consume dead letter topic (as `dlq-replay:<topic>` queue group, see
+    `get_replay_group`) and publish messages back to their original topic,
+    broker is disconnected when done
+    :param broker: broker to consume and publish with
+    :param topic: dead letter topic
+    :param target: topic to publish to, defaults to the original topic of every message
+    :param batch_size: number of messages consumed and published at once
+    :param rate: max number of messages published per second, unlimited by default
+    :param limit: max number of messages to replay
+    :param idle_timeout: stop after no message is received for this time (in seconds)
+    :return: number of replayed messages
+    """
+    service = Service(broker, REPLAY_SERVICE)
+    publisher = BatchPublisher(broker, batch_size=batch_size, rate=rate)
+    state = _Replay(publisher, target, limit, idle_timeout)
+    service.subscribe(
+        topic,
+        name=get_replay_name(topic),
+        max_concurrency=batch_size,
+        prefetch_count=batch_size,
+    )(state.replay_message)
+
+    await service.start()
+    try:
+        await state.wait(broker)
+        await publisher.flush()
+    finally:
+        await service.stop()
+    logger.info(f"Replayed {state.replayed} messages from {topic}")
+    return state.replayed
@@ -1,4 +1,19 @@
+from __future__ import annotations
+
 from asvc.types import Encoder
+from asvc.utils.imports import import_from_string
+
+ENCODER_REGISTRY: dict[str, Encoder] = {}
+
+# Encoders resolved lazily on first lookup, as they may depend on optional packages.
+# Pickle is intentionally left out, decoding it from untrusted producers is unsafe.
+BUILTIN_ENCODERS: dict[str, tuple[str, ...]] = {
+    "application/json": (
+        "asvc.encoders.orjson:OrjsonEncoder",
+        "asvc.encoders.json:JsonEncoder",
+    ),
+    "application/x-msgpack": ("asvc.encoders.msgpack:MsgPackEncoder",),
+}
 
 
 def get_default_encoder() -> Encoder:
@@ -10,3 +25,35 @@ def get_default_encoder() -> Encoder:
         from asvc.encoders.json import JsonEncoder
 
         return JsonEncoder()
+
+
+def normalize_content_type(content_type: str) -> str:
+    """Strip media type parameters, e.g. 'application/json; charset=utf-8'"""
+    return content_type.partition(";")[0].strip().lower()
+
+
+def register_encoder(encoder: Encoder, content_type: str | None = None) -> None:
+    """
+    Register encoder used for decoding messages with given content type
+    :param encoder: Encoder instance
+    :param content_type: Content type, defaults to encoder.CONTENT_TYPE
+    """
+    ENCODER_REGISTRY[
+        normalize_content_type(content_type or encoder.CONTENT_TYPE)
+    ] = encoder
+
+
+def get_encoder(content_type: str) -> Encoder | None:
+    """Return registered encoder for content type or None if not available"""
+    content_type = normalize_content_type(content_type)
+    encoder = ENCODER_REGISTRY.get(content_type)
+    if encoder is not None:
+        return encoder
+    for path in BUILTIN_ENCODERS.get(content_type, ()):
+        try:
+            encoder = import_from_string(path)()
+        except ImportError:
+            continue
+        register_encoder(encoder, content_type)
+        return encoder
+    return None
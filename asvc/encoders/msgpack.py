@@ -3,6 +3,8 @@ from typing import Any
 import ormsgpack
 from pydantic.json import pydantic_encoder
 
+from asvc.exceptions import DecodeError
+
 
 class MsgPackEncoder:
     CONTENT_TYPE = "application/x-msgpack"
@@ -13,4 +15,7 @@ class MsgPackEncoder:
 
     @staticmethod
     def decode(data: bytes) -> Any:
-        return ormsgpack.unpackb(data)
+        try:
+            return ormsgpack.unpackb(data)
+        except ormsgpack.MsgpackDecodeError as e:
+            raise DecodeError(data=data, error=e)
@@ -3,6 +3,8 @@ from typing import Any
 import orjson
 from pydantic.json import pydantic_encoder
 
+from asvc.exceptions import DecodeError
+
 
 class OrjsonEncoder:
     CONTENT_TYPE = "application/json"
@@ -13,4 +15,7 @@ class OrjsonEncoder:
 
     @staticmethod
     def decode(data: bytes) -> Any:
-        return orjson.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise DecodeError(data=data, error=e)
@@ -52,3 +52,10 @@ class Retry(Exception):
 
     def __init__(self, delay: int | None = None):
         self.delay = delay
+
+
+class Postpone(Retry):
+    """
+    Raised by middlewares in `before_process_message` to redeliver message later
+    without processing it (e.g. over rate limit), not counted as a retry
+    """
@@ -38,6 +38,8 @@ def include_service(
                         )
                     )
 
+                return
+
         raise ConfigurationError("HealthCheckMiddleware expected")
 
 
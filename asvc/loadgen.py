@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Callable
+
+from pydantic import BaseModel
+from pydantic.fields import (
+    SHAPE_DICT,
+    SHAPE_LIST,
+    SHAPE_MAPPING,
+    SHAPE_SEQUENCE,
+    SHAPE_SET,
+    SHAPE_SINGLETON,
+    SHAPE_TUPLE_ELLIPSIS,
+    ModelField,
+)
+from typing_extensions import Literal, get_args, get_origin
+
+from .exceptions import ConfigurationError
+from .middleware import Middleware
+from .utils.datetime import utc_now
+from .utils.ids import generate_id
+
+if TYPE_CHECKING:
+    from .broker import Broker
+    from .consumer import Consumer
+    from .models import CloudEvent
+    from .service import Service
+
+_SEQUENCE_SHAPES = {SHAPE_LIST, SHAPE_SET, SHAPE_SEQUENCE, SHAPE_TUPLE_ELLIPSIS}
+_MAPPING_SHAPES = {SHAPE_DICT, SHAPE_MAPPING}
+_WILDCARDS = ("*", ">", "#")
+
+
+def _sample_model(type_: type[BaseModel]) -> dict[str, Any]:
+    return {f.alias: sample_value(f) for f in type_.__fields__.values()}
+
+
+# samplers by base type, checked in order (subclasses before their bases)
+_SAMPLERS: tuple[tuple[type, Callable[[Any], Any]], ...] = (
+    (BaseModel, _sample_model),
+    (enum.Enum, lambda t: next(iter(t)).value),
+    (datetime, lambda t: utc_now().isoformat()),
+    (date, lambda t: date.today().isoformat()),
+    (uuid.UUID, lambda t: str(uuid.uuid4())),
+    (bool, lambda t: True),
+    (int, lambda t: 1),
+    (float, lambda t: 1.0),
+    (Decimal, lambda t: "1.0"),
+    (str, lambda t: "value"),
+    ((list, set, tuple), lambda t: []),
+    (dict, lambda t: {}),
+)
+
+
+def sample_type(type_: Any) -> Any:
+    """Return example value of given type"""
+    if get_origin(type_) is Literal:
+        return get_args(type_)[0]
+    if isinstance(type_, type):
+        for base, sampler in _SAMPLERS:
+            if issubclass(type_, base):
+                return sampler(type_)
+    return "value"
+
+
+def sample_value(model_field: ModelField) -> Any:
+    """Return example value matching pydantic field"""
+    if model_field.sub_fields and model_field.shape == SHAPE_SINGLETON:
+        # Union or Optional, use first type
+        return sample_value(model_field.sub_fields[0])
+    value = sample_type(model_field.type_)
+    if model_field.shape in _SEQUENCE_SHAPES:
+        return [value]
+    if model_field.shape in _MAPPING_SHAPES:
+        return {"key": value}
+    return value
+
+
+def get_topic(consumer: Consumer) -> str:
+    """Return topic matching consumer subscription, with wildcards replaced"""
+    topic = consumer.topic
+    for wildcard in _WILDCARDS:
+        topic = topic.replace(wildcard, "bench")
+    return topic
+
+
+def make_event(consumer: Consumer) -> CloudEvent:
+    """Create synthetic event from consumer `event_type` schema"""
+    event_type = consumer.event_type
+    data_field = event_type.__fields__.get("data")
+    data = sample_value(data_field) if data_field else None
+    return event_type.parse_obj({"subject": get_topic(consumer), "data": data})
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Return p-th percentile (nearest rank) of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+@dataclass
+class BenchResult:
+    sent: int
+    processed: int
+    errors: int
+    duration: float
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.processed / self.duration if self.duration else 0.0
+
+    def summary(self) -> dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "processed": self.processed,
+            "errors": self.errors,
+            "duration_s": round(self.duration, 3),
+            "throughput_msg_s": round(self.throughput, 1),
+            "latency_p50_ms": round(percentile(latencies, 50), 3),
+            "latency_p95_ms": round(percentile(latencies, 95), 3),
+            "latency_p99_ms": round(percentile(latencies, 99), 3),
+            "latency_max_ms": round(latencies[-1] if latencies else 0.0, 3),
+        }
+
+
+class LatencyMiddleware(Middleware):
+    """Records end-to-end latency, from publish to processing end, of benchmark messages"""
+
+    def __init__(self) -> None:
+        self.sent: dict[str, int] = {}
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.publishing = True
+        self.done = asyncio.Event()
+
+    def mark_sent(self, message: CloudEvent) -> None:
+        self.sent[message.id] = time.perf_counter_ns()
+
+    def finish_publishing(self) -> None:
+        self.publishing = False
+        if not self.sent:
+            self.done.set()
+
+    async def after_process_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any | None = None,
+        exc: Exception | None = None,
+    ) -> None:
+        sent = self.sent.pop(message.id, None)
+        if sent is None:
+            return
+        self.latencies.append((time.perf_counter_ns() - sent) / 1_000_000)
+        if exc:
+            self.errors += 1
+        if not self.sent and not self.publishing:
+            self.done.set()
+
+
+def use_broker(service: Service, broker_url: str | None = None) -> Broker:
+    """
+    Replace service broker with in-memory StubBroker (keeping middlewares),
+    or connect service broker to `broker_url`. Raises `ConfigurationError`
+    for backends not configured with url
+    """
+    broker = service.broker
+    if broker_url is None:
+        from .backends.stub import StubBroker
+
+        broker = StubBroker(
+            middlewares=list(broker.middlewares), encoder=broker.encoder
+        )
+    elif hasattr(broker, "bootstrap_servers"):
+        broker.bootstrap_servers = broker_url.split("://", 1)[-1]  # type: ignore
+    elif hasattr(broker, "url"):
+        broker.url = broker_url  # type: ignore
+    else:
+        raise ConfigurationError(f"{broker!r} broker does not support broker url")
+    service.broker = broker
+    return broker
+
+
+async def run_bench(
+    service: Service,
+    count: int = 10000,
+    rate: float = 0,
+    consumers: list[str] | None = None,
+    timeout: float = 60,
+) -> BenchResult:
+    """
+    Run service, publish synthetic events to its consumers and measure
+    throughput and end-to-end latency
+    :param service: service to benchmark, with broker already set up
+    :param count: number of messages to publish
+    :param rate: messages per second, 0 means as fast as possible
+    :param consumers: names of consumers to send messages to, all by default
+    :param timeout: max time (in seconds) to wait for messages to be processed
+    """
+    targets = [
+        c for n, c in service.consumers.items() if not consumers or n in consumers
+    ]
+    if not targets:
+        raise ValueError("No consumers to benchmark")
+    templates = [make_event(c) for c in targets]
+    recorder = LatencyMiddleware()
+    service.broker.add_middleware(recorder)
+    await service.start()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        for i in range(count):
+            if rate:
+                delay = start + i / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            message = templates[i % len(templates)].copy(
+                update={"id": generate_id(), "time": utc_now()}
+            )
+            recorder.mark_sent(message)
+            await service.broker.publish_event(message)
+        recorder.finish_publishing()
+        try:
+            await asyncio.wait_for(recorder.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        duration = loop.time() - start
+    finally:
+        await service.stop()
+        service.broker.middlewares.remove(recorder)
+    return BenchResult(
+        sent=count,
+        processed=len(recorder.latencies),
+        errors=recorder.errors,
+        duration=duration,
+        latencies=recorder.latencies,
+    )
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from .utils.enum import AutoEnum
+from .utils.subjects import SubjectTrie
+
+if TYPE_CHECKING:
+    from .consumer import Consumer
+    from .models import CloudEvent
+    from .service import Service
+
+# CloudEvents extension attribute set on events delivered locally and mirrored to the broker
+LOCAL_ORIGIN = "asvcorigin"
+
+
+class DeliveryMode(AutoEnum):
+    """
+    Delivery of events published to topics with consumers running in the same process:
+    - remote: always publish to the broker (default)
+    - local: pass events directly to local consumers, publish to the broker
+      only when there are no local consumers
+    - mirror: pass events to local consumers and publish them to the broker too,
+      for other subscribers (local consumers skip their copy)
+    """
+
+    remote = AutoEnum.auto()
+    local = AutoEnum.auto()
+    mirror = AutoEnum.auto()
+
+
+class LocalMessage:
+    """Raw message of locally delivered event"""
+
+    __slots__ = ("event", "key", "deliveries")
+
+    def __init__(self, event: CloudEvent, key: tuple[str, str]) -> None:
+        self.event = event
+        self.key = key
+        self.deliveries = 1
+
+
+class LocalSubscribers:
+    """Consumers started in this process, keyed by (service name, consumer name)"""
+
+    def __init__(self) -> None:
+        self.handlers: dict[tuple[str, str], Callable[[Any], Awaitable[Any]]] = {}
+        self._subjects: SubjectTrie[tuple[str, str]] = SubjectTrie()
+        self._tasks: set[asyncio.Task] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.handlers)
+
+    def add(
+        self,
+        service: Service,
+        consumer: Consumer,
+        handler: Callable[[Any], Awaitable[Any]],
+    ) -> None:
+        key = (service.name, consumer.name)
+        if key not in self.handlers:
+            self._subjects.insert(consumer.topic, key)
+        self.handlers[key] = handler
+
+    def is_local(self, service: Service, consumer: Consumer) -> bool:
+        return (service.name, consumer.name) in self.handlers
+
+    def _spawn(self, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def deliver(self, event: CloudEvent) -> int:
+        """
+        Hand shallow copies of the event to handlers of matching consumers
+        :return: number of consumers the event was delivered to
+        """
+        keys = self._subjects.match(event.topic)
+        for key in keys:
+            self._spawn(self.handlers[key](LocalMessage(event.copy(), key)))
+        return len(keys)
+
+    def redeliver(self, message: LocalMessage, delay: float | None = None) -> None:
+        message.deliveries += 1
+        handler = self.handlers.get(message.key)
+        if handler is not None:
+            self._spawn(self._redeliver(handler, message, delay))
+
+    async def _redeliver(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        message: LocalMessage,
+        delay: float | None,
+    ) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        await handler(message)
+
+    async def close(self) -> None:
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.handlers.clear()
+        self._subjects = SubjectTrie()
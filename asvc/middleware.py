@@ -86,6 +86,18 @@ class Middleware(LoggerMixin):
     ) -> None:
         """Called after message is skipped by the middleware"""
 
+    async def after_postpone_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        delay: float | None = None,
+    ) -> None:
+        """
+        Called after message is postponed by the middleware (`Retry` or `Postpone`
+        raised in `before_process_message`), before it is rejected
+        """
+
     async def before_process_message(
         self, broker: Broker, consumer: Consumer, message: CloudEvent
     ) -> None:
@@ -100,3 +112,29 @@ class Middleware(LoggerMixin):
         exc: Exception | None = None,
     ) -> None:
         """Called after message is processed (but not acknowledged/rejected yet)"""
+
+    async def after_retries_exhausted(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        exc: Exception,
+    ) -> None:
+        """
+        Called when failed message is not retried anymore (by `RetryMiddleware`),
+        before it is acknowledged
+        """
+
+    async def after_stage_timing(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        timings: dict[str, float],
+    ) -> None:
+        """
+        Called after message handling, for messages sampled with broker
+        `stage_sample_rate`. Timings map stage name (decode, validate,
+        before_process, process, forward, after_process, ack) to its duration
+        in milliseconds
+        """
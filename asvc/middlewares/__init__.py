@@ -1,14 +1,26 @@
 from .debug import DebugMiddleware
+from .dedup import DeduplicationMiddleware, DedupStore
+from .dlq import DeadLetterMiddleware
 from .error import ErrorHandlerMiddleware
 from .healthcheck import HealthCheckMiddleware
+from .monitor import EventLoopMonitorMiddleware
 from .prometheus import PrometheusMiddleware
+from .ratelimit import RateLimitMiddleware, RateLimitStore
+from .results import ResultMiddleware
 from .retries import RetryConsumerOptions, RetryMiddleware
 
 __all__ = [
     "DebugMiddleware",
+    "DeadLetterMiddleware",
+    "DeduplicationMiddleware",
+    "DedupStore",
     "ErrorHandlerMiddleware",
     "PrometheusMiddleware",
     "HealthCheckMiddleware",
+    "EventLoopMonitorMiddleware",
+    "RateLimitMiddleware",
+    "RateLimitStore",
+    "ResultMiddleware",
     "RetryMiddleware",
     "RetryConsumerOptions",
 ]
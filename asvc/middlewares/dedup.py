@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Sequence
+
+from asvc.exceptions import Postpone, Skip
+from asvc.logger import LoggerMixin
+from asvc.middleware import Middleware
+from asvc.utils.cache import BloomFilter, TTLCache
+
+if TYPE_CHECKING:
+    from asvc.broker import Broker
+    from asvc.consumer import Consumer
+    from asvc.models import CloudEvent
+    from asvc.service import Service
+    from asvc.types import RawMessage
+
+
+class DedupStore(LoggerMixin, ABC):
+    """
+    Shared store of processed message keys. Lookups issued concurrently (in the same
+    event loop iteration) are sent to the store at once with `contains_many`
+    """
+
+    def __init__(self) -> None:
+        self._pending: dict[str, asyncio.Future] = {}
+
+    @abstractmethod
+    async def contains_many(self, keys: Sequence[str]) -> list[bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_many(self, keys: Sequence[str], ttl: float) -> None:
+        raise NotImplementedError
+
+    async def connect(self, broker: Broker) -> None:
+        """Called after broker is connected"""
+
+    async def contains(self, key: str) -> bool:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                loop.call_soon(self._lookup)
+            future = self._pending[key] = loop.create_future()
+        return await asyncio.shield(future)
+
+    def _lookup(self) -> None:
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._lookup_many(pending))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _lookup_many(self, pending: dict[str, asyncio.Future]) -> None:
+        try:
+            found = await self.contains_many(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                future.set_exception(e)
+                future.exception()
+        else:
+            for future, value in zip(pending.values(), found):
+                future.set_result(value)
+
+
+class DeduplicationMiddleware(Middleware):
+    """
+    Skips messages already processed by consumer queue group (by `CloudEvent.id`).
+    Keys of processed messages are kept in bounded local cache per queue group
+    and optionally in shared store, messages are not marked as processed when processing
+    failed, so they can be retried. Redeliveries of messages still being processed
+    are nacked with `in_flight_delay`.
+    Can be disabled per consumer with `deduplicate=False` option.
+    :param ttl: time (in seconds) to remember processed message
+    :param max_size: max number of messages remembered by every queue group
+    :param bloom: use Bloom filter instead of LRU cache, with less memory per key,
+        but no TTL (oldest keys are forgotten in generations of `max_size`) and
+        rare false positives (`error_rate`), i.e. skipped messages not processed before
+    :param error_rate: Bloom filter false positive rate
+    :param store: shared store checked when message is not found locally
+    :param in_flight_delay: delay (in seconds) of redelivery of message
+        received while it is being processed
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_size: int = 100_000,
+        bloom: bool = False,
+        error_rate: float = 0.001,
+        store: DedupStore | None = None,
+        in_flight_delay: float = 5,
+    ) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bloom = bloom
+        self.error_rate = error_rate
+        self.store = store
+        self.in_flight_delay = in_flight_delay
+        self._caches: dict[str, TTLCache[str, bool] | BloomFilter] = {}
+        self._groups: dict[Consumer, str] = {}
+        # keys of messages being processed, by id of raw message
+        self._in_flight: dict[int, str] = {}
+        self._processing: set[str] = set()
+
+    def get_group(self, consumer: Consumer) -> str:
+        """Return queue group (`<service>:<consumer>`) of consumer"""
+        return self._groups.get(consumer, consumer.name)
+
+    def get_cache(self, consumer: Consumer) -> TTLCache[str, bool] | BloomFilter:
+        group = self.get_group(consumer)
+        cache = self._caches.get(group)
+        if cache is None:
+            if self.bloom:
+                cache = BloomFilter(self.max_size, self.error_rate)
+            else:
+                cache = TTLCache(self.max_size, self.ttl)
+            self._caches[group] = cache
+        return cache
+
+    def get_key(self, consumer: Consumer, message: CloudEvent) -> str:
+        return f"{self.get_group(consumer)}:{message.id}"
+
+    def _remember(self, consumer: Consumer, message: CloudEvent) -> None:
+        cache = self.get_cache(consumer)
+        if isinstance(cache, BloomFilter):
+            cache.add(message.id)
+        else:
+            cache.set(message.id, True)
+
+    async def after_broker_connect(self, broker: Broker) -> None:
+        if self.store is not None:
+            await self.store.connect(broker)
+
+    async def before_consumer_start(
+        self, broker: Broker, service: Service, consumer: Consumer
+    ) -> None:
+        self._groups[consumer] = f"{service.name}:{consumer.name}"
+
+    def _start_processing(self, consumer: Consumer, message: CloudEvent) -> None:
+        key = self.get_key(consumer, message)
+        if key in self._processing:
+            self.logger.info(f"Message {message.id} is being processed, postponed")
+            raise Postpone(delay=self.in_flight_delay)  # type: ignore[arg-type]
+        self._processing.add(key)
+        self._in_flight[id(message.raw)] = key
+
+    def _stop_processing(self, message: RawMessage) -> None:
+        key = self._in_flight.pop(id(message), None)
+        if key is not None:
+            self._processing.discard(key)
+
+    async def before_process_message(
+        self, broker: Broker, consumer: Consumer, message: CloudEvent
+    ) -> None:
+        if not consumer.options.get("deduplicate", True):
+            return
+        if message.id in self.get_cache(consumer):
+            self.logger.info(f"Duplicate message {message.id} skipped")
+            raise Skip()
+        if self.store is not None and await self._is_stored(consumer, message):
+            self._remember(consumer, message)
+            self.logger.info(f"Duplicate message {message.id} skipped")
+            raise Skip()
+        self._start_processing(consumer, message)
+
+    async def _is_stored(self, consumer: Consumer, message: CloudEvent) -> bool:
+        try:
+            return await self.store.contains(  # type: ignore[union-attr]
+                self.get_key(consumer, message)
+            )
+        except Exception as e:
+            self.logger.exception("Deduplication store lookup failed", exc_info=e)
+            return False
+
+    async def after_process_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any | None = None,
+        exc: Exception | None = None,
+    ) -> None:
+        if exc is not None or not consumer.options.get("deduplicate", True):
+            return
+        self._remember(consumer, message)
+        if self.store is None:
+            return
+        try:
+            await self.store.add_many([self.get_key(consumer, message)], self.ttl)
+        except Exception as e:
+            self.logger.exception("Deduplication store update failed", exc_info=e)
+
+    async def after_ack(
+        self, broker: Broker, consumer: Consumer, message: RawMessage
+    ) -> None:
+        self._stop_processing(message)
+
+    async def after_nack(
+        self, broker: Broker, consumer: Consumer, message: RawMessage
+    ) -> None:
+        self._stop_processing(message)
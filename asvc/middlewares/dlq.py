@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from asvc.exceptions import Fail
+from asvc.middleware import Middleware
+from asvc.publisher import BatchPublisher
+from asvc.utils.datetime import utc_now
+
+if TYPE_CHECKING:
+    from asvc.broker import Broker
+    from asvc.consumer import Consumer
+    from asvc.models import CloudEvent
+
+# CloudEvents extension attributes with failure metadata of dead-lettered events
+DLQ_TOPIC = "dlqtopic"
+DLQ_CONSUMER = "dlqconsumer"
+DLQ_ERROR = "dlqerror"
+DLQ_DELIVERIES = "dlqdeliveries"
+DLQ_TIME = "dlqtime"
+DLQ_ATTRIBUTES = frozenset(
+    {DLQ_TOPIC, DLQ_CONSUMER, DLQ_ERROR, DLQ_DELIVERIES, DLQ_TIME}
+)
+
+MAX_ERROR_LENGTH = 1000
+
+
+class DeadLetterMiddleware(Middleware):
+    """
+    Publishes messages that failed permanently (retries exhausted in `RetryMiddleware`
+    or `Fail` raised) to dead letter topic, `<topic>.dlq` by default, with failure
+    metadata as CloudEvents extension attributes (dlqtopic, dlqconsumer, dlqerror,
+    dlqdeliveries, dlqtime). Dead letters are published in batches, the failed message
+    is acknowledged only after its batch is published, otherwise it is nacked.
+    :param topic: dead letter topic template, `{topic}` is replaced with original topic
+    :param batch_size: max number of dead letters published at once
+    :param linger: max time (in seconds) to wait for more dead letters to publish at once
+    :param retry_delay: delay (in seconds) of redelivery if dead letter publishing failed
+    """
+
+    def __init__(
+        self,
+        topic: str = "{topic}.dlq",
+        batch_size: int = 100,
+        linger: float = 0.05,
+        retry_delay: float = 10,
+    ) -> None:
+        self.topic = topic
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retry_delay = retry_delay
+        self._publishers: dict[int, BatchPublisher] = {}
+
+    def get_topic(self, message: CloudEvent) -> str:
+        return self.topic.format(topic=message.topic)
+
+    def get_publisher(self, broker: Broker) -> BatchPublisher:
+        publisher = self._publishers.get(id(broker))
+        if publisher is None:
+            publisher = self._publishers[id(broker)] = BatchPublisher(
+                broker, batch_size=self.batch_size, linger=self.linger
+            )
+        return publisher
+
+    def make_dead_letter(
+        self, consumer: Consumer, message: CloudEvent, exc: Exception
+    ) -> CloudEvent:
+        metadata: dict[str, Any] = {
+            "topic": self.get_topic(message),
+            DLQ_TOPIC: message.topic,
+            DLQ_CONSUMER: consumer.name,
+            DLQ_ERROR: f"{type(exc).__name__}: {exc}"[:MAX_ERROR_LENGTH],
+            DLQ_DELIVERIES: message.delivery_count,
+            DLQ_TIME: utc_now().isoformat(),
+        }
+        return message.copy(update=metadata)
+
+    async def dead_letter(
+        self, broker: Broker, consumer: Consumer, message: CloudEvent, exc: Exception
+    ) -> None:
+        dead_letter = self.make_dead_letter(consumer, message, exc)
+        try:
+            await self.get_publisher(broker).publish(dead_letter)
+        except Exception as e:
+            self.logger.exception(
+                f"Dead letter {message.id} not published, retrying", exc_info=e
+            )
+            await broker.nack(consumer, message.raw, self.retry_delay)
+            return
+        self.logger.warning(
+            f"Message {message.id} dead-lettered to {dead_letter.topic}: {exc!r}"
+        )
+        await broker.ack(consumer, message.raw)
+
+    async def after_retries_exhausted(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        exc: Exception,
+    ) -> None:
+        await self.dead_letter(broker, consumer, message, exc)
+
+    async def after_process_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any | None = None,
+        exc: Exception | None = None,
+    ) -> None:
+        if isinstance(exc, Fail):
+            await self.dead_letter(broker, consumer, message, exc)
+
+    async def before_broker_disconnect(self, broker: Broker) -> None:
+        publisher = self._publishers.pop(id(broker), None)
+        if publisher is not None:
+            await publisher.flush()
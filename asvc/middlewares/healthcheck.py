@@ -3,16 +3,25 @@ from __future__ import annotations
 import asyncio
 import os
 from pathlib import Path
-from typing import TYPE_CHECKING, Awaitable, Callable, Sequence
+from typing import TYPE_CHECKING, Callable, Sequence
 
 from asvc.middleware import Middleware
 
 if TYPE_CHECKING:
     from asvc.broker import Broker
+    from asvc.service import Service
 
 
 class HealthCheckMiddleware(Middleware):
-    """Middleware for performing basic health checks on broker"""
+    """
+    Middleware for performing basic health checks on broker
+    :param interval: health check interval (in seconds) in file mode
+    :param file_mode: report health status with "healthy"/"unhealthy" file
+        in HEALTHCHECK_DIR directory
+    :param checkers: additional health checks, callables returning bool,
+        e.g. `EventLoopMonitorMiddleware.get_health_status`.
+        Consumers liveness of started services is checked by default
+    """
 
     BASE_DIR = os.getenv("HEALTHCHECK_DIR", "/tmp")  # nosec
 
@@ -20,11 +29,13 @@ class HealthCheckMiddleware(Middleware):
         self,
         interval: int = 30,
         file_mode: bool = False,
-        checkers: Sequence[Callable[..., Awaitable[bool]]] | None = None,
+        checkers: Sequence[Callable[[], bool]] | None = None,
     ):
         self.interval = interval
         self.file_mode = file_mode
-        self._checkers = checkers
+        self._checkers = list(checkers or [])
+        # supervisor checks by service name, replaced when service is restarted
+        self._services: dict[str, Callable[[], bool]] = {}
         self._broker: Broker | None = None
         self._task: asyncio.Task | None = None
 
@@ -33,6 +44,9 @@ class HealthCheckMiddleware(Middleware):
         if self.file_mode:
             self._task = asyncio.create_task(self._run_forever())
 
+    async def after_service_start(self, broker: Broker, service: Service):
+        self._services[service.name] = service.supervisor.get_health_status
+
     async def before_broker_disconnect(self, broker: Broker):
         if self.file_mode and self._task:
             self._task.cancel()
@@ -51,6 +65,8 @@ class HealthCheckMiddleware(Middleware):
             pass
 
     def get_health_status(self) -> bool:
-        if self._broker:
-            return self._broker.is_connected
+        if self._broker and self._broker.is_connected:
+            return all(checker() for checker in self._checkers) and all(
+                checker() for checker in self._services.values()
+            )
         return False
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+from asvc.middleware import Middleware
+
+if TYPE_CHECKING:
+    from prometheus_client import Gauge
+    from prometheus_client.registry import CollectorRegistry
+
+    from asvc import Broker
+
+# lag and tasks gauges by registry, shared by monitors of the same process
+_gauges: dict[CollectorRegistry, tuple[Gauge, Gauge]] = {}
+
+
+def get_loop_gauges(registry: CollectorRegistry | None = None) -> tuple[Gauge, Gauge]:
+    """Return event loop lag and tasks gauges registered in `registry`"""
+    from prometheus_client import REGISTRY, Gauge
+
+    registry = registry or REGISTRY
+    try:
+        return _gauges[registry]
+    except KeyError:
+        gauges = _gauges[registry] = (
+            Gauge(
+                "event_loop_lag_seconds",
+                "Event loop scheduling delay",
+                registry=registry,
+                multiprocess_mode="livemax",
+            ),
+            Gauge(
+                "event_loop_tasks",
+                "Number of running asyncio tasks",
+                registry=registry,
+                multiprocess_mode="livesum",
+            ),
+        )
+        return gauges
+
+
+class EventLoopMonitorMiddleware(Middleware):
+    """
+    Samples event loop scheduling delay (lag) and number of running tasks.
+    Lag is the time a sleeping task is woken up later than scheduled, high values
+    mean that the loop is blocked, e.g. by sync code in a consumer.
+    :param interval: sampling interval (in seconds)
+    :param lag_threshold: lag (in seconds) above which service is reported unhealthy
+    :param pause_consumers: pause broker consumers while lag is above threshold
+    :param resume_threshold: lag (in seconds) below which paused consumers are resumed,
+        defaults to half of `lag_threshold`
+    :param export_metrics: export lag and tasks as prometheus gauges,
+        shared by all monitors using the same registry
+    :param registry: prometheus registry, defaults to the global registry
+    """
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        lag_threshold: float = 0.5,
+        pause_consumers: bool = False,
+        resume_threshold: float | None = None,
+        export_metrics: bool = False,
+        registry: CollectorRegistry | None = None,
+    ):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.pause_consumers = pause_consumers
+        self.resume_threshold = (
+            lag_threshold / 2 if resume_threshold is None else resume_threshold
+        )
+        self.lag = 0.0
+        self.tasks = 0
+        self._paused = False
+        self._task: asyncio.Task | None = None
+        self.lag_gauge = self.tasks_gauge = None
+        if export_metrics:
+            self.lag_gauge, self.tasks_gauge = get_loop_gauges(registry)
+
+    def get_health_status(self) -> bool:
+        return self.lag < self.lag_threshold
+
+    def update(self, broker: Broker, lag: float, tasks: int) -> None:
+        """Record a sample, pause or resume consumers if needed"""
+        self.lag = lag
+        self.tasks = tasks
+        if self.lag_gauge is not None:
+            self.lag_gauge.set(lag)
+            self.tasks_gauge.set(tasks)  # type: ignore
+        if not self.pause_consumers:
+            return
+        if not self._paused and lag >= self.lag_threshold:
+            self.logger.warning(f"Event loop lag {lag:.3f}s, pausing consumers")
+            self._paused = True
+            broker.pause()
+        elif self._paused and lag < self.resume_threshold:
+            self.logger.info(f"Event loop lag {lag:.3f}s, resuming consumers")
+            self._paused = False
+            broker.resume()
+
+    async def _run_forever(self, broker: Broker) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.update(broker, lag, len(asyncio.all_tasks(loop)))
+
+    async def after_broker_connect(self, broker: Broker) -> None:
+        self._task = asyncio.create_task(self._run_forever(broker))
+
+    async def before_broker_disconnect(self, broker: Broker) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._paused:
+            self._paused = False
+            broker.resume()
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import asyncio
+import glob
+import importlib
+import os
+import time
+from contextvars import ContextVar
 from typing import TYPE_CHECKING, Any
 
 from asvc.middleware import Middleware
-from asvc.utils.datetime import current_millis
 
 if TYPE_CHECKING:
     from prometheus_client.registry import CollectorRegistry
@@ -33,8 +38,205 @@ DEFAULT_BUCKETS = (
     float("inf"),
 )
 
+STAGE_BUCKETS = (
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    float("inf"),
+)
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def is_multiprocess() -> bool:
+    """Check if prometheus client runs in multiprocess mode"""
+    return bool(os.environ.get(MULTIPROC_DIR_ENV))
+
+
+def enable_multiprocess(path: str) -> None:
+    """
+    Switch prometheus client to multiprocess mode, metric values are stored in
+    `path` shared by all worker processes. Metrics created before this call
+    keep their in-memory values, so it should be called before creating middleware.
+    :param path: directory for metric files
+    """
+    from prometheus_client import values
+
+    os.makedirs(path, exist_ok=True)
+    os.environ[MULTIPROC_DIR_ENV] = path
+    # value class is selected on import of prometheus_client.values
+    importlib.reload(values)
+
+
+def clear_multiprocess_dir(path: str | None = None) -> None:
+    """
+    Remove metric files left by previous runs,
+    should be called by the parent process before starting workers
+    """
+    path = path or os.environ[MULTIPROC_DIR_ENV]
+    for filename in glob.glob(os.path.join(path, "*.db")):
+        os.remove(filename)
+
+
+def mark_process_dead(pid: int, path: str | None = None) -> None:
+    """Remove live gauge values of exited worker process"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid, path)
+
+
+def get_multiprocess_registry(path: str | None = None) -> CollectorRegistry:
+    """Return registry collecting metrics of all worker processes"""
+    from prometheus_client import CollectorRegistry, multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    return registry
+
+
+def start_multiprocess_server(
+    port: int, host: str = "0.0.0.0", path: str | None = None  # nosec
+) -> None:
+    """
+    Start http server exposing metrics aggregated from all worker processes,
+    usually run by the parent (supervisor) process
+    """
+    from prometheus_client import start_http_server
+
+    start_http_server(port, host, registry=get_multiprocess_registry(path))
+
+
+class _ConsumerMetrics:
+    """
+    Metric children bound to (topic, service, consumer) labels, updated immediately
+    or, with `batch_size` > 1, buffered and applied by `flush()`
+    """
+
+    __slots__ = (
+        "batched",
+        "in_progress_gauge",
+        "total",
+        "skipped",
+        "errored",
+        "rejected",
+        "durations_histogram",
+        "in_progress",
+        "pending_total",
+        "pending_skipped",
+        "pending_errored",
+        "pending_rejected",
+        "pending_durations",
+    )
+
+    def __init__(self, middleware: PrometheusMiddleware, labels: tuple[str, ...]):
+        self.batched = middleware.batch_size > 1
+        self.in_progress_gauge = middleware.in_progress.labels(*labels)
+        self.total = middleware.total_messages.labels(*labels)
+        self.skipped = middleware.total_skipped_messages.labels(*labels)
+        self.errored = middleware.total_errored_messages.labels(*labels)
+        self.rejected = middleware.total_rejected_messages.labels(*labels)
+        self.durations_histogram = middleware.message_durations.labels(*labels)
+        self.in_progress = 0
+        self.pending_total = 0
+        self.pending_skipped = 0
+        self.pending_errored = 0
+        self.pending_rejected = 0
+        self.pending_durations: list[float] = []
+
+    def start(self) -> None:
+        self.in_progress += 1
+        if not self.batched:
+            self.in_progress_gauge.inc()
+
+    def finish(self, duration: float | None, errored: bool) -> None:
+        self.in_progress -= 1
+        if not self.batched:
+            self.in_progress_gauge.dec()
+            self.total.inc()
+            if errored:
+                self.errored.inc()
+            if duration is not None:
+                self.durations_histogram.observe(duration)
+            return
+        self.pending_total += 1
+        if errored:
+            self.pending_errored += 1
+        if duration is not None:
+            self.pending_durations.append(duration)
+
+    def cancel(self) -> None:
+        self.in_progress -= 1
+        if not self.batched:
+            self.in_progress_gauge.dec()
+
+    def skip(self, started: bool) -> None:
+        if started:
+            self.cancel()
+        if self.batched:
+            self.pending_skipped += 1
+        else:
+            self.skipped.inc()
+
+    def reject(self) -> None:
+        if self.batched:
+            self.pending_rejected += 1
+        else:
+            self.rejected.inc()
+
+    def flush(self) -> None:
+        if not self.batched:
+            return
+        self.in_progress_gauge.set(self.in_progress)
+        if self.pending_total:
+            self.total.inc(self.pending_total)
+            self.pending_total = 0
+        if self.pending_skipped:
+            self.skipped.inc(self.pending_skipped)
+            self.pending_skipped = 0
+        if self.pending_errored:
+            self.errored.inc(self.pending_errored)
+            self.pending_errored = 0
+        if self.pending_rejected:
+            self.rejected.inc(self.pending_rejected)
+            self.pending_rejected = 0
+        durations, self.pending_durations = self.pending_durations, []
+        for duration in durations:
+            self.durations_histogram.observe(duration)
+
 
 class PrometheusMiddleware(Middleware):
+    """
+    Prometheus exporter of message processing metrics.
+    Metrics are updated immediately, with `batch_size` > 1 updates are buffered
+    and applied every `flush_interval` seconds, or after `batch_size` messages
+    processed by a consumer.
+    With several worker processes, set `multiprocess_dir` (or PROMETHEUS_MULTIPROC_DIR
+    env variable) to a directory shared by all workers. Exposed metrics are then
+    aggregated from all processes, the http server is started by the first worker
+    able to bind `server_port`, or by the parent process with `start_multiprocess_server`.
+    :param run_server: start prometheus http server on broker connect
+    :param registry: prometheus registry, defaults to the global registry
+    :param buckets: message duration histogram buckets (in milliseconds)
+    :param server_host: http server host
+    :param server_port: http server port
+    :param batch_size: max number of buffered updates per consumer,
+        metrics are updated immediately by default
+    :param flush_interval: interval (in seconds) of applying buffered updates
+    :param multiprocess_dir: directory for metric files in multiprocess mode
+    """
+
     def __init__(
         self,
         run_server: bool = False,
@@ -42,21 +244,36 @@ class PrometheusMiddleware(Middleware):
         buckets: tuple[float] | None = None,
         server_host: str = "0.0.0.0",  # nosec
         server_port: int = 8888,
+        batch_size: int = 1,
+        flush_interval: float = 1.0,
+        multiprocess_dir: str | None = None,
     ):
         from prometheus_client import REGISTRY, Counter, Gauge, Histogram
 
+        if multiprocess_dir:
+            enable_multiprocess(multiprocess_dir)
+        self.multiprocess = is_multiprocess()
         self.run_server = run_server
         self.registry = registry or REGISTRY
         self.buckets = buckets or DEFAULT_BUCKETS
         self.server_host = server_host
         self.server_port = server_port
-        self.message_start_times: dict[str, int] = {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
         self.service_name: str | None = None
+        self._consumers: dict[Consumer, _ConsumerMetrics] = {}
+        self._published: dict[tuple[str, str | None], Any] = {}
+        self._stages: dict[tuple[Consumer, str], Any] = {}
+        self._message_start: ContextVar[int] = ContextVar(
+            f"prometheus_message_start_{id(self)}", default=0
+        )
+        self._task: asyncio.Task | None = None
         self.in_progress = Gauge(
             "messages_in_progress",
             "Total number of messages being processed.",
             ["topic", "service", "consumer"],
             registry=self.registry,
+            multiprocess_mode="livesum",
         )
         self.total_messages = Counter(
             "messages_total",
@@ -67,6 +284,7 @@ class PrometheusMiddleware(Middleware):
         self.total_skipped_messages = Counter(
             "messages_skipped_total",
             "Total number of messages skipped processing.",
+            ["topic", "service", "consumer"],
             registry=self.registry,
         )
         self.total_messages_published = Counter(
@@ -94,16 +312,54 @@ class PrometheusMiddleware(Middleware):
             registry=self.registry,
             buckets=self.buckets,
         )
+        self.message_stage_durations = Histogram(
+            "message_stage_duration_ms",
+            "Time spend in message handling stage, for sampled messages",
+            ["topic", "service", "consumer", "stage"],
+            registry=self.registry,
+            buckets=STAGE_BUCKETS,
+        )
+
+    def _get_metrics(self, consumer: Consumer) -> _ConsumerMetrics:
+        try:
+            return self._consumers[consumer]
+        except KeyError:
+            metrics = self._consumers[consumer] = _ConsumerMetrics(
+                self, (consumer.topic, self.service_name, consumer.name)
+            )
+            return metrics
+
+    def _maybe_flush(self, metrics: _ConsumerMetrics) -> None:
+        if len(metrics.pending_durations) >= self.batch_size:
+            metrics.flush()
+
+    def flush(self) -> None:
+        """Apply all buffered metric updates"""
+        for metrics in self._consumers.values():
+            metrics.flush()
+
+    async def _flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
 
     async def before_service_start(self, broker: Broker, service: Service):
         self.service_name = service.name
 
+    async def after_consumer_start(
+        self, broker: Broker, service: Service, consumer: Consumer
+    ) -> None:
+        self.service_name = service.name
+        self._consumers.setdefault(
+            consumer,
+            _ConsumerMetrics(self, (consumer.topic, service.name, consumer.name)),
+        )
+
     async def before_process_message(
         self, broker: Broker, consumer: Consumer, message: CloudEvent
     ):
-        labels = (consumer.topic, self.service_name, consumer.name)
-        self.in_progress.labels(*labels).inc()
-        self.message_start_times[message.id] = current_millis()
+        self._get_metrics(consumer).start()
+        self._message_start.set(time.perf_counter_ns())
 
     async def after_process_message(
         self,
@@ -113,33 +369,90 @@ class PrometheusMiddleware(Middleware):
         result: Any | None = None,
         exc: Exception | None = None,
     ):
-        labels = (consumer.topic, self.service_name, consumer.name)
-        self.in_progress.labels(*labels).dec()
-        self.total_messages.labels(*labels).inc()
-        if exc:
-            self.total_errored_messages.labels(*labels).inc()
-
-        message_start_time = self.message_start_times.pop(message.id, current_millis())
-        message_duration = current_millis() - message_start_time
-        self.message_durations.labels(*labels).observe(message_duration)
+        end = time.perf_counter_ns()
+        start = self._message_start.get()
+        self._message_start.set(0)
+        metrics = self._get_metrics(consumer)
+        metrics.finish((end - start) / 1_000_000 if start else None, exc is not None)
+        self._maybe_flush(metrics)
 
     async def after_skip_message(
         self, broker: Broker, consumer: Consumer, message: CloudEvent
     ) -> None:
-        labels = (consumer.topic, self.service_name, consumer.name)
-        self.total_skipped_messages.labels(*labels).inc()
+        # message skipped by another middleware, after this one started timing
+        started = bool(self._message_start.get())
+        if started:
+            self._message_start.set(0)
+        self._get_metrics(consumer).skip(started)
+
+    async def after_postpone_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        delay: float | None = None,
+    ) -> None:
+        # postponed by another middleware, after this one started timing
+        if self._message_start.get():
+            self._message_start.set(0)
+            self._get_metrics(consumer).cancel()
 
     async def after_publish(self, broker: Broker, message: CloudEvent, **kwargs):
-        self.total_messages_published.labels(message.topic, message.source).inc()
+        key = (message.topic, message.source)
+        try:
+            counter = self._published[key]
+        except KeyError:
+            counter = self._published[key] = self.total_messages_published.labels(*key)
+        counter.inc()
+
+    async def after_stage_timing(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        timings: dict[str, float],
+    ) -> None:
+        for stage, duration in timings.items():
+            key = (consumer, stage)
+            try:
+                histogram = self._stages[key]
+            except KeyError:
+                histogram = self._stages[key] = self.message_stage_durations.labels(
+                    consumer.topic, self.service_name, consumer.name, stage
+                )
+            histogram.observe(duration)
 
     async def after_nack(self, broker: Broker, consumer: Consumer, message: RawMessage):
-        labels = (consumer.topic, self.service_name, consumer.name)
-        self.total_rejected_messages.labels(*labels).inc()
+        self._get_metrics(consumer).reject()
 
     async def after_broker_connect(self, broker: Broker):
+        if self.batch_size > 1:
+            self._task = asyncio.create_task(self._flush_forever())
         if self.run_server:
-            from prometheus_client import start_http_server
+            self._start_server()
 
+    def _start_server(self) -> None:
+        from prometheus_client import start_http_server
+
+        if not self.multiprocess:
             start_http_server(
                 self.server_port, self.server_host, registry=self.registry
             )
+            return
+        try:
+            start_multiprocess_server(self.server_port, self.server_host)
+        except OSError as e:
+            self.logger.info(
+                f"Metrics server not started ({e}), "
+                f"port {self.server_port} is served by another process"
+            )
+
+    async def before_broker_disconnect(self, broker: Broker):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+
+    async def after_broker_disconnect(self, broker: Broker):
+        if self.multiprocess:
+            mark_process_dead(os.getpid())
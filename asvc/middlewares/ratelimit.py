@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable
+
+from asvc.exceptions import Postpone
+from asvc.logger import LoggerMixin
+from asvc.middleware import Middleware
+
+if TYPE_CHECKING:
+    from asvc.broker import Broker
+    from asvc.consumer import Consumer
+    from asvc.models import CloudEvent
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with `rate` tokens per second up to `burst` tokens
+    :param rate: tokens per second
+    :param burst: max number of tokens, defaults to `rate` (at least 1)
+    :param timer: monotonic clock
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "timer")
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.timer = timer
+        self.updated_at = timer()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens, return 0 if taken, otherwise time (in seconds) until available
+        """
+        now = self.timer()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimitStore(LoggerMixin, ABC):
+    """Shared token buckets, tokens are leased in batches to limit round trips"""
+
+    async def connect(self, broker: Broker) -> None:
+        """Called after broker is connected"""
+
+    @abstractmethod
+    async def lease(
+        self, key: str, rate: float, burst: float, count: int
+    ) -> tuple[int, float]:
+        """
+        Take up to `count` tokens from bucket `key`
+        :return: number of taken tokens and time (in seconds) until next token
+            is available if none was taken
+        """
+        raise NotImplementedError
+
+
+class RateLimitMiddleware(Middleware):
+    """
+    Limits rate of processed messages with token bucket per consumer (or per topic),
+    consumers are limited with `rate_limit` (messages per second) and optional
+    `rate_burst` options. Messages over limit are postponed, nacked with delay
+    (not processed and not counted as retries), so they do not block consumer.
+    Limits are shared across service instances with `store`, tokens are leased from it
+    in batches of `lease_size`. Leased tokens not used within `lease_size / rate`
+    seconds are dropped, so idle instances do not exceed the shared rate later.
+    Publishing to `topics` is limited as well, `publish` waits for free token.
+    :param per: limit per `consumer` or per `topic` of consumed message
+    :param topics: max published messages per second by topic
+    :param store: shared store of token buckets, limits are local by default
+    :param lease_size: max number of tokens leased from store at once
+    :param timer: monotonic clock
+    """
+
+    def __init__(
+        self,
+        per: str = "consumer",
+        topics: dict[str, float] | None = None,
+        store: RateLimitStore | None = None,
+        lease_size: int = 10,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert per in ("consumer", "topic"), "Limit per consumer or topic expected"
+        self.per = per
+        self.topics = topics or {}
+        self.store = store
+        self.lease_size = lease_size
+        self.timer = timer
+        self._buckets: dict[str, TokenBucket] = {}
+        # leased tokens by key, with time they expire at
+        self._leased: dict[str, tuple[int, float]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def get_bucket(self, key: str, rate: float, burst: float | None) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _take_leased(self, key: str) -> bool:
+        leased, expires = self._leased.get(key, (0, 0.0))
+        if leased <= 0:
+            return False
+        if expires <= self.timer():
+            del self._leased[key]
+            return False
+        self._leased[key] = (leased - 1, expires)
+        return True
+
+    async def acquire(self, key: str, rate: float, burst: float | None = None) -> float:
+        """Take a token, return 0 if taken, otherwise time (in seconds) to wait"""
+        if self.store is None:
+            return self.get_bucket(key, rate, burst).acquire()
+        if self._take_leased(key):
+            return 0.0
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # leased by concurrent caller
+            if self._take_leased(key):
+                return 0.0
+            burst = burst or max(rate, 1)
+            try:
+                granted, wait = await self.store.lease(
+                    key, rate, burst, min(self.lease_size, int(burst))
+                )
+            except Exception as e:
+                self.logger.exception("Leasing tokens failed", exc_info=e)
+                return self.get_bucket(key, rate, burst).acquire()
+            if granted:
+                self._leased[key] = (granted - 1, self.timer() + granted / rate)
+                return 0.0
+            return wait
+
+    async def after_broker_connect(self, broker: Broker) -> None:
+        if self.store is not None:
+            await self.store.connect(broker)
+
+    async def before_process_message(
+        self, broker: Broker, consumer: Consumer, message: CloudEvent
+    ) -> None:
+        rate = consumer.options.get("rate_limit")
+        if not rate:
+            return
+        key = consumer.name if self.per == "consumer" else message.topic
+        wait = await self.acquire(key, rate, consumer.options.get("rate_burst"))
+        if wait:
+            # spread redeliveries of messages over limit
+            delay = wait + random.uniform(0, wait)
+            raise Postpone(delay=delay)  # type: ignore[arg-type]
+
+    async def before_publish(
+        self, broker: Broker, message: CloudEvent, **kwargs
+    ) -> None:
+        rate = self.topics.get(message.topic)
+        if not rate:
+            return
+        key = f"publish:{message.topic}"
+        wait = await self.acquire(key, rate)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = await self.acquire(key, rate)
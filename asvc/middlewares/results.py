@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+import async_timeout
+
+from asvc.middleware import Middleware
+from asvc.utils.batching import Batcher
+from asvc.utils.cache import TTLCache
+
+if TYPE_CHECKING:
+    from asvc.broker import Broker
+    from asvc.consumer import Consumer
+    from asvc.models import CloudEvent
+    from asvc.types import Encoder
+
+_MISSING = object()
+
+# key, encoded result, ttl (in seconds)
+StoredResult = Tuple[str, bytes, Optional[int]]
+
+
+class ResultWriter(Batcher[StoredResult]):
+    """Write-behind buffer of results, written with bounded retries with jitter"""
+
+    def __init__(
+        self,
+        backend: ResultMiddleware,
+        batch_size: int = 100,
+        linger: float = 0.01,
+        max_retries: int = 3,
+        backoff: float = 0.1,
+    ) -> None:
+        super().__init__(batch_size=batch_size, linger=linger)
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def process(self, batch: list[StoredResult]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.backend.write_many(batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.backend.logger.exception(
+                        f"Storing {len(batch)} results failed", exc_info=e
+                    )
+                    raise
+                # full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+
+class ResultMiddleware(Middleware, ABC):
+    """
+    Base class of result backends, storing results of consumers with `store_results`
+    option. Results are written in batches (write-behind), with `wait_for_write=False`
+    messages are acked without waiting until their results are written.
+    Waiting for results is served by one watch (subscription) of the backend
+    shared by all waiters, recently received results are kept in local LRU cache.
+    :param encoder: results encoder, default encoder by default
+    :param cache_size: max number of results kept in local cache
+    :param watch_retry_delay: delay (in seconds) before watching again after failure
+    :param batch_size: max number of results written at once
+    :param linger: max time (in seconds) to wait for more results to write at once
+    :param wait_for_write: wait until result is written before message is acked
+    :param max_retries: max number of write retries (with exponential backoff and jitter)
+    """
+
+    def __init__(
+        self,
+        encoder: Encoder | None = None,
+        cache_size: int = 1000,
+        watch_retry_delay: float = 1.0,
+        batch_size: int = 100,
+        linger: float = 0.01,
+        wait_for_write: bool = True,
+        max_retries: int = 3,
+    ) -> None:
+        if encoder is None:
+            from asvc.encoders import get_default_encoder
+
+            encoder = get_default_encoder()
+        self.encoder = encoder
+        self.watch_retry_delay = watch_retry_delay
+        self._cache: TTLCache[str, Any] = TTLCache(cache_size)
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+        self._watcher: asyncio.Task | None = None
+        self._watching = asyncio.Event()
+        self.wait_for_write = wait_for_write
+        self.writer = ResultWriter(
+            self, batch_size=batch_size, linger=linger, max_retries=max_retries
+        )
+
+    def get_key(self, consumer: Consumer | str, message_id: str) -> str:
+        name = consumer if isinstance(consumer, str) else consumer.name
+        return f"{name}:{message_id}"
+
+    def get_ttl(self, consumer: Consumer) -> int | None:
+        return consumer.options.get("result_ttl")
+
+    @abstractmethod
+    async def write_many(self, results: list[StoredResult]) -> None:
+        """Store encoded results at once"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _get(self, key: str) -> bytes | None:
+        """Return stored (encoded) result or `None` if there is none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _watch(self) -> None:
+        """
+        Subscribe to stored results, set `_watching` event once subscribed
+        and call `notify` with stored results awaited in `_waiters`
+        """
+        raise NotImplementedError
+
+    def notify(self, key: str, data: bytes) -> None:
+        """Pass stored result to waiters"""
+        value = self.encoder.decode(data)
+        self._cache.set(key, value)
+        for future in self._waiters.get(key, ()):
+            if not future.done():
+                future.set_result(value)
+
+    async def _run_watch(self) -> None:
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.exception("Watching results failed", exc_info=e)
+            self._watching.clear()
+            await asyncio.sleep(self.watch_retry_delay)
+
+    async def wait_for(
+        self, consumer: Consumer | str, message_id: str, timeout: float | None = None
+    ) -> Any:
+        """
+        Wait until result of message processing is stored and return it
+        :param consumer: consumer (or its name) processing the message
+        :param message_id: CloudEvent id
+        :param timeout: max time (in seconds) to wait, raises `asyncio.TimeoutError`
+        """
+        key = self.get_key(consumer, message_id)
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(future)
+        try:
+            async with async_timeout.timeout(timeout):
+                if self._watcher is None:
+                    self._watcher = asyncio.create_task(self._run_watch())
+                await self._watching.wait()
+                # result could be stored before watching started
+                data = await self._get(key)
+                if data is not None:
+                    self.notify(key, data)
+                return await future
+        finally:
+            waiters = self._waiters[key]
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[key]
+
+    async def after_process_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any | None = None,
+        exc: Exception | None = None,
+    ) -> None:
+        if exc is not None or not consumer.options.get("store_results"):
+            return
+        stored = (
+            self.get_key(consumer, message.id),
+            self.encoder.encode(result),
+            self.get_ttl(consumer),
+        )
+        try:
+            await self.writer.add(stored, wait=self.wait_for_write)
+        except Exception as e:
+            self.logger.error(f"Result of message {message.id} not stored: {e!r}")
+            # redelivered to store the result
+            await broker.nack(consumer, message.raw)
+
+    async def before_broker_disconnect(self, broker: Broker) -> None:
+        await self.writer.flush()
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+            self._watching.clear()
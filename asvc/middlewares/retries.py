@@ -1,9 +1,10 @@
 from __future__ import annotations
 
+import warnings
 from dataclasses import dataclass
 from typing import TYPE_CHECKING, Any, Awaitable, Callable
 
-from asvc.exceptions import Retry
+from asvc.exceptions import Fail, Retry
 from asvc.middleware import Middleware
 from asvc.utils.datetime import utc_now
 
@@ -16,24 +17,75 @@ if TYPE_CHECKING:
 @dataclass(frozen=True)
 class RetryConsumerOptions:
     """
-    Retries based on backoff and max_age, as not every broker provides info about
-    number of times that message was delivered
+    Retries based on number of times message was delivered (`CloudEvent.delivery_count`),
+    without deliveries postponed by middlewares (`CloudEvent.postponed`),
+    with exponential backoff. Can be overridden per consumer with options of the same
+    name (`backoff` for `backoff_factor`).
+    :param backoff_factor: delay (in seconds) before the first retry, doubled for every next one
+    :param max_backoff: max delay (in seconds) between retries
+    :param max_retries: max number of retries
+    :param max_age: max message age (in seconds) to retry, not checked by default
+    :param retry_if: async callable `(retries, exc) -> bool` replacing the limits above
+    :param retry_when: deprecated, async callable `(message_age, exc) -> bool`
+        called with message age (in seconds), use `retry_if` instead
+    :param throws: exceptions not retried
     """
 
-    backoff_factor: int = 5
-    max_age: int = 60
+    backoff_factor: float = 5
+    max_backoff: float = 300
+    max_retries: int = 5
+    max_age: int | None = None
+    retry_if: Callable[[int, Exception], Awaitable[bool]] | None = None
     retry_when: Callable[[int, Exception], Awaitable[bool]] | None = None
     throws: type[Exception] | tuple[type[Exception]] | None = None
 
 
 class RetryMiddleware(Middleware):
     """
-    Retry Message Middleware
+    Retry Message Middleware, failed messages are nacked with backoff delay,
+    messages exceeding retry limits are acked (after `retries_exhausted` hook).
+    Messages failed with `Fail` exception are not retried.
     """
 
     def __init__(self, default_retry_options: RetryConsumerOptions | None = None):
         self.default_retry_options = default_retry_options or RetryConsumerOptions()
 
+    def get_option(self, consumer: Consumer, name: str, default_name: str = "") -> Any:
+        default = getattr(self.default_retry_options, default_name or name)
+        return consumer.options.get(name, default)
+
+    def get_delay(self, consumer: Consumer, retries: int) -> float:
+        backoff = self.get_option(consumer, "backoff", "backoff_factor")
+        return min(backoff * 2**retries, self.get_option(consumer, "max_backoff"))
+
+    def get_age(self, message: CloudEvent) -> int:
+        """Return message age in seconds"""
+        return int((utc_now() - message.time).total_seconds())
+
+    def get_retries(self, message: CloudEvent) -> int:
+        """Return number of previous failed attempts to process message"""
+        return max(message.delivery_count - 1 - message.postponed, 0)
+
+    async def should_retry(
+        self, consumer: Consumer, message: CloudEvent, exc: Exception
+    ) -> bool:
+        retries = self.get_retries(message)
+        retry_if = self.get_option(consumer, "retry_if")
+        if callable(retry_if):
+            return await retry_if(retries, exc)
+        retry_when = self.get_option(consumer, "retry_when")
+        if callable(retry_when):
+            warnings.warn(
+                "retry_when is deprecated, use retry_if called with number of retries",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            return await retry_when(self.get_age(message), exc)
+        if retries >= self.get_option(consumer, "max_retries"):
+            return False
+        max_age = self.get_option(consumer, "max_age")
+        return max_age is None or self.get_age(message) < max_age
+
     async def after_process_message(
         self,
         broker: Broker,
@@ -45,31 +97,25 @@ class RetryMiddleware(Middleware):
         if exc is None:
             return
 
-        throws = consumer.options.get("throws")
-        if throws and isinstance(exc, throws):
+        throws = self.get_option(consumer, "throws")
+        if isinstance(exc, Fail) or throws and isinstance(exc, throws):
             return
 
-        retry_when = consumer.options.get(
-            "retry_when", self.default_retry_options.retry_when
-        )
-        message_age = (utc_now() - message.time).seconds
-        max_age = consumer.options.get("max_age", self.default_retry_options.max_age)
-        if (
-            callable(retry_when)
-            and not await retry_when(message_age, exc)
-            or retry_when is None
-            and message_age >= max_age
-        ):
+        if not await self.should_retry(consumer, message, exc):
             self.logger.error(f"Retry limit exceeded for message {message.id}.")
+            await broker.dispatch_after("retries_exhausted", consumer, message, exc)
+            await broker.ack(consumer, message.raw)
             return
-            # await broker.ack(consumer, message)
 
         if isinstance(exc, Retry) and exc.delay is not None:
             delay = exc.delay
         else:
-            delay = consumer.options.get(
-                "backoff", self.default_retry_options.backoff_factor
-            )
+            delay = self.get_delay(consumer, self.get_retries(message))
 
-        self.logger.info("Retrying message %r in %d milliseconds.", message.id, delay)
-        await broker.nack(consumer, message)
+        self.logger.info(
+            "Retrying message %r in %.2f seconds (delivery %d).",
+            message.id,
+            delay,
+            message.delivery_count,
+        )
+        await broker.nack(consumer, message.raw, delay)
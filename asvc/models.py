@@ -1,21 +1,30 @@
 from datetime import datetime
 from typing import Any, Dict, Generic, Optional
 
-from pydantic import Extra, Field
+from pydantic import Extra, Field, validator
 from pydantic.fields import ModelField, PrivateAttr
 from pydantic.generics import GenericModel
 from typing_extensions import Literal
 
+from .serialization import load_header
 from .types import D, RawMessage
-from .utils import str_uuid
-from .utils.datetime import utc_now
+from .utils.datetime import parse_datetime, utc_now
+from .utils.enum import AutoEnum
+from .utils.ids import generate_id
+
+
+class ContentMode(AutoEnum):
+    """CloudEvents content mode used on the wire"""
+
+    structured = AutoEnum.auto()
+    binary = AutoEnum.auto()
 
 
 class CloudEvent(GenericModel, Generic[D, RawMessage]):
     specversion: Optional[str] = "1.0"
     content_type: str = Field("application/json", alias="datacontenttype")
-    id: str = Field(default_factory=str_uuid)
-    trace_id: str = Field(default_factory=str_uuid, alias="traceid")
+    id: str = Field(default_factory=generate_id)
+    trace_id: str = Field(default_factory=generate_id, alias="traceid")
     time: datetime = Field(default_factory=utc_now)
     topic: str = Field(..., alias="subject")
     type: Optional[str] = "CloudEvent"
@@ -23,10 +32,13 @@ class CloudEvent(GenericModel, Generic[D, RawMessage]):
     data: Optional[D] = None
 
     _raw: Optional[RawMessage] = PrivateAttr()
+    _delivery_count: int = PrivateAttr(1)
+    _postponed: int = PrivateAttr(0)
 
     def __init_subclass__(cls, **kwargs):
-        if "abstract" not in kwargs:
-            name = kwargs.pop("type") or cls.__name__
+        abstract = kwargs.pop("abstract", False)
+        name = kwargs.pop("type", None) or cls.__name__
+        if not abstract:
             cls.__fields__["type"] = ModelField(
                 name="type",
                 type_=Literal[name],  # type: ignore
@@ -35,7 +47,19 @@ class CloudEvent(GenericModel, Generic[D, RawMessage]):
                 class_validators=None,
                 model_config=cls.__config__,
             )
-        super().__init_subclass__(cls, **kwargs)
+        super().__init_subclass__(**kwargs)
+
+    @validator("*", pre=True)
+    def _parse_structured(cls, v: Any, field: ModelField) -> Any:
+        # attributes sent as JSON-encoded ce-* headers in binary content mode
+        return v if field.name == "data" else load_header(v, field)
+
+    @validator("time", pre=True)
+    def _parse_time(cls, v: Any) -> Any:
+        try:
+            return parse_datetime(v)
+        except (TypeError, ValueError, OverflowError):
+            return v
 
     @property
     def raw(self) -> RawMessage:
@@ -43,6 +67,22 @@ class CloudEvent(GenericModel, Generic[D, RawMessage]):
             raise AttributeError("raw property accessible only for incoming messages")
         return self._raw
 
+    @property
+    def delivery_count(self) -> int:
+        """
+        Number of times incoming message was delivered (1 for the first delivery),
+        for backends not tracking redeliveries always 1
+        """
+        return self._delivery_count
+
+    @property
+    def postponed(self) -> int:
+        """
+        Number of times incoming message was postponed (`Postpone`) by this process,
+        included in `delivery_count`
+        """
+        return self._postponed
+
     def dict(self, **kwargs: Any) -> Dict[str, Any]:
         kwargs.setdefault("by_alias", True)
         return super().dict(**kwargs)
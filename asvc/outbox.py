@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+import glob
+import json
+import mmap
+import os
+import struct
+from collections import Counter, deque
+from typing import TYPE_CHECKING
+
+from .logger import LoggerMixin
+from .models import CloudEvent
+from .serialization import get_serializer
+
+if TYPE_CHECKING:
+    from .broker import Broker
+
+# offset of the first record not replayed yet
+HEADER = struct.Struct(">Q")
+LENGTH = struct.Struct(">I")
+
+
+class Segment:
+    """
+    Append-only memory-mapped file of length-prefixed records, preallocated to `size`.
+    Length is written after record data, so a partially written record is ignored.
+    :param path: segment file, opened if exists
+    :param size: file size (in bytes) of a new segment
+    """
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        exists = os.path.exists(path)
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(size)
+        self.size = os.path.getsize(path)
+        self._mmap = mmap.mmap(self._file.fileno(), self.size)
+        self.read_offset = HEADER.unpack_from(self._mmap, 0)[0] or HEADER.size
+        self.write_offset = self._scan()
+
+    def _scan(self) -> int:
+        offset = HEADER.size
+        while offset + LENGTH.size <= self.size:
+            (length,) = LENGTH.unpack_from(self._mmap, offset)
+            end = offset + LENGTH.size + length
+            if not length or end > self.size:
+                break
+            offset = end
+        return offset
+
+    @property
+    def pending(self) -> bool:
+        return self.read_offset < self.write_offset
+
+    def append(self, data: bytes) -> bool:
+        """Append record, return `False` if segment is full"""
+        start = self.write_offset + LENGTH.size
+        end = start + len(data)
+        if end > self.size:
+            return False
+        self._mmap[start:end] = data
+        LENGTH.pack_into(self._mmap, self.write_offset, len(data))
+        self.write_offset = end
+        return True
+
+    def read(self, offset: int) -> tuple[bytes, int]:
+        """Return record at `offset` and offset of the next one"""
+        (length,) = LENGTH.unpack_from(self._mmap, offset)
+        start = offset + LENGTH.size
+        return self._mmap[start : start + length], start + length
+
+    def commit(self, offset: int) -> None:
+        """Mark records before `offset` as replayed"""
+        self.read_offset = offset
+        HEADER.pack_into(self._mmap, 0, offset)
+
+    def flush(self) -> None:
+        self._mmap.flush()
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def remove(self) -> None:
+        self.close()
+        os.remove(self.path)
+
+
+class Outbox(LoggerMixin):
+    """
+    Keeps events that could not be published (broker disconnected, publishing failed
+    or took longer than `publish_timeout`) in local segment files and publishes them
+    in batches once the broker is connected. While a topic has stored events, new events
+    to the topic are stored too, so the order per topic is preserved. Replayed segments
+    are removed. Publish options other than the event itself are not stored.
+    :param path: directory of segment files
+    :param segment_size: size (in bytes) of one segment file
+    :param publish_timeout: max time (in seconds) to wait for publishing before
+        the event is stored
+    :param batch_size: max number of events published at once
+    :param replay_interval: time (in seconds) between replay attempts
+    :param sync: flush segment to disk after every stored event
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_size: int = 16 * 1024 * 1024,
+        publish_timeout: float | None = 5.0,
+        batch_size: int = 500,
+        replay_interval: float = 1.0,
+        sync: bool = False,
+    ) -> None:
+        self.path = path
+        self.segment_size = segment_size
+        self.publish_timeout = publish_timeout
+        self.batch_size = batch_size
+        self.replay_interval = replay_interval
+        self.sync = sync
+        self._segments: deque[Segment] = deque()
+        self._topics: Counter[str] = Counter()
+        self._count = 0
+        self._next_id = 0
+        self._broker: Broker | None = None
+        self._task: asyncio.Task | None = None
+        # created on start, bound to the running event loop
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def is_pending(self, topic: str) -> bool:
+        """Check if topic has stored events not published yet"""
+        return self._topics[topic] > 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def _new_segment(self, size: int) -> Segment:
+        path = os.path.join(self.path, f"{self._next_id:012d}.seg")
+        self._next_id += 1
+        segment = Segment(path, size)
+        self._segments.append(segment)
+        return segment
+
+    def store(self, message: CloudEvent) -> None:
+        """Store event to publish later"""
+        data = json.dumps(
+            get_serializer(type(message)).to_dict(message), default=str
+        ).encode()
+        if not self._segments or not self._segments[-1].append(data):
+            size = max(self.segment_size, HEADER.size + LENGTH.size + len(data))
+            self._new_segment(size).append(data)
+        if self.sync:
+            self._segments[-1].flush()
+        self._topics[message.topic] += 1
+        self._count += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _restore(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(self.path, "*.seg"))):
+            self._next_id = int(os.path.basename(path).split(".")[0]) + 1
+            segment = Segment(path, self.segment_size)
+            if not segment.pending:
+                segment.remove()
+                continue
+            self._segments.append(segment)
+            offset = segment.read_offset
+            while offset < segment.write_offset:
+                data, offset = segment.read(offset)
+                self._topics[CloudEvent.parse_raw(data).topic] += 1
+                self._count += 1
+        if self._count:
+            self.logger.info(f"Restored {self._count} unpublished events")
+
+    def start(self, broker: Broker) -> None:
+        if self._task is not None:
+            return
+        self._broker = broker
+        self._wakeup = asyncio.Event()
+        self._restore()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Publish stored events if broker is connected and close segment files"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._count and self._broker.is_connected:  # type: ignore
+            try:
+                await self.replay()
+            except Exception as e:
+                self.logger.exception("Publishing stored events failed", exc_info=e)
+        for segment in self._segments:
+            segment.flush()
+            segment.close()
+        self._segments.clear()
+        self._topics.clear()
+        if self._count:
+            self.logger.warning(f"{self._count} unpublished events left in outbox")
+        self._count = 0
+
+    async def _publish_ordered(self, batch: list[CloudEvent]) -> None:
+        # events of the same topic are published one after another
+        waves: list[list[CloudEvent]] = []
+        depth: Counter[str] = Counter()
+        for message in batch:
+            i = depth[message.topic]
+            depth[message.topic] += 1
+            if i == len(waves):
+                waves.append([])
+            waves[i].append(message)
+        for wave in waves:
+            await self._broker._publish_batch(wave)  # type: ignore
+
+    async def replay(self) -> None:
+        """Publish stored events, replayed segments are removed"""
+        while self._segments:
+            segment = self._segments[0]
+            batch: list[CloudEvent] = []
+            offset = segment.read_offset
+            while offset < segment.write_offset and len(batch) < self.batch_size:
+                data, offset = segment.read(offset)
+                batch.append(CloudEvent.parse_raw(data))
+            if batch:
+                await self._publish_ordered(batch)
+                segment.commit(offset)
+                self._count -= len(batch)
+                for message in batch:
+                    self._topics[message.topic] -= 1
+                    if not self._topics[message.topic]:
+                        del self._topics[message.topic]
+            if not segment.pending:
+                self._segments.popleft()
+                segment.remove()
+
+    async def _run(self) -> None:
+        wakeup: asyncio.Event = self._wakeup  # type: ignore
+        while True:
+            if not self._count:
+                wakeup.clear()
+                await wakeup.wait()
+            await asyncio.sleep(self.replay_interval)
+            if not self._broker.is_connected:  # type: ignore
+                continue
+            try:
+                await self.replay()
+            except Exception as e:
+                self.logger.warning(f"Publishing stored events failed: {e!r}")
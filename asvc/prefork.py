@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Any
+
+from typing_extensions import Protocol
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT)
+
+
+class Runnable(Protocol):
+    def run(self, use_uvloop: bool = False, **kwargs: Any) -> None:
+        ...
+
+
+def _run_worker(
+    runner: Runnable, index: int, cpu: int | None, use_uvloop: bool
+) -> None:
+    for sig in FORWARDED_SIGNALS:
+        signal.signal(sig, signal.SIG_DFL)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    logger.info(f"Worker {index} started (pid {os.getpid()}, cpu {cpu})")
+    runner.run(use_uvloop=use_uvloop)
+
+
+class Worker:
+    __slots__ = ("index", "cpu", "process", "started_at", "restarts", "restart_at")
+
+    def __init__(self, index: int, cpu: int | None) -> None:
+        self.index = index
+        self.cpu = cpu
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_at: float | None = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class PreforkRunner:
+    """
+    Runs service runner in multiple forked worker processes, each with its own event loop,
+    broker connection and consumers. Workers exiting unexpectedly are restarted with
+    exponential backoff, termination signals are forwarded to workers, which stop gracefully.
+    :param runner: ServiceRunner (or Service) to run in every worker
+    :param workers: number of worker processes, defaults to number of CPUs
+    :param cpu_affinity: pin each worker to a single CPU (Linux only)
+    :param use_uvloop: use uvloop event loop in workers
+    :param shutdown_timeout: time (in seconds) given workers to stop before being killed
+    :param restart_delay: initial delay (in seconds) before restarting failed worker
+    :param max_restart_delay: max delay (in seconds) before restarting failed worker
+    :param backoff_reset: uptime (in seconds) after which worker restart delay is reset
+    :param metrics_port: serve prometheus metrics aggregated from all workers on this port,
+        requires PROMETHEUS_MULTIPROC_DIR to be set before metrics are created
+    """
+
+    def __init__(
+        self,
+        runner: Runnable,
+        workers: int | None = None,
+        cpu_affinity: bool = False,
+        use_uvloop: bool = False,
+        shutdown_timeout: float = 60,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60,
+        backoff_reset: float = 60,
+        metrics_port: int | None = None,
+    ) -> None:
+        self.runner = runner
+        self.num_workers = workers or os.cpu_count() or 1
+        self.cpu_affinity = cpu_affinity
+        self.use_uvloop = use_uvloop
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.backoff_reset = backoff_reset
+        self.metrics_port = metrics_port
+        self.workers: list[Worker] = []
+        self._context = multiprocessing.get_context("fork")
+        self._stopping = False
+
+    def _get_cpu(self, index: int) -> int | None:
+        if not self.cpu_affinity:
+            return None
+        cpus = sorted(os.sched_getaffinity(0))
+        return cpus[index % len(cpus)]
+
+    def _spawn(self, worker: Worker) -> None:
+        worker.process = self._context.Process(
+            target=_run_worker,
+            args=(self.runner, worker.index, worker.cpu, self.use_uvloop),
+            name=f"asvc-worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+
+    def _start_metrics_server(self) -> None:
+        from .middlewares.prometheus import (
+            clear_multiprocess_dir,
+            is_multiprocess,
+            start_multiprocess_server,
+        )
+
+        if not is_multiprocess():
+            logger.warning(
+                "PROMETHEUS_MULTIPROC_DIR is not set, metrics server not started"
+            )
+            return
+        clear_multiprocess_dir()
+        start_multiprocess_server(self.metrics_port)  # type: ignore
+
+    def start(self) -> None:
+        """Start all worker processes"""
+        if self.metrics_port:
+            self._start_metrics_server()
+        self.workers = [Worker(i, self._get_cpu(i)) for i in range(self.num_workers)]
+        for worker in self.workers:
+            self._spawn(worker)
+
+    def _on_exit(self, worker: Worker) -> None:
+        process = worker.process
+        assert process is not None  # nosec
+        logger.warning(
+            f"Worker {worker.index} (pid {process.pid}) exited with code {process.exitcode}"
+        )
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            from .middlewares.prometheus import mark_process_dead
+
+            mark_process_dead(process.pid)  # type: ignore
+        process.close()
+        worker.process = None
+        if time.monotonic() - worker.started_at > self.backoff_reset:
+            worker.restarts = 0
+        delay = min(self.restart_delay * 2**worker.restarts, self.max_restart_delay)
+        worker.restarts += 1
+        worker.restart_at = time.monotonic() + delay
+        logger.info(f"Restarting worker {worker.index} in {delay:.1f}s")
+
+    def supervise(self, timeout: float | None = None) -> None:
+        """
+        Wait for worker exits (up to `timeout` seconds),
+        restart exited workers when their backoff delay is over
+        """
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.restart_at is not None and worker.restart_at <= now:
+                self._spawn(worker)
+        running = [w for w in self.workers if w.process is not None]
+        pending = [w.restart_at for w in self.workers if w.restart_at is not None]
+        if pending:
+            delay = max(min(pending) - now, 0)
+            timeout = delay if timeout is None else min(timeout, delay)
+        ready = wait([w.process.sentinel for w in running], timeout)  # type: ignore
+        for worker in running:
+            if worker.process.sentinel in ready:  # type: ignore
+                worker.process.join()  # type: ignore
+                if not self._stopping:
+                    self._on_exit(worker)
+
+    def stop(self, sig: int = signal.SIGTERM) -> None:
+        """
+        Send `sig` to all workers and wait for them to stop,
+        workers still running after `shutdown_timeout` are killed
+        """
+        self._stopping = True
+        running = [w.process for w in self.workers if w.is_alive]
+        for process in running:
+            os.kill(process.pid, sig)  # type: ignore
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in running:
+            process.join(max(deadline - time.monotonic(), 0))  # type: ignore
+            if process.is_alive():  # type: ignore
+                logger.warning(f"Worker (pid {process.pid}) did not stop, killing")
+                process.kill()  # type: ignore
+                process.join()  # type: ignore
+
+    def run(self) -> None:
+        """Start workers and supervise them until SIGINT/SIGTERM/SIGQUIT is received"""
+        received: list[int] = []
+
+        def _handler(signum: int, frame: Any) -> None:
+            received.append(signum)
+
+        for sig in FORWARDED_SIGNALS:
+            signal.signal(sig, _handler)
+        self.start()
+        logger.info(f"Started {self.num_workers} workers (pid {os.getpid()})")
+        while not received:
+            self.supervise(timeout=1.0)
+        logger.info(f"Received signal {received[0]}, stopping workers")
+        self.stop(signal.SIGTERM if received[0] == signal.SIGQUIT else received[0])
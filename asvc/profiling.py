@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import json
+import os
+import signal
+import tracemalloc
+from typing import TYPE_CHECKING, Any, Sequence
+
+from .exceptions import ConfigurationError
+from .middleware import Middleware
+from .utils.enum import AutoEnum
+
+if TYPE_CHECKING:
+    from types import FrameType
+
+    from .broker import Broker
+    from .consumer import Consumer
+    from .models import CloudEvent
+    from .service import Service
+
+
+class ProfilerMode(AutoEnum):
+    """CPU profiler: deterministic (cProfile) or sampling"""
+
+    cprofile = AutoEnum.auto()
+    sampling = AutoEnum.auto()
+
+
+class SamplingProfiler:
+    """
+    Records call stacks of the main thread every `interval` seconds of CPU time
+    (with SIGPROF timer, available only on Unix) and exports them in speedscope
+    (https://www.speedscope.app) format
+    :param interval: sampling interval (in seconds of CPU time)
+    """
+
+    def __init__(self, interval: float = 0.001) -> None:
+        self.interval = interval
+        self.active = True
+        self.frames: list[dict[str, Any]] = []
+        self.samples: list[list[int]] = []
+        self._frame_ids: dict[tuple[str, str, int], int] = {}
+        self._previous_handler: Any = None
+
+    def _frame_id(self, frame: FrameType) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        try:
+            return self._frame_ids[key]
+        except KeyError:
+            index = self._frame_ids[key] = len(self.frames)
+            self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            return index
+
+    def sample(self, frame: FrameType | None) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_id(frame))
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            self.samples.append(stack)
+
+    def _handle_signal(self, signum: int, frame: FrameType | None) -> None:
+        if self.active:
+            self.sample(frame)
+
+    def start(self) -> None:
+        if not hasattr(signal, "setitimer"):
+            raise ConfigurationError("Sampling profiler requires SIGPROF (Unix only)")
+        self._previous_handler = signal.signal(signal.SIGPROF, self._handle_signal)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def to_speedscope(self, name: str = "asvc") -> dict[str, Any]:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": len(self.samples) * self.interval,
+                    "samples": self.samples,
+                    "weights": [self.interval] * len(self.samples),
+                }
+            ],
+            "name": name,
+            "exporter": "asvc",
+        }
+
+
+class ProfilingMiddleware(Middleware):
+    """Counts processed messages, signals when the limit is reached"""
+
+    def __init__(self, max_messages: int | None = None) -> None:
+        self.max_messages = max_messages
+        self.processed = 0
+        self.done = asyncio.Event()
+
+    async def after_process_message(
+        self,
+        broker: Broker,
+        consumer: Consumer,
+        message: CloudEvent,
+        result: Any | None = None,
+        exc: Exception | None = None,
+    ) -> None:
+        self.processed += 1
+        if self.max_messages and self.processed >= self.max_messages:
+            self.done.set()
+
+
+class Profiler:
+    """
+    Runs services and collects CPU profile and (optionally) memory allocations snapshot
+    :param mode: cprofile (snakeviz compatible .prof file) or sampling (speedscope json)
+    :param out_dir: output directory
+    :param memory: collect top memory allocations with tracemalloc
+    :param handler_only: profile only message handling (`Broker.get_handler` handlers),
+        with concurrent handlers other tasks running in the meantime are included too
+    :param interval: sampling interval (in seconds) for sampling mode
+    :param top: number of top allocations in memory report
+    """
+
+    def __init__(
+        self,
+        mode: ProfilerMode | str = ProfilerMode.cprofile,
+        out_dir: str = ".",
+        memory: bool = True,
+        handler_only: bool = False,
+        interval: float = 0.001,
+        top: int = 50,
+    ) -> None:
+        self.mode = ProfilerMode(mode)
+        self.out_dir = out_dir
+        self.memory = memory
+        self.handler_only = handler_only
+        self.interval = interval
+        self.top = top
+        self._cprofile: cProfile.Profile | None = None
+        self._sampler: SamplingProfiler | None = None
+        self._active_handlers = 0
+
+    def _enable(self) -> None:
+        if self._cprofile:
+            self._cprofile.enable()
+        if self._sampler:
+            self._sampler.active = True
+
+    def _disable(self) -> None:
+        if self._cprofile:
+            self._cprofile.disable()
+        if self._sampler:
+            self._sampler.active = False
+
+    def _wrap_handlers(self, broker: Broker) -> None:
+        get_handler = broker.get_handler
+
+        def get_profiled_handler(service: Service, consumer: Consumer):
+            handler = get_handler(service, consumer)
+
+            async def profiled_handler(raw_message: Any) -> None:
+                self._active_handlers += 1
+                if self._active_handlers == 1:
+                    self._enable()
+                try:
+                    await handler(raw_message)
+                finally:
+                    self._active_handlers -= 1
+                    if not self._active_handlers:
+                        self._disable()
+
+            return profiled_handler
+
+        broker.get_handler = get_profiled_handler  # type: ignore
+
+    def _start(self) -> None:
+        if self.memory:
+            tracemalloc.start()
+        if self.mode == ProfilerMode.cprofile:
+            self._cprofile = cProfile.Profile()
+        else:
+            self._sampler = SamplingProfiler(self.interval)
+            self._sampler.start()
+        if self.handler_only:
+            self._disable()
+        else:
+            self._enable()
+
+    def _stop(self) -> list[str]:
+        self._disable()
+        os.makedirs(self.out_dir, exist_ok=True)
+        files = []
+        if self._cprofile:
+            path = os.path.join(self.out_dir, "profile.prof")
+            self._cprofile.dump_stats(path)
+            files.append(path)
+        if self._sampler:
+            self._sampler.stop()
+            path = os.path.join(self.out_dir, "profile.speedscope.json")
+            with open(path, "w") as f:
+                json.dump(self._sampler.to_speedscope(), f)
+            files.append(path)
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            path = os.path.join(self.out_dir, "memory.txt")
+            with open(path, "w") as f:
+                for stat in snapshot.statistics("lineno")[: self.top]:
+                    f.write(f"{stat}\n")
+            files.append(path)
+        return files
+
+    async def run(
+        self,
+        services: Sequence[Service],
+        duration: float | None = None,
+        max_messages: int | None = None,
+    ) -> tuple[int, list[str]]:
+        """
+        Run services until `duration` seconds pass or `max_messages` are processed
+        :return: number of processed messages and list of created files
+        """
+        counter = ProfilingMiddleware(max_messages)
+        brokers = {id(s.broker): s.broker for s in services}.values()
+        for broker in brokers:
+            broker.add_middleware(counter)
+            if self.handler_only:
+                self._wrap_handlers(broker)
+        self._start()
+        try:
+            for service in services:
+                await service.start()
+            try:
+                await asyncio.wait_for(counter.done.wait(), duration)
+            except asyncio.TimeoutError:
+                pass
+            for service in services:
+                await service.stop()
+        finally:
+            files = self._stop()
+            for broker in brokers:
+                broker.middlewares.remove(counter)
+                if self.handler_only:
+                    del broker.get_handler  # type: ignore
+        return counter.processed, files
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+from .logger import LoggerMixin
+from .utils.batching import Batcher
+
+if TYPE_CHECKING:
+    from .broker import Broker
+    from .models import CloudEvent
+
+
+class BatchPublisher(Batcher["CloudEvent"], LoggerMixin):
+    """
+    Collects events published concurrently and sends them with `Broker.publish_batch`,
+    every caller waits until its batch is published (or fails with the batch error)
+    :param broker: broker to publish with
+    :param batch_size: max number of events in one batch
+    :param linger: max time (in seconds) to wait for more events before publishing a batch
+    :param rate: max number of published events per second, unlimited by default
+    :param publish_options: additional params passed to `Broker.publish_batch`
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        batch_size: int = 100,
+        linger: float = 0.05,
+        rate: float = 0,
+        **publish_options: Any,
+    ) -> None:
+        super().__init__(batch_size=batch_size, linger=linger)
+        self.broker = broker
+        self.rate = rate
+        self.publish_options = publish_options
+        self._next_at = 0.0
+
+    async def publish(self, message: CloudEvent) -> None:
+        await self.add(message)
+
+    async def process(self, batch: list[CloudEvent]) -> None:
+        await self._wait_rate(len(batch))
+        await self.broker.publish_batch(batch, **self.publish_options)
+
+    async def _wait_rate(self, count: int) -> None:
+        if not self.rate:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._next_at > now:
+            await asyncio.sleep(self._next_at - now)
+        self._next_at = max(self._next_at, now) + count / self.rate
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
+
+from .logger import LoggerMixin
+from .models import CloudEvent
+from .serialization import get_serializer
+from .utils.ids import generate_id
+
+if TYPE_CHECKING:
+    from .broker import Broker
+
+T = TypeVar("T")
+
+
+class TimerWheel(Generic[T]):
+    """
+    Hierarchical timing wheel. Adding a timer is O(1), timers are moved to lower levels
+    only when their slot comes up, so millions of pending timers are cheap to hold.
+    Timers beyond the wheel range are kept in a heap until they fit.
+    :param resolution: tick duration (in seconds)
+    :param slots: number of slots per level, power of 2
+    :param levels: number of levels, wheel range is `resolution * slots ** levels`
+    :param now: current time (in seconds), defaults to unix time
+    """
+
+    def __init__(
+        self,
+        resolution: float = 0.05,
+        slots: int = 256,
+        levels: int = 4,
+        now: float | None = None,
+    ) -> None:
+        if slots & (slots - 1):
+            raise ValueError("Number of slots must be a power of 2")
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels: list[list[list[tuple[int, T]]]] = [
+            [[] for _ in range(slots)] for _ in range(levels)
+        ]
+        self._overflow: list[tuple[int, int, T]] = []
+        self._counter = itertools.count()
+        self._tick = self._to_tick(time.time() if now is None else now)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(timestamp / self.resolution)
+
+    def _insert(self, tick: int, item: T) -> None:
+        delta = tick - self._tick
+        for level in range(self.levels):
+            if delta < 1 << (self._bits * (level + 1)):
+                slot = (tick >> (self._bits * level)) & self._mask
+                self._wheels[level][slot].append((tick, item))
+                return
+        heapq.heappush(self._overflow, (tick, next(self._counter), item))
+
+    def add(self, due: float, item: T, now: float | None = None) -> None:
+        """
+        Add timer expiring at `due` time (in seconds)
+        :param now: current time, used to move idle wheel forward
+        """
+        if not self._count and now is not None:
+            self._tick = max(self._tick, self._to_tick(now))
+        # rounded up, timers never expire early
+        self._insert(max(math.ceil(due / self.resolution), self._tick), item)
+        self._count += 1
+
+    def _cascade(self, tick: int) -> None:
+        top = self.levels - 1
+        if not tick & ((1 << (self._bits * top)) - 1):
+            limit = tick + (1 << (self._bits * self.levels))
+            while self._overflow and self._overflow[0][0] < limit:
+                due, _, item = heapq.heappop(self._overflow)
+                self._insert(due, item)
+        for level in range(top, 0, -1):
+            if tick & ((1 << (self._bits * level)) - 1):
+                continue
+            slot = (tick >> (self._bits * level)) & self._mask
+            bucket = self._wheels[level][slot]
+            if bucket:
+                self._wheels[level][slot] = []
+                for due, item in bucket:
+                    self._insert(due, item)
+
+    def advance(self, now: float) -> list[T]:
+        """Move the wheel to `now` and return expired timers"""
+        target = self._to_tick(now)
+        expired: list[T] = []
+        wheel = self._wheels[0]
+        while self._tick <= target and self._count:
+            tick = self._tick
+            self._cascade(tick)
+            slot = tick & self._mask
+            bucket = wheel[slot]
+            if bucket:
+                wheel[slot] = []
+                expired.extend(item for _, item in bucket)
+            self._tick += 1
+        self._count -= len(expired)
+        if not self._count:
+            self._tick = max(self._tick, target + 1)
+        return expired
+
+
+class Scheduler(LoggerMixin):
+    """
+    Publishes delayed events when they are due. Pending events are kept in memory
+    in a timer wheel and optionally persisted to a local file, restored on start.
+    :param resolution: timer tick (in seconds), events are published up to one tick late
+    :param path: file to persist pending events in (JSON lines), with their publish
+        options, which must be JSON serializable
+    :param retry_delay: delay (in seconds) before publishing again after failure
+    """
+
+    def __init__(
+        self,
+        resolution: float = 0.05,
+        path: str | None = None,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.resolution = resolution
+        self.path = path
+        self.retry_delay = retry_delay
+        self._wheel: TimerWheel[tuple[str, CloudEvent, dict[str, Any]]] = TimerWheel(
+            resolution
+        )
+        self._broker: Broker | None = None
+        self._task: asyncio.Task | None = None
+        # created on start, bound to the running event loop
+        self._wakeup: asyncio.Event | None = None
+        self._file: Any = None
+        self._pending: dict[str, dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._wheel)
+
+    def schedule(self, message: CloudEvent, due: float, **kwargs: Any) -> None:
+        """
+        Publish message at `due` time
+        :param message: Cloud event to publish
+        :param due: unix time (in seconds)
+        :param kwargs: additional params passed to `Broker.publish_event`
+        :raises ValueError: if events are persisted and `kwargs` are not JSON serializable
+        """
+        key = generate_id()
+        if self.path:
+            record = {
+                "id": key,
+                "due": due,
+                "event": get_serializer(type(message)).to_dict(message),
+            }
+            if kwargs:
+                try:
+                    json.dumps(kwargs)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(
+                        f"Publish options of scheduled event can not be persisted: {e}"
+                    ) from e
+                record["kwargs"] = kwargs
+            self._pending[key] = record
+            self._write(record)
+            if self._file is not None:
+                self._file.flush()
+        self._wheel.add(due, (key, message, kwargs), now=time.time())
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _write(self, record: dict[str, Any]) -> None:
+        if self._file is not None:
+            self._file.write(json.dumps(record, default=str) + "\n")
+
+    def _compact(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record, default=str) + "\n")
+        os.replace(tmp_path, self.path)  # type: ignore
+
+    def _restore(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "event" in record:
+                    self._pending[record["id"]] = record
+                else:
+                    self._pending.pop(record["id"], None)
+        now = time.time()
+        for key, record in self._pending.items():
+            message = CloudEvent.parse_obj(record["event"])
+            kwargs = record.get("kwargs", {})
+            self._wheel.add(record["due"], (key, message, kwargs), now=now)
+        if self._pending:
+            self.logger.info(f"Restored {len(self._pending)} scheduled events")
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def start(self, broker: Broker) -> None:
+        if self._task is not None:
+            return
+        self._broker = broker
+        self._wakeup = asyncio.Event()
+        if self.path:
+            self._restore()
+            self._compact()
+            self._file = open(self.path, "a")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._compact()
+        elif len(self._wheel):
+            self.logger.warning(f"{len(self._wheel)} scheduled events discarded")
+
+    async def _publish_due(self) -> None:
+        for key, message, kwargs in self._wheel.advance(time.time()):
+            try:
+                await self._broker.publish_event(message, **kwargs)  # type: ignore
+            except Exception as e:
+                self.logger.exception(f"Publishing {message.id} failed", exc_info=e)
+                self._wheel.add(time.time() + self.retry_delay, (key, message, kwargs))
+                continue
+            if self._pending.pop(key, None) is not None:
+                self._write({"id": key})
+        if self._file is not None:
+            self._file.flush()
+
+    async def _run(self) -> None:
+        wakeup: asyncio.Event = self._wakeup  # type: ignore
+        while True:
+            if not len(self._wheel):
+                wakeup.clear()
+                await wakeup.wait()
+            await asyncio.sleep(self.resolution)
+            await self._publish_due()
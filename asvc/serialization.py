@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import functools
+import json
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Mapping
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+
+if TYPE_CHECKING:
+    from asvc.models import CloudEvent
+    from asvc.types import Encoder
+
+CE_PREFIX = "ce-"
+CONTENT_TYPE_HEADER = "Content-Type"
+
+# CloudEvents attributes always sent, even if equal to field default
+REQUIRED_ATTRIBUTES = frozenset({"specversion", "id", "type", "topic"})
+# Attributes not sent as ce-* headers in binary content mode
+BINARY_EXCLUDED = frozenset({"data", "content_type"})
+
+
+def _is_default(value: Any, default: Any) -> bool:
+    return value is default or (default is not None and value == default)
+
+
+def _dump_datetime(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _dump_epoch_ms(value: Any) -> Any:
+    return int(value.timestamp() * 1000) if isinstance(value, datetime) else value
+
+
+def _dump_model(value: Any) -> Any:
+    # models nested in containers keep their aliases too
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    if isinstance(value, (list, tuple)):
+        return [_dump_model(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _dump_model(v) for k, v in value.items()}
+    return value
+
+
+def _dump_header(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list, tuple, BaseModel)):
+        return json.dumps(_dump_model(value), default=str)
+    return str(value)
+
+
+def is_structured(field: ModelField) -> bool:
+    """Check if attribute is sent as JSON-encoded ce-* header in binary content mode"""
+    type_ = field.type_
+    return field.shape != SHAPE_SINGLETON or (
+        isinstance(type_, type) and issubclass(type_, (BaseModel, dict, list, tuple))
+    )
+
+
+def load_header(value: Any, field: ModelField) -> Any:
+    """Decode JSON-encoded ce-* header of structured attribute, see `_dump_header`"""
+    if type(value) is str and value[:1] in ("[", "{") and is_structured(field):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class EventSerializer:
+    """
+    Serializer compiled for a CloudEvent (sub)class, used on publish instead of
+    pydantic's recursive `.dict()`. Field aliases are resolved once, datetimes are
+    emitted as RFC3339 strings and attributes equal to their static default are omitted.
+    :param cls: CloudEvent class
+    :param compact_time: emit datetimes as integer unix time in milliseconds,
+        instead of RFC3339 strings (structured content mode only)
+    """
+
+    __slots__ = ("aliases", "defaults", "converters")
+
+    def __init__(self, cls: type[CloudEvent], compact_time: bool = False) -> None:
+        self.aliases: dict[str, str] = {}
+        self.defaults: dict[str, Any] = {}
+        self.converters: dict[str, Callable[[Any], Any]] = {}
+        for name, field in cls.__fields__.items():
+            self.aliases[name] = field.alias
+            if (
+                name not in REQUIRED_ATTRIBUTES
+                and not field.required
+                and field.default_factory is None
+            ):
+                self.defaults[name] = field.default
+            if field.outer_type_ is datetime:
+                self.converters[name] = (
+                    _dump_epoch_ms if compact_time else _dump_datetime
+                )
+            elif name == "data":
+                self.converters[name] = _dump_model
+
+    def to_dict(self, message: CloudEvent) -> dict[str, Any]:
+        aliases, defaults, converters = self.aliases, self.defaults, self.converters
+        result = {}
+        for name, value in message.__dict__.items():
+            if name in defaults and _is_default(value, defaults[name]):
+                continue
+            if name in converters:
+                value = converters[name](value)
+            result[aliases.get(name, name)] = value
+        return result
+
+    def to_headers(self, message: CloudEvent) -> dict[str, str]:
+        aliases, defaults = self.aliases, self.defaults
+        headers = {}
+        for name, value in message.__dict__.items():
+            if value is None or name in BINARY_EXCLUDED:
+                continue
+            if name in defaults and _is_default(value, defaults[name]):
+                continue
+            headers[f"{CE_PREFIX}{aliases.get(name, name)}"] = _dump_header(value)
+        return headers
+
+    def encode(self, message: CloudEvent, encoder: Encoder) -> bytes:
+        """Serialize message in structured content mode"""
+        return encoder.encode(self.to_dict(message))
+
+
+@functools.lru_cache(maxsize=None)
+def get_serializer(
+    cls: type[CloudEvent], compact_time: bool = False
+) -> EventSerializer:
+    return EventSerializer(cls, compact_time)
+
+
+def is_binary(headers: Mapping[str, Any] | None) -> bool:
+    """Check if message was sent in CloudEvents binary content mode"""
+    return bool(headers) and f"{CE_PREFIX}specversion" in headers  # type: ignore
+
+
+def get_content_type(headers: Mapping[str, Any] | None) -> str | None:
+    if not headers:
+        return None
+    return headers.get(CONTENT_TYPE_HEADER) or headers.get(CONTENT_TYPE_HEADER.lower())
+
+
+def to_binary(message: CloudEvent, encoder: Encoder) -> tuple[bytes, dict[str, str]]:
+    """
+    Serialize message in CloudEvents binary content mode,
+    envelope attributes are sent as ce-* headers and the body contains only data
+    :param message: Cloud event to serialize
+    :param encoder: Encoder used for message data
+    :return: tuple of body and headers
+    """
+    headers = get_serializer(type(message)).to_headers(message)
+    headers[CONTENT_TYPE_HEADER] = encoder.CONTENT_TYPE
+    data = _dump_model(message.data)
+    body = b"" if data is None else encoder.encode(data)
+    return body, headers
+
+
+def from_binary(
+    data: bytes, headers: Mapping[str, Any], encoder: Encoder
+) -> dict[str, Any]:
+    """
+    Parse message sent in CloudEvents binary content mode, structured extension
+    attributes are left JSON-encoded and decoded on validation (see `load_header`)
+    :param data: Message body
+    :param headers: Message headers (or attributes)
+    :param encoder: Encoder matching the message content type
+    :return: CloudEvent attributes with decoded data
+    """
+    attrs: dict[str, Any] = {
+        k[len(CE_PREFIX) :].lower(): v
+        for k, v in headers.items()
+        if k[: len(CE_PREFIX)].lower() == CE_PREFIX
+    }
+    attrs["datacontenttype"] = encoder.CONTENT_TYPE
+    attrs["data"] = encoder.decode(data) if data else None
+    return attrs
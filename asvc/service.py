@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-import asyncio
 from typing import TYPE_CHECKING, Any, Callable
 
 from .consumer import ConsumerGroup, FnConsumer, ForwardResponse
 from .logger import LoggerMixin
 from .models import CloudEvent
+from .supervisor import ConsumerSupervisor
 from .utils import generate_instance_id
+from .validation import ValidationMode
 
 if TYPE_CHECKING:
     from .broker import Broker
@@ -25,6 +26,7 @@ class Service(LoggerMixin):
         description: str = "",
         tags_metadata: list[TagMeta] = None,
         instance_id_generator: Callable[[], str] = generate_instance_id,
+        supervisor: ConsumerSupervisor | None = None,
     ):
         self.broker = broker
         self.name = name
@@ -34,6 +36,7 @@ class Service(LoggerMixin):
         self.tags_metadata = tags_metadata or []
         self.id = instance_id_generator()
         self.consumer_group = ConsumerGroup()
+        self.supervisor = supervisor or ConsumerSupervisor()
 
     def subscribe(
         self,
@@ -43,6 +46,7 @@ class Service(LoggerMixin):
         timeout: int = 120,
         dynamic: bool = False,
         forward_response: ForwardResponse | None = None,
+        validation: ValidationMode | str = ValidationMode.full,
         cls=FnConsumer,
         **options,
     ):
@@ -52,6 +56,7 @@ class Service(LoggerMixin):
             timeout=timeout,
             dynamic=dynamic,
             forward_response=forward_response,
+            validation=validation,
             cls=cls,
             **options,
         )
@@ -81,12 +86,17 @@ class Service(LoggerMixin):
     async def start(self):
         await self.broker.dispatch_before("service_start", self)
         await self.broker.connect()
-        for consumer in self.consumers.values():
-            asyncio.create_task(self.broker.start_consumer(self, consumer))
+        self.supervisor.start(self)
         await self.broker.dispatch_after("service_start", self)
 
     async def stop(self, *args, **kwargs):
+        """
+        Stop service gracefully: stop receiving messages, wait for messages
+        being processed (up to broker `drain_timeout`) and disconnect
+        """
         await self.broker.dispatch_before("service_stop", self)
+        await self.broker.drain()
+        await self.supervisor.stop()
         await self.broker.disconnect()
         await self.broker.dispatch_after("service_stop", self)
 
@@ -4,7 +4,9 @@ from pydantic import BaseSettings, Field, validator
 
 from asvc.utils.imports import import_from_string
 
+from .local import DeliveryMode
 from .middleware import Middleware
+from .models import ContentMode
 
 
 class Settings(BaseSettings):
@@ -18,6 +20,13 @@ class BrokerSettings(BaseSettings):
     description: Optional[str] = None
     middlewares: Optional[List["Middleware"]] = None
     encoder: Optional[Any] = Field(None, env="BROKER_ENCODER_CLASS")
+    content_mode: Optional[ContentMode] = Field(None, env="BROKER_CONTENT_MODE")
+    compact_time: bool = Field(False, env="BROKER_COMPACT_TIME")
+    stage_sample_rate: float = Field(0.0, env="BROKER_STAGE_SAMPLE_RATE")
+    drain_timeout: float = Field(30, env="BROKER_DRAIN_TIMEOUT")
+    local_delivery: DeliveryMode = Field(
+        DeliveryMode.remote, env="BROKER_LOCAL_DELIVERY"
+    )
 
     @validator("encoder", pre=True)
     def resolve_encoder(cls, v):
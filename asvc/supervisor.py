@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from typing import TYPE_CHECKING
+
+from .logger import LoggerMixin
+
+if TYPE_CHECKING:
+    from .consumer import Consumer
+    from .service import Service
+
+
+class ConsumerSupervisor(LoggerMixin):
+    """
+    Runs service consumers and restarts the ones that failed (or stopped unexpectedly)
+    with exponential backoff and random jitter.
+    :param initial_delay: delay (in seconds) before the first restart
+    :param max_delay: max delay (in seconds) between restarts
+    :param jitter: random fraction of delay, e.g. 0.5 means delay in range [0.5*d, d]
+    :param reset_after: consumer uptime (in seconds) after which backoff is reset
+    :param max_restarts: max number of consecutive restarts, unlimited by default
+    """
+
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        max_delay: float = 60.0,
+        jitter: float = 0.5,
+        reset_after: float = 60.0,
+        max_restarts: int | None = None,
+    ) -> None:
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.reset_after = reset_after
+        self.max_restarts = max_restarts
+        self.restarts: dict[str, int] = {}
+        self._alive: dict[str, bool] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def get_delay(self, attempt: int) -> float:
+        delay = min(self.initial_delay * 2**attempt, self.max_delay)
+        return delay * (1 - self.jitter * random.random())  # nosec
+
+    def is_alive(self, consumer: Consumer) -> bool:
+        return self._alive.get(consumer.name, False)
+
+    def get_health_status(self) -> bool:
+        """Check if all supervised consumers are running"""
+        return all(self._alive.values())
+
+    def start(self, service: Service) -> None:
+        for consumer in service.consumers.values():
+            self._alive[consumer.name] = True
+            self.restarts.setdefault(consumer.name, 0)
+            self._tasks[consumer.name] = asyncio.create_task(
+                self._supervise(service, consumer)
+            )
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._alive.clear()
+
+    async def _supervise(self, service: Service, consumer: Consumer) -> None:
+        broker = service.broker
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while broker.is_consuming:
+            started = loop.time()
+            self._alive[consumer.name] = True
+            try:
+                await broker.start_consumer(service, consumer)
+                if not broker.consumer_loop or not broker.is_consuming:
+                    # subscribed (push based backend) or broker stopped
+                    return
+                self.logger.error(f"Consumer {consumer.name} stopped unexpectedly")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.exception(f"Consumer {consumer.name} failed", exc_info=e)
+            self._alive[consumer.name] = False
+            if loop.time() - started > self.reset_after:
+                attempt = 0
+            if self.max_restarts is not None and attempt >= self.max_restarts:
+                self.logger.error(
+                    f"Consumer {consumer.name} restart limit exceeded, giving up"
+                )
+                return
+            delay = self.get_delay(attempt)
+            attempt += 1
+            self.restarts[consumer.name] += 1
+            self.logger.info(f"Restarting consumer {consumer.name} in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Batcher(Generic[T]):
+    """
+    Collects items added concurrently and processes them in batches, a batch is processed
+    when it is full or `linger` seconds after its first item was added. Batches are
+    processed one at a time, subclasses implement `process`.
+    :param batch_size: max number of items in one batch
+    :param linger: max time (in seconds) to wait for more items before processing a batch
+    """
+
+    def __init__(self, batch_size: int = 100, linger: float = 0.05) -> None:
+        self.batch_size = batch_size
+        self.linger = linger
+        self._batch: list[T] = []
+        self._done: asyncio.Future | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._lock = asyncio.Lock()
+
+    async def process(self, batch: list[T]) -> None:
+        raise NotImplementedError
+
+    async def add(self, item: T, wait: bool = True) -> None:
+        """
+        Add item to current batch, the caller filling the batch waits until it is processed
+        :param wait: wait until the batch is processed (and raise its error)
+        """
+        if self._done is None:
+            loop = asyncio.get_running_loop()
+            self._done = loop.create_future()
+            self._timer = loop.call_later(self.linger, self._flush_later)
+        done = self._done
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+        if wait:
+            await asyncio.shield(done)
+
+    def _flush_later(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def flush(self) -> None:
+        """Process collected items now, errors are raised to waiting callers"""
+        batch, done = self._batch, self._done
+        if done is None:
+            # wait for batch being processed
+            async with self._lock:
+                return
+        self._batch, self._done = [], None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        try:
+            async with self._lock:
+                await self.process(batch)
+        except Exception as e:
+            done.set_exception(e)
+            # retrieved by waiting callers
+            done.exception()
+        else:
+            done.set_result(None)
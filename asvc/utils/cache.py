@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """
+    LRU cache with expiring entries, least recently used entries are evicted
+    when `max_size` is reached
+    :param max_size: max number of entries
+    :param ttl: time (in seconds) after which entry expires, no expiration by default
+    :param timer: monotonic clock
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, _MISSING) is not _MISSING  # type: ignore
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires and expires <= self.timer():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        expires = self.timer() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+
+class BloomFilter:
+    """
+    Scalable Bloom filter for large key spaces, memory use does not depend on key size.
+    A new filter is added when the current one holds `capacity` keys, the oldest one
+    is dropped beyond `max_filters`, so memory is bounded and old keys are forgotten.
+    False positive rate is up to `error_rate * max_filters`, there are no false negatives
+    for keys in retained filters.
+    :param capacity: number of keys in one filter
+    :param error_rate: false positive rate of one filter
+    :param max_filters: max number of retained filters
+    """
+
+    def __init__(
+        self, capacity: int = 1_000_000, error_rate: float = 0.001, max_filters: int = 4
+    ) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_filters = max_filters
+        self._bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._hashes = max(1, round(self._bits / capacity * math.log(2)))
+        self._filters: deque[bytearray] = deque([self._new_filter()])
+        self._count = 0
+
+    def _new_filter(self) -> bytearray:
+        return bytearray((self._bits + 7) // 8)
+
+    def _indexes(self, key: str) -> list[int]:
+        # double hashing, k indexes from two 64 bit hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def _contains(self, indexes: list[int]) -> bool:
+        return any(
+            all(bits[i >> 3] & (1 << (i & 7)) for i in indexes)
+            for bits in self._filters
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return self._contains(self._indexes(key))
+
+    def add(self, key: str) -> None:
+        indexes = self._indexes(key)
+        if self._contains(indexes):
+            return
+        if self._count >= self.capacity:
+            self._filters.append(self._new_filter())
+            if len(self._filters) > self.max_filters:
+                self._filters.popleft()
+            self._count = 0
+        bits = self._filters[-1]
+        for i in indexes:
+            bits[i >> 3] |= 1 << (i & 7)
+        self._count += 1
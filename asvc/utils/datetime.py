@@ -1,5 +1,9 @@
 import time
 from datetime import datetime, timezone
+from typing import Any
+
+from pydantic.datetime_parse import MS_WATERSHED
+from pydantic.datetime_parse import parse_datetime as _parse_datetime
 
 
 def utc_now() -> datetime:
@@ -8,3 +12,22 @@ def utc_now() -> datetime:
 
 def current_millis() -> int:
     return time.monotonic_ns() // 1000
+
+
+def parse_datetime(value: Any) -> datetime:
+    """
+    Faster alternative to pydantic datetime parsing, for the common formats
+    (ISO 8601 strings and unix timestamps), falls back to pydantic otherwise
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value > MS_WATERSHED:
+            value = value / 1000
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    return _parse_datetime(value)
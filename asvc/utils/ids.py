@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from . import str_uuid
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_RAND_B_MASK = (1 << 62) - 1
+_COUNTER_BITS = 12
+_COUNTER_MAX = (1 << _COUNTER_BITS) - 1
+
+
+class TimeOrderedIdGenerator(ABC):
+    """
+    Generates 128-bit, time-ordered identifiers: 48 bits of unix time in milliseconds,
+    12 bits of per-millisecond counter (randomly seeded) and 62 random bits.
+    Randomness is read from `os.urandom` once per `batch_size` identifiers.
+    Subclasses define the text representation.
+    :param batch_size: number of identifiers generated from one entropy read
+    """
+
+    ENTROPY_SIZE = 10  # 2 bytes counter seed + 8 bytes random part
+
+    def __init__(self, batch_size: int = 512) -> None:
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._entropy = memoryview(b"")
+        self._offset = 0
+        self._last_ms = 0
+        self._counter = 0
+
+    def _next_entropy(self) -> bytes:
+        if self._offset >= len(self._entropy):
+            self._entropy = memoryview(os.urandom(self.ENTROPY_SIZE * self.batch_size))
+            self._offset = 0
+        offset = self._offset
+        self._offset = offset + self.ENTROPY_SIZE
+        return self._entropy[offset : offset + self.ENTROPY_SIZE]
+
+    def next_int(self) -> int:
+        with self._lock:
+            entropy = self._next_entropy()
+            ms = time.time_ns() // 1_000_000
+            if ms <= self._last_ms:
+                # same millisecond (or clock moved back), keep ids monotonic
+                ms = self._last_ms
+                self._counter += 1
+                if self._counter > _COUNTER_MAX:
+                    ms += 1
+                    self._counter = 0
+            else:
+                # leave half of counter space for ids generated in the same ms
+                self._counter = int.from_bytes(entropy[:2], "big") >> 5
+            self._last_ms = ms
+            rand_b = int.from_bytes(entropy[2:], "big") & _RAND_B_MASK
+            return (
+                (ms << 80) | (0x7 << 76) | (self._counter << 64) | (0b10 << 62) | rand_b
+            )
+
+    @abstractmethod
+    def __call__(self) -> str:
+        raise NotImplementedError
+
+
+class UUID7Generator(TimeOrderedIdGenerator):
+    """Generates UUIDv7 (RFC 9562) strings, e.g. 01890a5d-ac96-774b-bcce-b302099a8057"""
+
+    def __call__(self) -> str:
+        h = "%032x" % self.next_int()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+class ULIDGenerator(TimeOrderedIdGenerator):
+    """Generates ULID strings (26 characters, Crockford's base32)"""
+
+    def __call__(self) -> str:
+        value = self.next_int()
+        return "".join(
+            CROCKFORD_ALPHABET[(value >> shift) & 0x1F] for shift in range(125, -1, -5)
+        )
+
+
+def id_timestamp_ms(value: str) -> int:
+    """Return unix time in milliseconds encoded in UUIDv7 or ULID string"""
+    if len(value) == 26:
+        ms = 0
+        for char in value[:10]:
+            ms = (ms << 5) | CROCKFORD_ALPHABET.index(char.upper())
+        return ms
+    return int(value.replace("-", "")[:12], 16)
+
+
+_id_generator: Callable[[], str] = str_uuid
+
+
+def set_id_generator(generator: Callable[[], str]) -> None:
+    """
+    Set function used to generate CloudEvent ids (`id` and `trace_id`),
+    e.g. `set_id_generator(UUID7Generator())`. Defaults to random UUID4 strings.
+    """
+    global _id_generator
+    _id_generator = generator
+
+
+def generate_id() -> str:
+    return _id_generator()
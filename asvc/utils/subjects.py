@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from typing import Generic, Hashable, TypeVar
+
+V = TypeVar("V", bound=Hashable)
+
+
+class _Node(Generic[V]):
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node[V]] = {}
+        self.values: dict[V, None] = {}
+
+
+class SubjectTrie(Generic[V]):
+    """
+    Maps NATS style subject patterns (dot separated tokens) to values.
+    `*` matches exactly one token, `>` (only as the last token) matches one or more tokens.
+    Results of `match` are cached until the trie is modified.
+    :param cache_size: max number of cached subjects
+    """
+
+    def __init__(self, cache_size: int = 4096) -> None:
+        self.cache_size = cache_size
+        self._root: _Node[V] = _Node()
+        self._cache: dict[str, list[V]] = {}
+
+    def insert(self, pattern: str, value: V) -> None:
+        node = self._root
+        for token in pattern.split("."):
+            node = node.children.setdefault(token, _Node())
+        node.values[value] = None
+        self._cache.clear()
+
+    def remove(self, pattern: str, value: V) -> None:
+        path = [self._root]
+        for token in pattern.split("."):
+            node = path[-1].children.get(token)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].values.pop(value, None)
+        # prune empty nodes
+        for token, parent, node in zip(
+            reversed(pattern.split(".")), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if node.values or node.children:
+                break
+            del parent.children[token]
+        self._cache.clear()
+
+    def match(self, subject: str) -> list[V]:
+        """Return values of all patterns matching `subject`, without duplicates"""
+        try:
+            return self._cache[subject]
+        except KeyError:
+            pass
+        found: dict[V, None] = {}
+        self._match(self._root, subject.split("."), 0, found)
+        result = list(found)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[subject] = result
+        return result
+
+    def _match(
+        self, node: _Node[V], tokens: list[str], index: int, found: dict[V, None]
+    ) -> None:
+        if index == len(tokens):
+            found.update(node.values)
+            return
+        children = node.children
+        child = children.get(tokens[index])
+        if child is not None:
+            self._match(child, tokens, index + 1, found)
+        child = children.get("*")
+        if child is not None:
+            self._match(child, tokens, index + 1, found)
+        child = children.get(">")
+        if child is not None:
+            found.update(child.values)
+
+    def __bool__(self) -> bool:
+        return bool(self._root.children)
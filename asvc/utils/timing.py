@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import random
+import time
+from typing import Union
+
+
+class StageTimer:
+    """
+    Measures duration of consecutive message handling stages,
+    each `mark` records time (in milliseconds) elapsed since the previous one
+    """
+
+    __slots__ = ("timings", "_last")
+
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+        self._last = time.perf_counter_ns()
+
+    def __bool__(self) -> bool:
+        return True
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter_ns()
+        self.timings[stage] = (now - self._last) / 1_000_000
+        self._last = now
+
+
+class NullStageTimer:
+    """Timer used for messages not sampled, does nothing"""
+
+    __slots__ = ()
+
+    timings: dict[str, float] = {}
+
+    def __bool__(self) -> bool:
+        return False
+
+    def mark(self, stage: str) -> None:
+        pass
+
+
+NULL_TIMER = NullStageTimer()
+
+Timer = Union[StageTimer, NullStageTimer]
+
+
+def start_stage_timer(sample_rate: float) -> Timer:
+    """
+    Return stage timer for `sample_rate` fraction of calls, no-op timer otherwise
+    :param sample_rate: fraction of messages to measure, between 0 and 1
+    """
+    if sample_rate and (sample_rate >= 1 or random.random() < sample_rate):  # nosec
+        return StageTimer()
+    return NULL_TIMER
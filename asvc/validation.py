@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import functools
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable
+
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+
+from .serialization import is_structured, load_header
+from .utils.datetime import parse_datetime
+from .utils.enum import AutoEnum
+
+if TYPE_CHECKING:
+    from .models import CloudEvent
+
+_missing = object()
+
+
+class ValidationMode(AutoEnum):
+    """
+    How incoming messages are validated:
+    - full: pydantic validation of the whole event (default)
+    - envelope: validate only event attributes, data is not validated
+    - trusted: no validation, only for producers using the same event model
+    """
+
+    full = AutoEnum.auto()
+    envelope = AutoEnum.auto()
+    trusted = AutoEnum.auto()
+
+
+def _construct(cls: type[BaseModel], values: dict[str, Any], fields_set: set[str]):
+    """Create model instance from already validated values, same as .construct()"""
+    m = cls.__new__(cls)
+    object.__setattr__(m, "__dict__", values)
+    object.__setattr__(m, "__fields_set__", fields_set)
+    m._init_private_attributes()
+    return m
+
+
+def _data_constructor(cls: type[CloudEvent]) -> Callable[[Any], Any] | None:
+    field = cls.__fields__.get("data")
+    if field is None:
+        return None
+    type_ = field.outer_type_
+    if isinstance(type_, type) and issubclass(type_, BaseModel):
+
+        def construct(value: Any) -> Any:
+            return type_.construct(**value) if isinstance(value, dict) else value
+
+        return construct
+    return None
+
+
+class EnvelopeValidator:
+    """Validates CloudEvent attributes only, `data` is constructed without validation"""
+
+    def __init__(self, cls: type[CloudEvent]) -> None:
+        self.cls = cls
+        self.fields = [(n, f) for n, f in cls.__fields__.items() if n != "data"]
+        self.construct_data = _data_constructor(cls)
+
+    def __call__(self, obj: dict[str, Any]) -> CloudEvent:
+        obj = dict(obj)
+        values: dict[str, Any] = {}
+        errors: list[ErrorWrapper] = []
+        for name, field in self.fields:
+            value = obj.pop(field.alias, _missing)
+            if value is _missing:
+                value = obj.pop(name, _missing)
+            if value is _missing:
+                if field.required:
+                    errors.append(ErrorWrapper(MissingError(), loc=field.alias))
+                else:
+                    values[name] = field.get_default()
+                continue
+            value, error = field.validate(value, values, loc=field.alias, cls=self.cls)
+            if error:
+                errors.append(error)  # type: ignore
+            else:
+                values[name] = value
+        if errors:
+            raise ValidationError(errors, self.cls)
+        data = obj.pop("data", None)
+        values["data"] = self.construct_data(data) if self.construct_data else data
+        values.update(obj)
+        return _construct(self.cls, values, set(values))
+
+
+class TrustedValidator:
+    """
+    Creates CloudEvent without validation, with field aliases and defaults resolved once.
+    Only datetime attributes are parsed, as they are sent as strings or integers,
+    and structured attributes sent as JSON-encoded headers in binary content mode.
+    """
+
+    def __init__(self, cls: type[CloudEvent]) -> None:
+        self.cls = cls
+        self.names = {f.alias: n for n, f in cls.__fields__.items()}
+        self.optional = [(n, f) for n, f in cls.__fields__.items() if not f.required]
+        self.datetimes = [
+            n for n, f in cls.__fields__.items() if f.outer_type_ is datetime
+        ]
+        self.structured = [
+            (n, f)
+            for n, f in cls.__fields__.items()
+            if n != "data" and is_structured(f)
+        ]
+        self.construct_data = _data_constructor(cls)
+
+    def __call__(self, obj: dict[str, Any]) -> CloudEvent:
+        names = self.names
+        values = {names.get(k, k): v for k, v in obj.items()}
+        fields_set = set(values)
+        for name in self.datetimes:
+            value = values.get(name)
+            if value is not None and not isinstance(value, datetime):
+                values[name] = parse_datetime(value)
+        for name, field in self.structured:
+            if name in values:
+                values[name] = load_header(values[name], field)
+        if self.construct_data and "data" in values:
+            values["data"] = self.construct_data(values["data"])
+        for name, field in self.optional:
+            if name not in values:
+                values[name] = field.get_default()
+        return _construct(self.cls, values, fields_set)
+
+
+@functools.lru_cache(maxsize=None)
+def get_validator(
+    cls: type[CloudEvent], mode: ValidationMode = ValidationMode.full
+) -> Callable[[Any], CloudEvent]:
+    """Return message validator for event class, cached per class and mode"""
+    if mode == ValidationMode.envelope:
+        return EnvelopeValidator(cls)
+    if mode == ValidationMode.trusted:
+        return TrustedValidator(cls)
+    return cls.parse_obj
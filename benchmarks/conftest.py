@@ -0,0 +1,63 @@
+import asyncio
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from asvc import CloudEvent
+
+
+class _Queue(asyncio.Queue):
+    """Stub broker queue, without unfinished tasks accounting"""
+
+    def task_done(self) -> None:
+        pass
+
+
+class Item(BaseModel):
+    sku: str
+    quantity: int
+    price: float
+
+
+class Order(BaseModel):
+    order_id: int
+    customer: str
+    items: List[Item]
+    total: float
+
+
+class OrderCreated(CloudEvent):
+    data: Order
+
+
+def make_payload(items: int) -> dict:
+    return {
+        "order_id": 1,
+        "customer": "customer@example.com",
+        "items": [
+            {"sku": f"sku-{i}", "quantity": i, "price": 9.99} for i in range(items)
+        ],
+        "total": 9.99 * items,
+    }
+
+
+# number of order items, ~100B, ~5KB and ~500KB of encoded data
+PAYLOAD_SIZES = {"small": 1, "medium": 100, "large": 10000}
+
+
+@pytest.fixture(params=list(PAYLOAD_SIZES))
+def payload_size(request):
+    return request.param
+
+
+@pytest.fixture
+def payload(payload_size):
+    return make_payload(PAYLOAD_SIZES[payload_size])
+
+
+@pytest.fixture
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
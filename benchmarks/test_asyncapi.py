@@ -0,0 +1,32 @@
+"""
+AsyncAPI specification build for a service with many consumers.
+Run with: pytest benchmarks/test_asyncapi.py
+"""
+import pytest
+from conftest import OrderCreated
+
+from asvc import CloudEvent, Service
+from asvc.asyncapi.generator import get_async_api_spec
+from asvc.backends.stub import StubBroker
+
+CONSUMERS = 50
+
+
+@pytest.fixture
+def service():
+    service = Service(name="bench", broker=StubBroker())
+    for i in range(CONSUMERS):
+        event_type = OrderCreated if i % 2 else CloudEvent
+
+        async def consumer(message):
+            return None
+
+        consumer.__annotations__["message"] = event_type
+        service.subscribe(f"topic.{i}", name=f"consumer_{i}")(consumer)
+    return service
+
+
+def test_asyncapi_spec(benchmark, service):
+    benchmark.extra_info["consumers"] = CONSUMERS
+    spec = benchmark(get_async_api_spec, service)
+    assert len(spec.channels) == CONSUMERS
@@ -0,0 +1,33 @@
+"""
+Encoding and decoding cost per encoder and payload size.
+Run with: pytest benchmarks/test_encoders.py --benchmark-group-by=func,param:payload_size
+"""
+import pytest
+
+from asvc.utils.imports import import_from_string
+
+ENCODERS = {
+    "json": "asvc.encoders.json:JsonEncoder",
+    "orjson": "asvc.encoders.orjson:OrjsonEncoder",
+    "msgpack": "asvc.encoders.msgpack:MsgPackEncoder",
+    "pickle": "asvc.encoders.pickle:PickleEncoder",
+}
+
+
+@pytest.fixture(params=list(ENCODERS))
+def encoder(request):
+    try:
+        return import_from_string(ENCODERS[request.param])()
+    except ImportError:
+        pytest.skip(f"{request.param} not installed")
+
+
+def test_encode(benchmark, encoder, payload):
+    data = benchmark(encoder.encode, payload)
+    benchmark.extra_info["size_bytes"] = len(data)
+
+
+def test_decode(benchmark, encoder, payload):
+    data = encoder.encode(payload)
+    benchmark.extra_info["size_bytes"] = len(data)
+    assert benchmark(encoder.decode, data) == payload
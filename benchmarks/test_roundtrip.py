@@ -0,0 +1,56 @@
+"""
+Publish to ack round trip on StubBroker, with increasing number of middlewares.
+Run with: pytest benchmarks/test_roundtrip.py --benchmark-group-by=func
+"""
+import pytest
+from conftest import OrderCreated, _Queue, make_payload
+
+from asvc import Service
+from asvc.backends.stub import StubBroker
+from asvc.middleware import Middleware
+
+MESSAGES = 100
+
+
+class NoopMiddleware(Middleware):
+    async def before_process_message(self, broker, consumer, message):
+        pass
+
+    async def after_process_message(
+        self, broker, consumer, message, result=None, exc=None
+    ):
+        pass
+
+
+@pytest.fixture(params=(0, 3, 10))
+def middlewares(request):
+    return request.param
+
+
+@pytest.fixture
+def service(middlewares):
+    broker = StubBroker(middlewares=[NoopMiddleware() for _ in range(middlewares)])
+    broker.topics["orders"] = _Queue()
+    service = Service(name="bench", broker=broker)
+
+    @service.subscribe("orders", name="consumer")
+    async def consumer(message: OrderCreated):
+        return None
+
+    return service
+
+
+def test_publish_to_ack(benchmark, service, middlewares, event_loop):
+    broker = service.broker
+    queue = broker.topics["orders"]
+    handler = broker.get_handler(service, service.consumers["consumer"])
+    data = make_payload(3)
+
+    async def roundtrip():
+        for _ in range(MESSAGES):
+            await service.publish("orders", data, type_=OrderCreated)
+            await handler(queue.get_nowait())
+
+    benchmark.extra_info["messages_per_round"] = MESSAGES
+    benchmark.extra_info["middlewares"] = middlewares
+    benchmark(lambda: event_loop.run_until_complete(roundtrip()))
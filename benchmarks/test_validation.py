@@ -0,0 +1,75 @@
+"""
+Per-message cost of consumer validation modes.
+Run with: pytest benchmarks/test_validation.py --benchmark-group-by=func,param:shape
+"""
+from typing import List
+
+import pytest
+from conftest import Order, OrderCreated, _Queue, make_payload
+
+from asvc import CloudEvent, Service
+from asvc.backends.stub import Message, StubBroker
+
+MESSAGES = 100
+
+
+class OrderList(CloudEvent):
+    data: List[Order]
+
+
+# event class and data of each event shape
+SHAPES = {
+    "untyped": (CloudEvent, lambda: {"order_id": 1, "customer": "c", "total": 9.99}),
+    "model": (OrderCreated, lambda: make_payload(3)),
+    "nested": (OrderList, lambda: [make_payload(3) for _ in range(20)]),
+}
+
+
+@pytest.fixture(params=("full", "envelope", "trusted"))
+def validation(request):
+    return request.param
+
+
+@pytest.fixture(params=list(SHAPES))
+def shape(request):
+    return request.param
+
+
+@pytest.fixture
+def service(validation, shape):
+    service = Service(name="bench", broker=StubBroker())
+    event_type = SHAPES[shape][0]
+
+    async def consumer(message):
+        return None
+
+    consumer.__annotations__["message"] = event_type
+    service.subscribe("orders", name="consumer", validation=validation)(consumer)
+    return service
+
+
+@pytest.fixture
+def event(shape):
+    event_type, make_data = SHAPES[shape]
+    return event_type(topic="orders", source="bench", data=make_data())
+
+
+def test_validate_message(benchmark, service, event):
+    broker = service.broker
+    payload = broker.decode_message(*broker.encode_message(event))
+    consumer = service.consumers["consumer"]
+    benchmark(consumer.validate_message, payload)
+
+
+def test_stub_broker_handler(benchmark, service, event, event_loop):
+    broker = service.broker
+    data, headers = broker.encode_message(event)
+    message = Message(data=data, queue=_Queue(), headers=headers)
+    handler = broker.get_handler(service, service.consumers["consumer"])
+
+    async def process_batch():
+        for _ in range(MESSAGES):
+            await handler(message)
+
+    benchmark.extra_info["messages_per_round"] = MESSAGES
+    benchmark(lambda: event_loop.run_until_complete(process_batch()))
@@ -1,9 +1,21 @@
+import asyncio
+
 import pytest
+from aiokafka import TopicPartition
+from aiokafka.structs import ConsumerRecord
 
+from asvc import CloudEvent
 from asvc.broker import Broker
 from asvc.backends.nats import NatsBroker, JetStreamBroker
 from asvc.backends.kafka import KafkaBroker
+from asvc.backends.kafka.broker import (
+    DELIVERY_COUNT_HEADER,
+    RETRY_AT_HEADER,
+    get_retry_at,
+    get_retry_topic,
+)
 from asvc.backends.pubsub import PubSubBroker
+from asvc.backends.stub import Message, StubBroker
 from asvc.backends.rabbitmq import RabbitmqBroker
 
 backends = [NatsBroker, JetStreamBroker, KafkaBroker, PubSubBroker, RabbitmqBroker]
@@ -12,3 +24,148 @@ backends = [NatsBroker, JetStreamBroker, KafkaBroker, PubSubBroker, RabbitmqBrok
 @pytest.mark.parametrize("broker", backends)
 def test_is_subclass(broker):
     assert issubclass(broker, Broker)
+
+
+class FakeProducer:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+
+    async def send_and_wait(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+class FakeSubscriber:
+    def __init__(self):
+        self.committed = []
+        self.seeks = []
+        self.paused = set()
+
+    async def commit(self, offsets):
+        self.committed.append(offsets)
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+    def pause(self, *tps):
+        self.paused.update(tps)
+
+    def resume(self, *tps):
+        self.paused.difference_update(tps)
+
+
+def make_record(broker, offset, headers=(), topic="orders"):
+    data, message_headers = broker.encode_message(CloudEvent(topic="orders"))
+    return ConsumerRecord(
+        topic,
+        0,
+        offset,
+        0,
+        0,
+        b"key",
+        data,
+        0,
+        3,
+        len(data),
+        [*((k, v.encode()) for k, v in message_headers.items()), *headers],
+    )
+
+
+async def test_kafka_nack_republishes_with_delivery_count():
+    broker = KafkaBroker(bootstrap_servers="localhost:9092")
+    broker._publisher = FakeProducer()
+    subscriber = FakeSubscriber()
+    tp = TopicPartition("orders", 0)
+    records = [
+        make_record(broker, 0),
+        make_record(broker, 1, [(DELIVERY_COUNT_HEADER, b"2")]),
+        make_record(broker, 2),
+    ]
+
+    async def handler(record):
+        if record.offset == 1:
+            await broker._nack(record)
+
+    await broker._handle_batch(subscriber, handler, tp, records, "orders.g.retry")
+    assert subscriber.committed == [{tp: 3}]
+    assert not subscriber.seeks
+    (sent,) = broker._publisher.sent
+    assert sent["topic"] == "orders.g.retry"
+    assert sent["key"] == b"key"
+    assert sent["value"] == records[1].value
+    assert (DELIVERY_COUNT_HEADER, b"3") in sent["headers"]
+    assert (DELIVERY_COUNT_HEADER, b"2") not in sent["headers"]
+    assert broker.get_delivery_count(records[1]) == 3
+
+
+def test_kafka_retry_topic():
+    assert get_retry_topic("orders", "svc:consumer") == "orders.svc_consumer.retry"
+
+
+async def test_kafka_pauses_until_retry_is_due():
+    broker = KafkaBroker(bootstrap_servers="localhost:9092")
+    broker._publisher = FakeProducer()
+    subscriber = FakeSubscriber()
+    tp = TopicPartition("orders.g.retry", 0)
+    handled = []
+
+    async def handler(record):
+        handled.append(record.offset)
+        await broker._nack(record, delay=60)
+
+    records = [make_record(broker, 0, topic="orders.g.retry")]
+    resume = await broker._handle_batch(
+        subscriber, handler, tp, records, "orders.g.retry"
+    )
+    assert resume is None
+    (sent,) = broker._publisher.sent
+    due = make_record(broker, 1, sent["headers"], topic="orders.g.retry")
+    assert RETRY_AT_HEADER in dict(sent["headers"])
+    assert get_retry_at(due) > get_retry_at(records[0])
+
+    resume = await broker._handle_batch(
+        subscriber, handler, tp, [due], "orders.g.retry"
+    )
+    assert handled == [0]
+    assert subscriber.paused == {tp}
+    assert subscriber.seeks == [(tp, 1)]
+    assert subscriber.committed == [{tp: 1}]
+    resume.cancel()
+
+
+def test_kafka_parses_non_utf8_headers():
+    broker = KafkaBroker(bootstrap_servers="localhost:9092")
+    record = make_record(broker, 0, [("traceparent", b"\xff\xfe"), ("empty", None)])
+    assert broker.parse_incoming_message(record)["subject"] == "orders"
+
+
+async def test_kafka_seeks_back_when_republish_fails():
+    broker = KafkaBroker(bootstrap_servers="localhost:9092")
+    subscriber = FakeSubscriber()
+    tp = TopicPartition("orders", 0)
+    records = [make_record(broker, offset) for offset in range(3)]
+
+    async def handler(record):
+        if record.offset == 1:
+            await broker._nack(record)
+
+    await broker._handle_batch(subscriber, handler, tp, records, "orders.g.retry")
+    assert subscriber.committed == [{tp: 1}]
+    assert subscriber.seeks == [(tp, 1)]
+    assert not broker._unsettled
+
+
+async def test_stub_nack_redelivers_later():
+    broker = StubBroker()
+    queue = broker.topics["orders"]
+    await queue.put(Message(data=b"{}", queue=queue))
+    message = await queue.get()
+    await asyncio.wait_for(broker._nack(message, delay=0.05), 0.01)
+    assert queue.empty()
+    redelivered = await asyncio.wait_for(queue.get(), 1)
+    assert redelivered is message
+    assert broker.get_delivery_count(message) == 2
+    await broker._ack(message)
+    await asyncio.wait_for(queue.join(), 0.1)
@@ -1,3 +1,52 @@
+from datetime import datetime
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from asvc import CloudEvent
+
+
+class Item(BaseModel):
+    name: str
+    price: float
+
+
+class ItemEvent(CloudEvent):
+    data: Item
+
+
+def broker_roundtrip(broker, ce):
+    return broker.decode_message(*broker.encode_message(ce))
+
+
 async def test_consumer_process(test_consumer, ce):
     res = await test_consumer.process(ce)
     assert res == 42
+
+
+@pytest.mark.parametrize("validation", ("full", "envelope", "trusted"))
+def test_validation_modes(service, validation):
+    @service.subscribe("test_topic", name=validation, validation=validation)
+    async def handler(message: ItemEvent):
+        pass
+
+    consumer = service.consumers[validation]
+    ce = ItemEvent(topic="test_topic", data={"name": "item", "price": 1.5})
+    message = consumer.validate_message(broker_roundtrip(service.broker, ce))
+    assert isinstance(message, ItemEvent)
+    assert isinstance(message.data, Item)
+    assert isinstance(message.time, datetime)
+    assert message == ce
+
+
+def test_envelope_validation_errors(service):
+    @service.subscribe("test_topic", validation="envelope")
+    async def handler(message: ItemEvent):
+        pass
+
+    consumer = service.consumers["handler"]
+    with pytest.raises(ValidationError):
+        consumer.validate_message({"id": "1", "time": "not a date"})
+    # data is not validated
+    message = consumer.validate_message({"subject": "test_topic", "data": {"x": 1}})
+    assert message.data.x == 1
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from asvc import CloudEvent, Service
+from asvc.backends.memory import InMemoryBroker
+from asvc.dlq import get_replay_group, replay, restore_message
+from asvc.exceptions import Fail
+from asvc.middleware import Middleware
+from asvc.middlewares import DeadLetterMiddleware, RetryMiddleware
+from asvc.middlewares.retries import RetryConsumerOptions
+from asvc.publisher import BatchPublisher
+
+
+class BatchRecorder(Middleware):
+    def __init__(self):
+        self.published = []
+
+    async def after_publish(self, broker, message, **kwargs):
+        self.published.append(message)
+
+
+@pytest.mark.parametrize("exc, deliveries", [(ValueError("boom"), 3), (Fail(), 1)])
+async def test_dead_letter_after_retries(broker, service, ce, exc, deliveries):
+    broker.add_middleware(
+        RetryMiddleware(RetryConsumerOptions(backoff_factor=0.001, max_retries=2))
+    )
+    broker.add_middleware(DeadLetterMiddleware(linger=0.001))
+
+    @service.subscribe("test_topic", name="failing")
+    async def failing(message: CloudEvent):
+        raise exc
+
+    handler = broker.get_handler(service, service.consumers["failing"])
+    await broker.publish_event(ce)
+    for _ in range(deliveries):
+        await handler(await broker.topics[ce.topic].get())
+    assert broker.topics[ce.topic].empty()
+
+    dead_letter = broker.decode_message(
+        broker.topics["test_topic.dlq"].get_nowait().data
+    )
+    assert dead_letter["id"] == ce.id
+    assert dead_letter["dlqtopic"] == "test_topic"
+    assert dead_letter["dlqconsumer"] == "failing"
+    assert dead_letter["dlqdeliveries"] == deliveries
+    assert dead_letter["dlqerror"].startswith(type(exc).__name__)
+
+    restored = restore_message(CloudEvent.parse_obj(dead_letter))
+    assert restored.topic == "test_topic"
+    assert "dlqerror" not in restored.__dict__
+
+
+async def test_batch_publisher():
+    recorder = BatchRecorder()
+    broker = InMemoryBroker(middlewares=[recorder])
+    publisher = BatchPublisher(broker, batch_size=3, linger=0.01)
+    batches = []
+
+    async def publish_batch(messages, **kwargs):
+        batches.append(len(messages))
+
+    broker._publish_batch = publish_batch
+    events = [CloudEvent(type="Test", topic="test", data=n) for n in range(5)]
+    await asyncio.gather(*(publisher.publish(e) for e in events))
+    assert batches == [3, 2]
+    assert [e.data for e in recorder.published] == list(range(5))
+
+
+async def test_replay():
+    recorder = BatchRecorder()
+    broker = InMemoryBroker(middlewares=[recorder])
+    # replay queue group must exist before dead-lettering
+    broker.get_group(
+        Service(broker, "dlq-replay"), _Consumer("orders_dlq", "orders.dlq")
+    )
+    middleware = DeadLetterMiddleware()
+    for n in range(3):
+        event = CloudEvent(type="Order", topic="orders", data=n)
+        await broker.publish_event(
+            middleware.make_dead_letter(_Consumer("handle"), event, ValueError())
+        )
+
+    replayed = await replay(broker, "orders.dlq", limit=2, idle_timeout=0.1)
+    assert replayed == 2
+    restored = [m for m in recorder.published if m.topic == "orders"]
+    assert sorted(m.data for m in restored) == [0, 1]
+    assert all("dlqtopic" not in m.__dict__ for m in restored)
+
+
+class _Consumer:
+    def __init__(self, name, topic=None):
+        self.name = name
+        self.topic = topic or name
+
+
+def test_replay_group_name_is_sanitized():
+    assert get_replay_group("orders.dlq") == "dlq-replay:orders_dlq"
+    assert get_replay_group("orders.*.>") == "dlq-replay:orders____"
@@ -1,6 +1,7 @@
 import pytest
 
 from asvc import CloudEvent
+from asvc.encoders import get_encoder
 from asvc.encoders.json import JsonEncoder
 from asvc.encoders.msgpack import MsgPackEncoder
 from asvc.encoders.orjson import OrjsonEncoder
@@ -27,3 +28,26 @@ def test_encoder_cloud_events(encoder, data):
     assert isinstance(encoded, bytes)
     decoded = encoder.decode(encoded)
     assert decoded["data"] == ce_dict["data"]
+
+
+@pytest.mark.parametrize(
+    "content_type, encoder",
+    (
+        ("application/json", OrjsonEncoder),
+        ("application/json; charset=utf-8", OrjsonEncoder),
+        ("application/x-msgpack", MsgPackEncoder),
+    ),
+)
+def test_get_encoder(content_type, encoder):
+    assert isinstance(get_encoder(content_type), encoder)
+
+
+def test_get_encoder_unknown_content_type():
+    assert get_encoder("application/octet-stream") is None
+
+
+def test_broker_decodes_by_content_type(broker):
+    data = {"key": "value"}
+    assert broker.decode(MsgPackEncoder.encode(data), "application/x-msgpack") == data
+    assert broker.decode(broker.encoder.encode(data), "text/unknown") == data
+    assert broker.get_encoder(None) is broker.encoder
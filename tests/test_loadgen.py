@@ -0,0 +1,70 @@
+import enum
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pytest
+from pydantic import BaseModel
+
+from asvc import CloudEvent, Service
+from asvc.backends.stub import StubBroker
+from asvc.exceptions import ConfigurationError
+from asvc.loadgen import make_event, percentile, run_bench, use_broker
+
+
+class Color(enum.Enum):
+    red = "red"
+    green = "green"
+
+
+class Address(BaseModel):
+    city: str
+    zip_code: Optional[int]
+
+
+class User(BaseModel):
+    name: str
+    age: int
+    color: Color
+    created: datetime
+    tags: List[str]
+    scores: Dict[str, float]
+    addresses: List[Address]
+
+
+class UserCreated(CloudEvent):
+    data: User
+
+
+def test_make_event_from_schema(service: Service):
+    @service.subscribe("users.*", name="user_consumer")
+    async def handler(message: UserCreated):
+        pass
+
+    event = make_event(service.consumers["user_consumer"])
+    assert isinstance(event, UserCreated)
+    assert isinstance(event.data, User)
+    assert event.topic == "users.bench"
+    assert event.data.addresses[0].city
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+async def test_run_bench(service: Service, test_consumer):
+    broker = use_broker(service)
+    assert isinstance(broker, StubBroker)
+    result = await run_bench(service, count=100, timeout=5)
+    assert result.processed == 100
+    assert result.errors == 0
+    assert result.throughput > 0
+    summary = result.summary()
+    assert summary["latency_p50_ms"] <= summary["latency_p99_ms"]
+
+
+def test_use_broker_url_not_supported(service: Service):
+    with pytest.raises(ConfigurationError):
+        use_broker(service, "nats://localhost:4222")
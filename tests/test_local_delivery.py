@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from asvc import CloudEvent, ForwardResponse, Service
+from asvc.backends.stub import StubBroker
+from asvc.local import LOCAL_ORIGIN, LocalMessage
+
+
+class CountingBroker(StubBroker):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.published = []
+
+    async def _publish(self, message, **kwargs):
+        self.published.append(message)
+        await super()._publish(message, **kwargs)
+
+
+async def run_service(local_delivery, publish_kwargs=None):
+    broker = CountingBroker(local_delivery=local_delivery)
+    service = Service(name="test", broker=broker)
+    received = []
+
+    @service.subscribe("orders")
+    async def handle(message: CloudEvent):
+        received.append(message)
+
+    await service.start()
+    await asyncio.sleep(0)
+    await service.publish("orders", {"id": 1}, **(publish_kwargs or {}))
+    await asyncio.sleep(0.01)
+    await service.stop()
+    return broker, received
+
+
+@pytest.mark.parametrize(
+    "mode, published, local",
+    [("remote", 1, False), ("local", 0, True), ("mirror", 1, True)],
+)
+@pytest.mark.asyncio
+async def test_delivery_modes(mode, published, local):
+    broker, received = await run_service(mode)
+    assert len(received) == 1
+    assert isinstance(received[0].raw, LocalMessage) is local
+    assert len(broker.published) == published
+    if mode == "mirror":
+        assert getattr(broker.published[0], LOCAL_ORIGIN) == broker._instance_id
+
+
+@pytest.mark.asyncio
+async def test_delivery_override():
+    broker, received = await run_service("remote", {"delivery": "local"})
+    assert len(received) == 1
+    assert not broker.published
+
+
+@pytest.mark.asyncio
+async def test_forward_response_chain():
+    broker = CountingBroker(local_delivery="local")
+    service = Service(name="test", broker=broker)
+    totals = []
+
+    @service.subscribe("orders", forward_response=ForwardResponse(topic="totals"))
+    async def handle_order(message: CloudEvent):
+        return message.data["amount"] * 2
+
+    @service.subscribe("totals")
+    async def handle_total(message: CloudEvent):
+        totals.append(message.data)
+
+    await service.start()
+    await asyncio.sleep(0)
+    await service.publish("orders", {"amount": 21})
+    await asyncio.sleep(0.01)
+    await service.stop()
+    assert totals == [42]
+    assert not broker.published
+
+
+@pytest.mark.asyncio
+async def test_no_local_consumers_publishes_remotely():
+    broker = CountingBroker(local_delivery="local")
+    await broker.connect()
+    await broker.publish("orders", {"id": 1})
+    await broker.disconnect()
+    assert len(broker.published) == 1
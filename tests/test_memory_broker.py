@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from asvc import CloudEvent, Service
+from asvc.backends.memory import InMemoryBroker, InMemoryMessage, QueueGroup
+from asvc.exceptions import Retry
+from asvc.utils.subjects import SubjectTrie
+
+
+class Order(CloudEvent):
+    data: dict
+
+
+@pytest.mark.parametrize(
+    "pattern, subject, matches",
+    [
+        ("orders.created", "orders.created", True),
+        ("orders.created", "orders.updated", False),
+        ("orders.*", "orders.created", True),
+        ("orders.*", "orders.created.eu", False),
+        ("orders.>", "orders.created.eu", True),
+        ("orders.>", "orders", False),
+        ("*.created", "orders.created", True),
+    ],
+)
+def test_subject_trie_match(pattern, subject, matches):
+    trie = SubjectTrie()
+    trie.insert(pattern, "group")
+    assert (trie.match(subject) == ["group"]) is matches
+
+
+def test_subject_trie_remove():
+    trie = SubjectTrie()
+    trie.insert("orders.*", "a")
+    trie.insert("orders.>", "a")
+    trie.insert("orders.created", "b")
+    assert trie.match("orders.created") == ["b", "a"]
+    trie.remove("orders.*", "a")
+    trie.remove("orders.>", "a")
+    assert trie.match("orders.created") == ["b"]
+    trie.remove("orders.created", "b")
+    assert not trie
+
+
+@pytest.mark.parametrize("serialize", [True, False])
+@pytest.mark.asyncio
+async def test_fan_out_and_queue_groups(serialize):
+    broker = InMemoryBroker(serialize=serialize)
+    received = {"billing": [], "shipping": []}
+    services = []
+    for name in received:
+        service = Service(name=name, broker=broker)
+
+        @service.subscribe("orders.>", name="handle")
+        async def handle(message: Order, name=name):
+            received[name].append(message.data["n"])
+
+        services.append(service)
+    for service in services:
+        await service.start()
+    await asyncio.sleep(0)
+    for i in range(20):
+        await broker.publish_event(Order(topic="orders.created", data={"n": i}))
+    await broker.publish_event(Order(topic="users.created", data={"n": -1}))
+    await asyncio.wait_for(broker.join(), 1)
+    for service in services:
+        await service.stop()
+    assert sorted(received["billing"]) == list(range(20))
+    assert sorted(received["shipping"]) == list(range(20))
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    broker = InMemoryBroker(serialize=False)
+    service = Service(name="test", broker=broker)
+    active = []
+
+    @service.subscribe("jobs", max_concurrency=3)
+    async def job(message: CloudEvent):
+        active.append(broker.in_flight())
+        await asyncio.sleep(0.01)
+
+    await service.start()
+    await asyncio.sleep(0)
+    for _ in range(9):
+        await broker.publish("jobs")
+    await asyncio.wait_for(broker.join(), 1)
+    await service.stop()
+    assert len(active) == 9
+    assert max(active) == 3
+
+
+@pytest.mark.asyncio
+async def test_nack_redelivers():
+    broker = InMemoryBroker()
+    service = Service(name="test", broker=broker)
+    deliveries = []
+
+    @service.subscribe("jobs")
+    async def job(message: CloudEvent):
+        deliveries.append(message.raw.deliveries)
+        if len(deliveries) < 3:
+            raise Retry(delay=0.01)
+
+    await service.start()
+    await asyncio.sleep(0)
+    await broker.publish("jobs")
+    await asyncio.wait_for(broker.join(), 1)
+    await service.stop()
+    assert deliveries == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_drain_stops_idle_workers():
+    broker = InMemoryBroker()
+    service = Service(name="test", broker=broker)
+
+    @service.subscribe("jobs", max_concurrency=3)
+    async def job(message: CloudEvent):
+        pass
+
+    await service.start()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert len(broker._getters) == 3
+    assert await broker.drain(timeout=1) == 0
+    await asyncio.sleep(0.01)
+    assert not broker._getters
+    await service.stop()
+
+
+@pytest.mark.asyncio
+async def test_join_when_handler_raises():
+    broker = InMemoryBroker()
+    await broker.connect()
+    group = broker.groups["test:jobs"] = QueueGroup("test:jobs", "jobs")
+
+    async def handler(message):
+        raise RuntimeError("handler failed")
+
+    await broker._put(InMemoryMessage(b"{}", group))
+    with pytest.raises(RuntimeError):
+        await broker._worker(group, handler)
+    await asyncio.wait_for(broker.join(), 1)
+
+
+def test_validate_passes_event_instances(test_consumer, ce):
+    assert test_consumer.validate_message(ce) is ce
@@ -0,0 +1,589 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from nats.js.errors import InvalidKeyError, KeyNotFoundError
+from nats.js.kv import _is_key_valid
+from prometheus_client import CollectorRegistry
+
+from asvc import CloudEvent
+from asvc.backends.nats.middlewares import (
+    NatsJetStreamResultMiddleware,
+    NatsKVDedupStore,
+)
+from asvc.exceptions import Postpone, Retry, Skip
+from asvc.middleware import Middleware
+from asvc.middlewares import (
+    DeduplicationMiddleware,
+    DedupStore,
+    EventLoopMonitorMiddleware,
+    HealthCheckMiddleware,
+    PrometheusMiddleware,
+    RateLimitMiddleware,
+    RateLimitStore,
+    ResultMiddleware,
+    RetryConsumerOptions,
+    RetryMiddleware,
+)
+from asvc.middlewares.ratelimit import TokenBucket
+
+
+class SkipMiddleware(Middleware):
+    async def before_process_message(self, broker, consumer, message):
+        raise Skip
+
+
+@pytest.fixture
+def registry():
+    return CollectorRegistry()
+
+
+def get_sample(registry, name, consumer):
+    return registry.get_sample_value(
+        name,
+        {"topic": consumer.topic, "service": "test_service", "consumer": consumer.name},
+    )
+
+
+async def test_prometheus_middleware(broker, service, test_consumer, ce, registry):
+    prometheus = PrometheusMiddleware(registry=registry, batch_size=10)
+    broker.add_middleware(prometheus)
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    for _ in range(3):
+        await broker.publish_event(ce)
+        await handler(await broker.topics[ce.topic].get())
+
+    assert get_sample(registry, "messages_total", test_consumer) == 0
+    prometheus.flush()
+    assert get_sample(registry, "messages_total", test_consumer) == 3
+    assert get_sample(registry, "messages_in_progress", test_consumer) == 0
+    assert get_sample(registry, "message_duration_ms_count", test_consumer) == 3
+    assert not prometheus._message_start.get()
+
+
+async def test_prometheus_immediate_updates(
+    broker, service, test_consumer, ce, registry
+):
+    prometheus = PrometheusMiddleware(registry=registry)
+    broker.add_middleware(prometheus)
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    await broker.publish_event(ce)
+    await handler(await broker.topics[ce.topic].get())
+
+    assert get_sample(registry, "messages_total", test_consumer) == 1
+    assert get_sample(registry, "messages_in_progress", test_consumer) == 0
+    assert get_sample(registry, "message_duration_ms_count", test_consumer) == 1
+
+
+async def test_prometheus_skipped_messages(
+    broker, service, test_consumer, ce, registry
+):
+    prometheus = PrometheusMiddleware(registry=registry, batch_size=1)
+    broker.add_middleware(prometheus)
+    broker.add_middleware(SkipMiddleware())
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    await broker.publish_event(ce)
+    await handler(await broker.topics[ce.topic].get())
+
+    prometheus.flush()
+    assert get_sample(registry, "messages_skipped_total", test_consumer) == 1
+    assert get_sample(registry, "messages_in_progress", test_consumer) == 0
+
+
+async def test_prometheus_multiprocess(
+    broker, service, test_consumer, ce, tmp_path, monkeypatch
+):
+    from prometheus_client import values
+
+    from asvc.middlewares.prometheus import get_multiprocess_registry
+
+    monkeypatch.setattr(values, "ValueClass", values.ValueClass)
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    prometheus = PrometheusMiddleware(
+        registry=CollectorRegistry(), batch_size=1, multiprocess_dir=str(tmp_path)
+    )
+    broker.add_middleware(prometheus)
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    for _ in range(2):
+        await broker.publish_event(ce)
+        await handler(await broker.topics[ce.topic].get())
+
+    assert list(tmp_path.glob("*.db"))
+    registry = get_multiprocess_registry(str(tmp_path))
+    assert get_sample(registry, "messages_total", test_consumer) == 2
+    assert get_sample(registry, "messages_in_progress", test_consumer) == 0
+    await prometheus.after_broker_disconnect(broker)
+    assert not list(tmp_path.glob("gauge_livesum_*.db"))
+
+
+class TimingMiddleware(Middleware):
+    def __init__(self):
+        self.timings = []
+
+    async def after_stage_timing(self, broker, consumer, message, timings):
+        self.timings.append(timings)
+
+
+@pytest.mark.parametrize("sample_rate,expected", [(0.0, 0), (1.0, 3)])
+async def test_stage_timing(broker, service, test_consumer, ce, sample_rate, expected):
+    middleware = TimingMiddleware()
+    broker.add_middleware(middleware)
+    broker.stage_sample_rate = sample_rate
+    handler = broker.get_handler(service, test_consumer)
+    for _ in range(3):
+        await broker.publish_event(ce)
+        await handler(await broker.topics[ce.topic].get())
+
+    assert len(middleware.timings) == expected
+    if expected:
+        assert list(middleware.timings[0]) == [
+            "decode",
+            "validate",
+            "before_process",
+            "process",
+            "after_process",
+            "ack",
+        ]
+
+
+async def test_prometheus_stage_timing(broker, service, test_consumer, ce, registry):
+    prometheus = PrometheusMiddleware(registry=registry)
+    broker.add_middleware(prometheus)
+    broker.stage_sample_rate = 1.0
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    await broker.publish_event(ce)
+    await handler(await broker.topics[ce.topic].get())
+
+    labels = {
+        "topic": test_consumer.topic,
+        "service": "test_service",
+        "consumer": test_consumer.name,
+        "stage": "process",
+    }
+    assert registry.get_sample_value("message_stage_duration_ms_count", labels) == 1
+
+
+async def test_broker_pause(broker, service, test_consumer, ce):
+    handler = broker.get_handler(service, test_consumer)
+    await broker.publish_event(ce)
+    broker.pause()
+    task = asyncio.create_task(handler(await broker.topics[ce.topic].get()))
+    await asyncio.sleep(0.01)
+    assert broker.is_paused
+    assert not task.done()
+    broker.resume()
+    await asyncio.wait_for(task, 1)
+
+
+async def test_event_loop_monitor(broker):
+    monitor = EventLoopMonitorMiddleware(interval=0.01, lag_threshold=0.05)
+    health = HealthCheckMiddleware(checkers=[monitor.get_health_status])
+    await health.after_broker_connect(broker)
+    await monitor.after_broker_connect(broker)
+    await asyncio.sleep(0.02)
+    assert monitor.tasks > 0
+    assert health.get_health_status()
+
+    time.sleep(0.1)  # block the event loop
+    await asyncio.sleep(0.001)
+    assert monitor.lag >= 0.05
+    assert not health.get_health_status()
+    await monitor.before_broker_disconnect(broker)
+
+
+def test_event_loop_monitor_pauses_consumers(broker, registry):
+    monitor = EventLoopMonitorMiddleware(
+        lag_threshold=0.5, pause_consumers=True, export_metrics=True, registry=registry
+    )
+    monitor.update(broker, 0.6, 10)
+    assert broker.is_paused
+    assert registry.get_sample_value("event_loop_lag_seconds") == 0.6
+    monitor.update(broker, 0.3, 10)
+    assert broker.is_paused
+    monitor.update(broker, 0.1, 10)
+    assert not broker.is_paused
+
+
+def test_event_loop_monitors_share_gauges(broker, registry):
+    first = EventLoopMonitorMiddleware(export_metrics=True, registry=registry)
+    second = EventLoopMonitorMiddleware(export_metrics=True, registry=registry)
+    assert first.lag_gauge is second.lag_gauge
+    second.update(broker, 0.2, 3)
+    assert registry.get_sample_value("event_loop_tasks") == 3
+
+
+class SettleRecorder(Middleware):
+    def __init__(self):
+        self.settled = []
+
+    async def after_ack(self, broker, consumer, message):
+        self.settled.append("ack")
+
+    async def after_nack(self, broker, consumer, message):
+        self.settled.append("nack")
+
+
+@pytest.mark.parametrize(
+    "exc, settled",
+    [
+        (ValueError(), ["nack", "nack", "ack"]),
+        (Retry(delay=0), ["nack", "nack", "ack"]),
+    ],
+)
+async def test_retry_middleware(broker, service, ce, exc, settled):
+    recorder = SettleRecorder()
+    broker.add_middleware(
+        RetryMiddleware(RetryConsumerOptions(backoff_factor=0.001, max_retries=2))
+    )
+    broker.add_middleware(recorder)
+    deliveries = []
+
+    @service.subscribe("test_topic", name="failing")
+    async def failing(message: CloudEvent):
+        deliveries.append(message.delivery_count)
+        raise exc
+
+    handler = broker.get_handler(service, service.consumers["failing"])
+    await broker.publish_event(ce)
+    for _ in range(3):
+        await handler(await broker.topics[ce.topic].get())
+    assert deliveries == [1, 2, 3]
+    assert recorder.settled == settled
+    assert broker.topics[ce.topic].empty()
+
+
+def test_retry_backoff(test_consumer):
+    retries = RetryMiddleware(RetryConsumerOptions(backoff_factor=5, max_backoff=60))
+    delays = [retries.get_delay(test_consumer, n) for n in range(5)]
+    assert delays == [5, 10, 20, 40, 60]
+    test_consumer.options["backoff"] = 1
+    assert retries.get_delay(test_consumer, 2) == 4
+
+
+async def test_retry_if_and_deprecated_retry_when(test_consumer, ce):
+    calls = []
+
+    async def retry_if(retries, exc):
+        calls.append(("retry_if", retries))
+        return True
+
+    async def retry_when(age, exc):
+        calls.append(("retry_when", age))
+        return False
+
+    ce._delivery_count = 3
+    retries = RetryMiddleware(RetryConsumerOptions(retry_if=retry_if))
+    assert await retries.should_retry(test_consumer, ce, ValueError())
+    retries = RetryMiddleware(RetryConsumerOptions(retry_when=retry_when))
+    with pytest.warns(DeprecationWarning):
+        assert not await retries.should_retry(test_consumer, ce, ValueError())
+    assert calls == [("retry_if", 2), ("retry_when", 0)]
+
+
+class PostponeOnceMiddleware(Middleware):
+    async def before_process_message(self, broker, consumer, message):
+        if message.delivery_count == 1:
+            raise Postpone(delay=0)
+
+
+async def test_postponed_deliveries_not_retries(broker, service, ce):
+    recorder = SettleRecorder()
+    broker.add_middleware(PostponeOnceMiddleware())
+    broker.add_middleware(
+        RetryMiddleware(RetryConsumerOptions(backoff_factor=0.001, max_retries=1))
+    )
+    broker.add_middleware(recorder)
+    postponed = []
+
+    @service.subscribe("test_topic", name="failing")
+    async def failing(message: CloudEvent):
+        postponed.append(message.postponed)
+        raise ValueError()
+
+    handler = broker.get_handler(service, service.consumers["failing"])
+    await broker.publish_event(ce)
+    for _ in range(3):
+        await handler(await broker.topics[ce.topic].get())
+    assert postponed == [1, 1]
+    assert recorder.settled == ["nack", "nack", "ack"]
+
+
+class MemoryDedupStore(DedupStore):
+    def __init__(self):
+        super().__init__()
+        self.keys = set()
+        self.lookups = []
+
+    async def contains_many(self, keys):
+        self.lookups.append(list(keys))
+        return [key in self.keys for key in keys]
+
+    async def add_many(self, keys, ttl):
+        self.keys.update(keys)
+
+
+@pytest.mark.parametrize("bloom", [False, True])
+async def test_deduplication_middleware(broker, service, ce, bloom):
+    store = MemoryDedupStore()
+    dedup = DeduplicationMiddleware(bloom=bloom, store=store)
+    broker.add_middleware(dedup)
+    processed = []
+
+    @service.subscribe("test_topic", name="dedup")
+    async def handle(message: CloudEvent):
+        processed.append(message.id)
+
+    consumer = service.consumers["dedup"]
+    await dedup.before_consumer_start(broker, service, consumer)
+    handler = broker.get_handler(service, consumer)
+    for _ in range(2):
+        await broker.publish_event(ce)
+        await handler(await broker.topics[ce.topic].get())
+    assert processed == [ce.id]
+    assert store.keys == {f"{service.name}:dedup:{ce.id}"}
+
+
+async def test_deduplication_postpones_message_in_flight(broker, service, ce):
+    recorder = SettleRecorder()
+    broker.add_middleware(DeduplicationMiddleware(in_flight_delay=1))
+    broker.add_middleware(recorder)
+    release = asyncio.Event()
+    processed = []
+
+    @service.subscribe("test_topic", name="dedup")
+    async def handle(message: CloudEvent):
+        await release.wait()
+        processed.append(message.id)
+
+    handler = broker.get_handler(service, service.consumers["dedup"])
+    await broker.publish_event(ce)
+    await broker.publish_event(ce)
+    first = asyncio.create_task(handler(await broker.topics[ce.topic].get()))
+    await asyncio.sleep(0)
+    await handler(await broker.topics[ce.topic].get())
+    assert recorder.settled == ["nack"]
+    release.set()
+    await first
+    assert recorder.settled == ["nack", "ack"]
+    assert processed == [ce.id]
+
+
+class FakeKeyValue:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        if not _is_key_valid(key):
+            raise InvalidKeyError(key)
+        if key not in self.data:
+            raise KeyNotFoundError()
+        return SimpleNamespace(key=key, value=self.data[key])
+
+    async def put(self, key, value):
+        if not _is_key_valid(key):
+            raise InvalidKeyError(key)
+        self.data[key] = value
+
+    async def watchall(self, **kwargs):
+        return FakeWatcher()
+
+
+class FakeWatcher:
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.Event().wait()
+
+    async def stop(self):
+        pass
+
+
+async def test_nats_kv_dedup_store_keys(service, test_consumer, ce):
+    dedup = DeduplicationMiddleware()
+    await dedup.before_consumer_start(None, service, test_consumer)
+    key = dedup.get_key(test_consumer, ce)
+    store = NatsKVDedupStore()
+    store._kv = FakeKeyValue()
+    assert not await store.contains(key)
+    await store.add_many([key], 60)
+    assert await store.contains(key)
+    assert all(_is_key_valid(k) for k in store._kv.data)
+
+
+async def test_nats_result_middleware_keys(broker, test_consumer, ce):
+    results = NatsJetStreamResultMiddleware("results")
+    results._kv = FakeKeyValue()
+    test_consumer.options["store_results"] = True
+    await results.after_process_message(broker, test_consumer, ce, {"total": 1})
+    assert all(_is_key_valid(k) for k in results._kv.data)
+    assert await results.wait_for(test_consumer, ce.id, timeout=1) == {"total": 1}
+    await results.before_broker_disconnect(broker)
+
+
+async def test_dedup_store_lookups_pipelined():
+    store = MemoryDedupStore()
+    store.keys = {"b"}
+    found = await asyncio.gather(*(store.contains(key) for key in "abca"))
+    assert found == [False, True, False, False]
+    assert store.lookups == [["a", "b", "c"]]
+
+
+class MemoryResultMiddleware(ResultMiddleware):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.data = {}
+        self.gets = 0
+        self.updates = asyncio.Queue()
+        self.watches = 0
+        self.writes = []
+        self.failures = 0
+
+    async def write_many(self, results):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError()
+        self.writes.append(len(results))
+        for key, data, _ in results:
+            self.data[key] = data
+
+    async def _get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    async def _watch(self):
+        self.watches += 1
+        self._watching.set()
+        while True:
+            key = await self.updates.get()
+            self.notify(key, self.data[key])
+
+    def store(self, key, value):
+        self.data[key] = self.encoder.encode(value)
+        self.updates.put_nowait(key)
+
+
+async def test_result_wait_for():
+    results = MemoryResultMiddleware()
+    results.store("consumer:stored", 1)
+    assert await results.wait_for("consumer", "stored", timeout=1) == 1
+
+    waiters = [results.wait_for("consumer", "id", timeout=1) for _ in range(3)]
+    waiting = asyncio.gather(*waiters)
+    await asyncio.sleep(0.01)
+    results.store("consumer:id", {"ok": True})
+    assert await waiting == [{"ok": True}] * 3
+    assert results.watches == 1
+    assert not results._waiters
+
+    gets = results.gets
+    assert await results.wait_for("consumer", "id") == {"ok": True}
+    assert results.gets == gets
+    with pytest.raises(asyncio.TimeoutError):
+        await results.wait_for("consumer", "missing", timeout=0.01)
+    await results.before_broker_disconnect(None)
+
+
+@pytest.mark.parametrize("wait_for_write", [True, False])
+async def test_result_write_behind(broker, service, wait_for_write):
+    results = MemoryResultMiddleware(
+        batch_size=3, linger=0.01, wait_for_write=wait_for_write
+    )
+    results.writer.backoff = 0.001
+    results.failures = 1
+    broker.add_middleware(results)
+
+    @service.subscribe("test_topic", name="results", store_results=True)
+    async def handle(message: CloudEvent):
+        return message.data
+
+    handler = broker.get_handler(service, service.consumers["results"])
+    for n in range(5):
+        await broker.publish_event(CloudEvent(type="Test", topic="test_topic", data=n))
+    messages = [await broker.topics["test_topic"].get() for _ in range(5)]
+    await asyncio.gather(*(handler(m) for m in messages))
+    await results.writer.flush()
+    assert results.writes == [3, 2]
+    stored = sorted(results.encoder.decode(v) for v in results.data.values())
+    assert stored == list(range(5))
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, timer=lambda: now[0])
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0.5]
+    now[0] = 0.5
+    assert bucket.acquire() == 0
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.leases = 0
+
+    async def lease(self, key, rate, burst, count):
+        self.leases += 1
+        granted = min(count, self.tokens)
+        self.tokens -= granted
+        return granted, 0 if granted else 1 / rate
+
+
+async def test_rate_limit_lease_expires():
+    now = [0.0]
+    store = MemoryRateLimitStore(tokens=10)
+    limiter = RateLimitMiddleware(store=store, lease_size=4, timer=lambda: now[0])
+    assert await limiter.acquire("key", rate=2, burst=4) == 0
+    now[0] = 1.9
+    assert await limiter.acquire("key", rate=2, burst=4) == 0
+    assert store.leases == 1
+    # 2 leased tokens left, expired after 4 / 2 seconds
+    now[0] = 2.0
+    assert await limiter.acquire("key", rate=2, burst=4) == 0
+    assert store.leases == 2
+
+
+async def test_prometheus_postponed_messages(
+    broker, service, test_consumer, ce, registry
+):
+    prometheus = PrometheusMiddleware(registry=registry)
+    broker.add_middleware(prometheus)
+    broker.add_middleware(RateLimitMiddleware())
+    test_consumer.options["rate_limit"] = 1
+    await prometheus.after_consumer_start(broker, service, test_consumer)
+    handler = broker.get_handler(service, test_consumer)
+    for _ in range(5):
+        await broker.publish_event(ce)
+    await asyncio.gather(
+        *[handler(await broker.topics[ce.topic].get()) for _ in range(5)]
+    )
+    assert get_sample(registry, "messages_total", test_consumer) == 1
+    assert get_sample(registry, "messages_in_progress", test_consumer) == 0
+
+
+@pytest.mark.parametrize("store", [None, MemoryRateLimitStore(tokens=2)])
+async def test_rate_limit_middleware(broker, service, ce, store):
+    recorder = SettleRecorder()
+    broker.add_middleware(RateLimitMiddleware(store=store, lease_size=5))
+    broker.add_middleware(recorder)
+    processed = []
+
+    @service.subscribe("test_topic", name="limited", rate_limit=100, rate_burst=2)
+    async def handle(message: CloudEvent):
+        processed.append(message.delivery_count)
+
+    handler = broker.get_handler(service, service.consumers["limited"])
+    for _ in range(3):
+        await broker.publish_event(ce)
+    await asyncio.gather(
+        *[handler(await broker.topics[ce.topic].get()) for _ in range(3)]
+    )
+    assert processed == [1, 1]
+    assert sorted(recorder.settled) == ["ack", "ack", "nack"]
+    if store:
+        assert store.leases == 2
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from asvc import CloudEvent
+from asvc.backends.stub import StubBroker
+from asvc.outbox import Outbox, Segment
+
+
+class FlakyBroker(StubBroker):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.up = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self.up
+
+    async def _publish(self, message, **kwargs):
+        if not self.up:
+            raise ConnectionError()
+        await super()._publish(message, **kwargs)
+
+
+def test_segment(tmp_path):
+    path = str(tmp_path / "0.seg")
+    segment = Segment(path, 64)
+    assert segment.append(b"first")
+    assert segment.append(b"second")
+    assert not segment.append(b"x" * 64)
+    data, offset = segment.read(segment.read_offset)
+    segment.commit(offset)
+    segment.close()
+
+    segment = Segment(path, 64)
+    assert segment.read(segment.read_offset)[0] == b"second"
+    assert segment.pending
+    segment.remove()
+
+
+@pytest.mark.asyncio
+async def test_outbox_replay(tmp_path):
+    broker = FlakyBroker(outbox=Outbox(str(tmp_path), replay_interval=0.01))
+    events = [CloudEvent(type="Test", topic=f"topic{n % 2}", data=n) for n in range(6)]
+    await broker.publish_event(events[0])
+    broker.up = True
+    for event in events[1:]:
+        await broker.publish_event(event)
+    # topic0 events wait for the stored one
+    assert len(broker.outbox) == 3
+    assert broker.topics["topic1"].qsize() == 3
+
+    await broker.outbox.replay()
+    assert not len(broker.outbox)
+    assert not list(tmp_path.glob("*.seg"))
+    received = [
+        broker.decode_message(broker.topics["topic0"].get_nowait().data)["data"]
+        for _ in range(3)
+    ]
+    assert received == [0, 2, 4]
+    await broker.outbox.stop()
+
+
+@pytest.mark.asyncio
+async def test_outbox_restore(tmp_path):
+    broker = FlakyBroker(outbox=Outbox(str(tmp_path)))
+    for n in range(3):
+        await broker.publish_event(CloudEvent(type="Test", topic="test", data=n))
+    await broker.outbox.stop()
+    assert list(tmp_path.glob("*.seg"))
+
+    broker = FlakyBroker(outbox=Outbox(str(tmp_path), replay_interval=0.01))
+    broker.up = True
+    broker.outbox.start(broker)
+    assert len(broker.outbox) == 3
+    assert broker.outbox.is_pending("test")
+    await asyncio.sleep(0.1)
+    assert broker.topics["test"].qsize() == 3
+    await broker.outbox.stop()
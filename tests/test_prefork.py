@@ -0,0 +1,43 @@
+import signal
+import sys
+import time
+
+import pytest
+
+from asvc.prefork import PreforkRunner
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="fork required")
+
+
+class SleepingRunner:
+    def run(self, use_uvloop: bool = False, **kwargs) -> None:
+        signal.pause()
+
+
+class FailingRunner:
+    def run(self, use_uvloop: bool = False, **kwargs) -> None:
+        sys.exit(1)
+
+
+def test_prefork_runner_starts_and_stops_workers():
+    runner = PreforkRunner(SleepingRunner(), workers=2, shutdown_timeout=5)
+    runner.start()
+    try:
+        assert all(w.is_alive for w in runner.workers)
+        assert len({w.process.pid for w in runner.workers}) == 2
+    finally:
+        runner.stop()
+    assert not any(w.is_alive for w in runner.workers)
+
+
+def test_prefork_runner_restarts_worker_with_backoff():
+    runner = PreforkRunner(
+        FailingRunner(), workers=1, restart_delay=0.05, shutdown_timeout=1
+    )
+    runner.start()
+    deadline = time.monotonic() + 5
+    while runner.workers[0].restarts < 3 and time.monotonic() < deadline:
+        runner.supervise(timeout=0.1)
+    runner.stop()
+    worker = runner.workers[0]
+    assert worker.restarts >= 3
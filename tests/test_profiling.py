@@ -0,0 +1,43 @@
+import json
+import pstats
+import sys
+
+import pytest
+
+from asvc.profiling import Profiler
+
+
+@pytest.mark.parametrize(
+    "mode,filename",
+    [
+        ("cprofile", "profile.prof"),
+        pytest.param(
+            "sampling",
+            "profile.speedscope.json",
+            marks=pytest.mark.skipif(sys.platform == "win32", reason="SIGPROF"),
+        ),
+    ],
+)
+@pytest.mark.parametrize("handler_only", [False, True])
+async def test_profiler(
+    service, test_consumer, ce, tmp_path, mode, filename, handler_only
+):
+    for _ in range(10):
+        await service.publish_event(ce)
+    profiler = Profiler(
+        mode=mode, out_dir=str(tmp_path), handler_only=handler_only, interval=0.0001
+    )
+    processed, files = await profiler.run([service], duration=5, max_messages=10)
+
+    assert processed == 10
+    assert sorted(files) == sorted(
+        [str(tmp_path / filename), str(tmp_path / "memory.txt")]
+    )
+    assert (tmp_path / "memory.txt").read_text()
+    if mode == "cprofile":
+        stats = pstats.Stats(str(tmp_path / filename))
+        assert any(f[2] == "process" for f in stats.stats)  # type: ignore
+    else:
+        profile = json.loads((tmp_path / filename).read_text())
+        assert profile["profiles"][0]["type"] == "sampled"
+    assert "get_handler" not in vars(service.broker)
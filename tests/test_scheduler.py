@@ -0,0 +1,112 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from asvc import CloudEvent, Service
+from asvc.backends.memory import InMemoryBroker
+from asvc.backends.rabbitmq.broker import get_delay_bucket
+from asvc.backends.stub import StubBroker
+from asvc.middleware import Middleware
+from asvc.scheduler import Scheduler, TimerWheel
+
+
+@pytest.mark.parametrize("slots, levels", [(256, 4), (4, 2)])
+def test_timer_wheel_expires_in_order(slots, levels):
+    wheel = TimerWheel(resolution=1, slots=slots, levels=levels, now=0)
+    dues = random.sample(range(1, 2000), 300)
+    for due in dues:
+        wheel.add(due, due)
+    assert len(wheel) == 300
+    fired = []
+    for now in range(0, 2007, 7):
+        expired = wheel.advance(now)
+        assert all(due <= now for due in expired)
+        assert all(due > now - 7 for due in expired)
+        fired.extend(expired)
+    assert sorted(fired) == sorted(dues)
+    assert not len(wheel)
+
+
+def test_timer_wheel_past_due():
+    wheel = TimerWheel(resolution=1, now=100)
+    wheel.add(50, "late")
+    assert wheel.advance(100) == ["late"]
+
+
+@pytest.mark.parametrize(
+    "delay, bucket", [(0.2, 1), (7, 7), (11.5, 12), (123, 130), (3599, 3600)]
+)
+def test_delay_bucket(delay, bucket):
+    assert get_delay_bucket(delay) == bucket
+
+
+@pytest.mark.asyncio
+async def test_delayed_publish():
+    broker = StubBroker(scheduler=Scheduler(resolution=0.01))
+    service = Service(name="test", broker=broker)
+    received = []
+
+    @service.subscribe("orders")
+    async def handle(message: CloudEvent):
+        received.append((message.data, time.monotonic()))
+
+    await service.start()
+    start = time.monotonic()
+    await service.publish("orders", 2, delay=0.1)
+    await service.publish("orders", 1, delay=0.05)
+    await service.publish("orders", 0)
+    await asyncio.sleep(0.2)
+    await service.stop()
+    assert [data for data, _ in received] == [0, 1, 2]
+    assert received[1][1] - start >= 0.05
+    assert received[2][1] - start >= 0.1
+
+
+class PublishedMiddleware(Middleware):
+    def __init__(self):
+        self.published = []
+
+    async def after_publish(self, broker, message, *args, **kwargs):
+        self.published.append(message.data)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_persistence(tmp_path):
+    path = str(tmp_path / "scheduled.jsonl")
+    published = PublishedMiddleware()
+    broker = InMemoryBroker(
+        middlewares=[published], scheduler=Scheduler(resolution=0.01, path=path)
+    )
+    await broker.connect()
+    await broker.publish("orders", {"id": 1}, delay=0.02)
+    await broker.publish("orders", {"id": 2}, delay=60)
+    await asyncio.sleep(0.1)
+    await broker.disconnect()
+    assert published.published == [{"id": 1}]
+
+    restored = Scheduler(resolution=0.01, path=path)
+    broker = InMemoryBroker(scheduler=restored)
+    await broker.connect()
+    assert len(restored) == 1
+    await broker.disconnect()
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_persists_publish_options(tmp_path):
+    path = str(tmp_path / "scheduled.jsonl")
+    scheduler = Scheduler(path=path)
+    scheduler.start(StubBroker())
+    scheduler.schedule(CloudEvent(topic="orders"), time.time() + 60, delivery="remote")
+    with pytest.raises(ValueError):
+        scheduler.schedule(CloudEvent(topic="orders"), time.time() + 60, key=object())
+    await scheduler.stop()
+
+    restored = Scheduler(path=path)
+    restored.start(StubBroker())
+    (timer,) = restored._wheel.advance(time.time() + 120)
+    assert timer[2] == {"delivery": "remote"}
+    await restored.stop()
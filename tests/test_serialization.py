@@ -0,0 +1,145 @@
+import json
+from datetime import date
+from typing import Dict, List, Optional
+
+import pytest
+from pydantic import BaseModel, Field
+
+from asvc import CloudEvent
+from asvc.backends.stub import StubBroker
+from asvc.encoders.json import JsonEncoder
+from asvc.encoders.msgpack import MsgPackEncoder
+from asvc.encoders.orjson import OrjsonEncoder
+from asvc.models import ContentMode
+from asvc.serialization import get_serializer
+from asvc.validation import ValidationMode, get_validator
+
+
+@pytest.mark.parametrize("content_mode", (ContentMode.structured, ContentMode.binary))
+def test_encode_decode_message(ce, content_mode):
+    broker = StubBroker(content_mode=content_mode)
+    data, headers = broker.encode_message(ce)
+    assert headers["Content-Type"] == broker.encoder.CONTENT_TYPE
+    decoded = CloudEvent.parse_obj(broker.decode_message(data, headers))
+    assert decoded.dict() == ce.dict()
+
+
+def test_binary_mode_headers(ce):
+    broker = StubBroker(content_mode="binary")
+    data, headers = broker.encode_message(ce)
+    assert broker.encoder.decode(data) == ce.data
+    assert headers["ce-id"] == ce.id
+    assert headers["ce-subject"] == ce.topic
+    assert headers["ce-time"] == ce.time.isoformat()
+    assert "ce-data" not in headers
+
+
+def test_binary_mode_extension_attributes():
+    broker = StubBroker(content_mode=ContentMode.binary)
+    ce = CloudEvent(topic="test_topic", partitionkey="key")
+    data, headers = broker.encode_message(ce)
+    assert data == b""
+    assert headers["ce-partitionkey"] == "key"
+    decoded = CloudEvent.parse_obj(broker.decode_message(data, headers))
+    assert decoded.partitionkey == "key"
+    assert decoded.data is None
+
+
+class Payload(BaseModel):
+    counter: int
+    created: date
+
+
+class PayloadEvent(CloudEvent):
+    data: Payload
+
+
+def test_cloud_event_subclass_type():
+    assert PayloadEvent.__fields__["type"].default == "PayloadEvent"
+
+    class Named(CloudEvent, type="custom.type"):
+        pass
+
+    assert Named(topic="test_topic").type == "custom.type"
+
+
+def test_serializer_matches_pydantic_dict():
+    ce = PayloadEvent(topic="test_topic", data={"counter": 1, "created": date.today()})
+    serialized = get_serializer(PayloadEvent).to_dict(ce)
+    assert serialized["type"] == "PayloadEvent"
+    assert serialized["time"] == ce.time.isoformat()
+    assert serialized["data"] == ce.data.dict()
+    assert "source" not in serialized
+    assert "datacontenttype" not in serialized
+    assert PayloadEvent.parse_obj(serialized) == ce
+    assert get_serializer(PayloadEvent) is get_serializer(PayloadEvent)
+
+
+@pytest.mark.parametrize("encoder", (JsonEncoder, OrjsonEncoder, MsgPackEncoder))
+def test_serializer_encode(encoder):
+    ce = PayloadEvent(topic="test_topic", data={"counter": 1, "created": date.today()})
+    encoded = get_serializer(PayloadEvent).encode(ce, encoder)
+    assert PayloadEvent.parse_obj(encoder.decode(encoded)) == ce
+
+
+def test_compact_time(ce):
+    broker = StubBroker(compact_time=True)
+    data, headers = broker.encode_message(ce)
+    decoded = broker.decode_message(data, headers)
+    assert decoded["time"] == int(ce.time.timestamp() * 1000)
+    parsed = CloudEvent.parse_obj(decoded)
+    assert abs((parsed.time - ce.time).total_seconds()) < 0.001
+
+
+class Aliased(BaseModel):
+    order_id: int = Field(alias="orderId")
+
+
+class AliasedEvent(CloudEvent):
+    data: Dict[str, List[Aliased]]
+
+
+def test_nested_models_keep_aliases():
+    ce = AliasedEvent(topic="test_topic", data={"orders": [Aliased(orderId=1)]})
+    assert get_serializer(AliasedEvent).to_dict(ce)["data"] == {
+        "orders": [{"orderId": 1}]
+    }
+    broker = StubBroker(content_mode=ContentMode.binary)
+    data, _ = broker.encode_message(ce)
+    assert broker.encoder.decode(data) == {"orders": [{"orderId": 1}]}
+
+
+def test_binary_mode_json_extension_attributes():
+    broker = StubBroker(content_mode=ContentMode.binary)
+    ce = CloudEvent(topic="test_topic", tags=["a", "b"], meta={"k": 1})
+    _, headers = broker.encode_message(ce)
+    assert json.loads(headers["ce-tags"]) == ["a", "b"]
+    assert json.loads(headers["ce-meta"]) == {"k": 1}
+
+
+class TaggedEvent(CloudEvent):
+    tags: List[str] = []
+    meta: Dict[str, int] = {}
+    aliased: Optional[Aliased] = None
+    label: str = ""
+
+
+@pytest.mark.parametrize("validation", list(ValidationMode))
+def test_binary_mode_structured_extension_roundtrip(validation):
+    broker = StubBroker(content_mode=ContentMode.binary)
+    ce = TaggedEvent(
+        topic="test_topic",
+        tags=["a", "b"],
+        meta={"k": 1},
+        aliased=Aliased(orderId=1),
+        label="[not json",
+    )
+    data, headers = broker.encode_message(ce)
+    decoded = get_validator(TaggedEvent, validation)(
+        broker.decode_message(data, headers)
+    )
+    assert decoded.tags == ["a", "b"]
+    assert decoded.meta == {"k": 1}
+    assert decoded.label == "[not json"
+    if validation != ValidationMode.trusted:
+        assert decoded == ce
@@ -20,3 +20,33 @@ async def test_service_scope(running_service: Service, ce):
     decoded = running_service.broker.encoder.decode(msg.data)
     ce2 = CloudEvent.parse_obj(decoded)
     assert ce.dict() == ce2.dict()
+
+
+async def test_service_stop_drains_messages(service: Service, ce):
+    processed = []
+
+    @service.subscribe(ce.topic, name="slow_consumer")
+    async def slow_handler(message: CloudEvent):
+        await asyncio.sleep(0.05)
+        processed.append(message.id)
+
+    await service.start()
+    await service.publish_event(ce)
+    await asyncio.sleep(0.01)
+    assert service.broker.in_flight() == 1
+    await service.stop()
+    assert processed == [ce.id]
+    assert service.broker.in_flight() == 0
+    assert not service.broker.is_consuming
+
+
+async def test_drain_timeout(service: Service, ce):
+    @service.subscribe(ce.topic, name="blocked_consumer")
+    async def blocked_handler(message: CloudEvent):
+        await asyncio.sleep(0.2)
+
+    await service.start()
+    await service.publish_event(ce)
+    await asyncio.sleep(0.01)
+    assert await service.broker.drain(timeout=0.01) == 1
+    await service.stop()
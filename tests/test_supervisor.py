@@ -0,0 +1,79 @@
+import asyncio
+
+from asvc import CloudEvent, Service
+from asvc.backends.stub import StubBroker
+from asvc.middlewares import HealthCheckMiddleware
+from asvc.supervisor import ConsumerSupervisor
+
+
+class FlakyBroker(StubBroker):
+    def __init__(self, failures: int, **options):
+        super().__init__(**options)
+        self.failures = failures
+        self.started = 0
+
+    async def _start_consumer(self, service, consumer):
+        self.started += 1
+        if self.started <= self.failures:
+            raise ConnectionError("Consumer failed")
+        await super()._start_consumer(service, consumer)
+
+
+def make_service(broker: StubBroker, **options) -> Service:
+    service = Service(
+        broker=broker,
+        name="supervised_service",
+        supervisor=ConsumerSupervisor(initial_delay=0.01, **options),
+    )
+
+    @service.subscribe("test_topic", name="test_consumer")
+    async def handler(message: CloudEvent):
+        pass
+
+    return service
+
+
+async def test_supervisor_restarts_failed_consumer():
+    healthcheck = HealthCheckMiddleware()
+    broker = FlakyBroker(failures=2, middlewares=[healthcheck])
+    service = make_service(broker)
+    await healthcheck.after_broker_connect(broker)
+    await service.start()
+    await asyncio.sleep(0.1)
+    consumer = service.consumers["test_consumer"]
+    assert broker.started == 3
+    assert service.supervisor.restarts["test_consumer"] == 2
+    assert service.supervisor.is_alive(consumer)
+    assert healthcheck.get_health_status()
+    await service.stop()
+
+
+async def test_supervisor_reports_dead_consumer_to_healthcheck():
+    healthcheck = HealthCheckMiddleware()
+    broker = FlakyBroker(failures=10, middlewares=[healthcheck])
+    service = make_service(broker, max_restarts=1)
+    await healthcheck.after_broker_connect(broker)
+    await service.start()
+    await asyncio.sleep(0.1)
+    assert broker.started == 2
+    assert not service.supervisor.get_health_status()
+    assert not healthcheck.get_health_status()
+    await service.stop()
+
+
+async def test_healthcheck_registers_restarted_service_once():
+    healthcheck = HealthCheckMiddleware()
+    broker = FlakyBroker(failures=0, middlewares=[healthcheck])
+    service = make_service(broker)
+    await healthcheck.after_broker_connect(broker)
+    for _ in range(3):
+        await service.start()
+        await service.stop()
+    assert len(healthcheck._services) == 1
+
+
+def test_supervisor_backoff_with_jitter():
+    supervisor = ConsumerSupervisor(initial_delay=1, max_delay=10, jitter=0.5)
+    for attempt, expected in [(0, 1), (1, 2), (3, 8), (10, 10)]:
+        delay = supervisor.get_delay(attempt)
+        assert expected * 0.5 <= delay <= expected
@@ -0,0 +1,66 @@
+import time
+import uuid
+
+import pytest
+
+from asvc import CloudEvent
+from asvc.utils import str_uuid
+from asvc.utils.cache import BloomFilter, TTLCache
+from asvc.utils.ids import (
+    ULIDGenerator,
+    UUID7Generator,
+    id_timestamp_ms,
+    set_id_generator,
+)
+
+
+@pytest.mark.parametrize("generator", (UUID7Generator, ULIDGenerator))
+def test_time_ordered_ids(generator):
+    generate = generator(batch_size=16)
+    now = time.time_ns() // 1_000_000
+    ids = [generate() for _ in range(1000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert abs(id_timestamp_ms(ids[0]) - now) < 1000
+
+
+def test_uuid7_format():
+    value = uuid.UUID(UUID7Generator()())
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+
+
+def test_set_id_generator():
+    set_id_generator(UUID7Generator())
+    try:
+        ce = CloudEvent(topic="test_topic")
+        assert uuid.UUID(ce.id).version == 7
+        assert uuid.UUID(ce.trace_id).version == 7
+    finally:
+        set_id_generator(str_uuid)
+
+
+def test_ttl_cache():
+    now = [0.0]
+    cache = TTLCache(max_size=2, ttl=10, timer=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    now[0] = 10
+    assert "a" not in cache
+    assert len(cache) == 1
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01, max_filters=2)
+    keys = [str(n) for n in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(str(n) in bloom for n in range(1000, 11000))
+    assert false_positives < 200
+    for n in range(2000, 4001):
+        bloom.add(str(n))
+    assert len(bloom._filters) == 2